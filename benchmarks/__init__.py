@@ -0,0 +1,20 @@
+"""
+CSPGen benchmark suite.
+
+Generates synthetic INI configs of a configurable size, times each phase of turning them into a CSP
+(config parsing, marker resolution, de-duplication, and rendering), and writes the results as JSON so that
+two runs (e.g. before and after upgrading) can be compared.
+
+Run it from the root of the repo::
+
+    # Benchmark a config with 500 groups nested up to 6 levels deep, and save the results
+    python3 -m benchmarks --groups 500 --depth 6 --hosts 30 -o before.json
+    # ... upgrade / change cspgen ...
+    # Compare against the previous results, exiting non-zero if any phase is more than 10% slower
+    python3 -m benchmarks --groups 500 --depth 6 --hosts 30 -o after.json --compare before.json --threshold 10
+    # Check that 'import privex.cspgen' stays under 100ms, and doesn't load any CLI-only dependencies
+    python3 -m benchmarks.imports --budget-ms 100
+
+"""
+from benchmarks.generator import ConfigParams, generate_config
+from benchmarks.runner import run_benchmarks, compare_results
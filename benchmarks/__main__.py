@@ -0,0 +1,75 @@
+"""
+Command line interface for the CSPGen benchmark suite - see ``python3 -m benchmarks --help``
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks.generator import ConfigParams, generate_config
+from benchmarks.runner import compare_results, run_benchmarks
+
+_defs = ConfigParams()
+
+parser = argparse.ArgumentParser(
+    prog='python3 -m benchmarks', description="Benchmark CSPGen against a synthetic config of a configurable size"
+)
+parser.add_argument('--groups', type=int, default=_defs.groups, help="Number of groups in [groups]")
+parser.add_argument('--depth', type=int, default=_defs.depth, help="How many levels deep groups are nested")
+parser.add_argument('--hosts', type=int, default=_defs.hosts, help="Number of hosts defined directly within each group")
+parser.add_argument('--directives', type=int, default=_defs.directives, help="Number of directive sections")
+parser.add_argument('--dup-ratio', type=float, default=_defs.dup_ratio, dest='dup_ratio',
+                    help="Fraction (0.0 - 1.0) of hosts drawn from a shared pool, i.e. duplicated between groups")
+parser.add_argument('--refs', type=int, default=_defs.refs, help="Number of {{markers}} per nested group / directive")
+parser.add_argument('--seed', type=int, default=_defs.seed, help="Random seed used when generating the config")
+parser.add_argument('--repeat', '-r', type=int, default=5, help="Number of times to run each phase")
+parser.add_argument('--output', '-o', type=str, default=None, help="Write the JSON results to this file")
+parser.add_argument('--compare', '-c', type=str, default=None, help="Compare the results against this JSON results file")
+parser.add_argument('--metric', type=str, default='median', choices=['min', 'median', 'mean', 'max'],
+                    help="Which timing to use when comparing results")
+parser.add_argument('--threshold', '-t', type=float, default=None,
+                    help="With --compare, exit with status 2 if any phase is more than this many percent slower")
+parser.add_argument('--dump-config', type=str, default=None, dest='dump_config',
+                    help="Write the generated INI config to this file (use '-' for stdout) and exit")
+
+
+def main():
+    vargs = parser.parse_args()
+    params = ConfigParams(
+        groups=vargs.groups, depth=vargs.depth, hosts=vargs.hosts, directives=vargs.directives,
+        dup_ratio=vargs.dup_ratio, refs=vargs.refs, seed=vargs.seed,
+    )
+    if vargs.dump_config:
+        ini = generate_config(params)
+        if vargs.dump_config == '-':
+            print(ini)
+        else:
+            Path(vargs.dump_config).write_text(ini)
+        return 0
+
+    res = run_benchmarks(params, repeat=vargs.repeat)
+    meta = res['meta']
+    print(f"cspgen v{meta['cspgen_version']} on Python {meta['python']} - config: {meta['config_bytes']} bytes, "
+          f"header: {meta['header_bytes']} bytes", file=sys.stderr)
+    print(f"params: {meta['params']}", file=sys.stderr)
+    for phase, r in res['results'].items():
+        print(f"{phase:>10}: min {r['min']:10.3f} ms   median {r['median']:10.3f} ms   max {r['max']:10.3f} ms",
+              file=sys.stderr)
+
+    if vargs.output:
+        with open(vargs.output, 'w') as fh:
+            json.dump(res, fh, indent=4)
+
+    if vargs.compare:
+        with open(vargs.compare) as fh:
+            old = json.load(fh)
+        lines, regressed = compare_results(old, res, threshold=vargs.threshold, metric=vargs.metric)
+        print(f"\nComparison against {vargs.compare} ({vargs.metric}):", file=sys.stderr)
+        print("\n".join(lines), file=sys.stderr)
+        if regressed:
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
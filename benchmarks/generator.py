@@ -0,0 +1,82 @@
+"""
+Synthetic large-config generator, used to produce INI files for benchmarking CSPGen.
+"""
+import random
+from typing import List, NamedTuple
+
+__all__ = ['CSP_DIRECTIVES', 'ConfigParams', 'generate_config']
+
+CSP_DIRECTIVES = [
+    'default-src', 'script-src', 'style-src', 'img-src', 'font-src', 'connect-src', 'media-src', 'object-src',
+    'frame-src', 'child-src', 'worker-src', 'manifest-src', 'form-action', 'frame-ancestors', 'base-uri',
+    'prefetch-src', 'script-src-elem', 'script-src-attr', 'style-src-elem', 'style-src-attr',
+]
+
+
+class ConfigParams(NamedTuple):
+    """The size / shape of a synthetic config generated by :func:`.generate_config`"""
+    groups: int = 200
+    """Total number of groups in ``[groups]``"""
+    depth: int = 5
+    """Number of nesting levels - groups at level N include ``{{markers}}`` for groups at level N-1"""
+    hosts: int = 20
+    """Number of hosts defined directly within each group"""
+    directives: int = 10
+    """Number of directive sections (e.g. ``[default-src]``)"""
+    dup_ratio: float = 0.3
+    """Fraction (0.0 - 1.0) of each group's hosts which are drawn from a shared pool, and thus duplicated between groups"""
+    refs: int = 3
+    """Number of ``{{markers}}`` each nested group / directive includes"""
+    seed: int = 1234
+    """Seed for the random generator, so that identical params always produce an identical config"""
+
+
+def _directive_name(i: int) -> str:
+    if i < len(CSP_DIRECTIVES):
+        return CSP_DIRECTIVES[i]
+    return f"x-bench-{i}-src"
+
+
+def generate_config(params: ConfigParams = ConfigParams()) -> str:
+    """
+    Generate a synthetic CSPGen INI config as a string, based on ``params``.
+
+        >>> ini = generate_config(ConfigParams(groups=50, depth=3))
+        >>> builder = CSPBuilder(contents=ini)
+
+    """
+    rnd = random.Random(params.seed)
+    depth = max(1, params.depth)
+    shared_pool = [f"https://shared{i}.example.com" for i in range(max(1, params.hosts * 4))]
+    levels: List[List[str]] = [[] for _ in range(depth)]
+    lines = ['[groups]']
+    uniq = 0
+
+    for g in range(params.groups):
+        lvl = g * depth // max(1, params.groups)
+        name = f"group{g}"
+        hosts = []
+        for _ in range(params.hosts):
+            if rnd.random() < params.dup_ratio:
+                hosts.append(rnd.choice(shared_pool))
+            else:
+                uniq += 1
+                hosts.append(f"https://h{uniq}.g{g}.example.net")
+        # Nest this group within the level below it (if there is one yet)
+        below = levels[lvl - 1] if lvl > 0 else []
+        refs = rnd.sample(below, min(params.refs, len(below)))
+        lines.append(f"{name} = " + ' '.join(hosts + ['{{' + r + '}}' for r in refs]))
+        levels[lvl].append(name)
+
+    top = [g for lvl in reversed(levels) for g in lvl][:max(params.refs * 4, 1)]
+    for d in range(params.directives):
+        refs = rnd.sample(top, min(params.refs, len(top)))
+        lines += [
+            '', f"[{_directive_name(d)}]",
+            "zones = 'self' " + ' '.join('{{' + r + '}}' for r in refs) + f" {rnd.choice(shared_pool)}",
+        ]
+        if d % 3 == 0: lines.append("unsafe-inline = true")
+        if d % 5 == 0: lines.append("unsafe-eval = true")
+
+    lines += ['', '[flags]', 'flags = upgrade-insecure-requests block-all-mixed-content', '']
+    return "\n".join(lines)
@@ -0,0 +1,78 @@
+"""
+Measures how long ``import privex.cspgen`` takes in a fresh interpreter, and checks that importing the library
+doesn't load any of the CLI / terminal dependencies.
+
+Used as a gate in CI - exits with status 2 if the import time is over budget, or a CLI-only module was imported::
+
+    python3 -m benchmarks.imports --budget-ms 100
+
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+__all__ = ['CLI_ONLY_MODULES', 'measure_import', 'check_import']
+
+CLI_ONLY_MODULES = ['argparse', 'rich', 'colorama', 'privex.helpers', 'privex.loghelper', 'concurrent.futures.process']
+"""Modules which must only be imported when the CLI is used - never by ``import privex.cspgen``"""
+
+_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{'ms': elapsed, 'loaded': [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str = 'privex.cspgen', repeat: int = 5, forbidden: List[str] = None) -> Dict[str, object]:
+    """
+    Import ``module`` in ``repeat`` fresh interpreters, returning min/median/max import time in milliseconds,
+    plus the list of ``forbidden`` modules (default: :data:`.CLI_ONLY_MODULES`) which were loaded by the import.
+    """
+    forbidden = CLI_ONLY_MODULES if forbidden is None else forbidden
+    runs, loaded = [], set()
+    code = _SNIPPET.format(module=module, forbidden=list(forbidden))
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        runs.append(res['ms'])
+        loaded.update(res['loaded'])
+    return dict(
+        min=min(runs), median=statistics.median(runs), mean=statistics.mean(runs), max=max(runs), runs=len(runs),
+        loaded=sorted(loaded),
+    )
+
+
+def check_import(budget_ms: float, module: str = 'privex.cspgen', repeat: int = 5) -> List[str]:
+    """Return a list of problems (empty if none) - the import's median time being over ``budget_ms``, or CLI modules being loaded"""
+    res = measure_import(module, repeat)
+    problems = []
+    if res['median'] > budget_ms:
+        problems.append(f"Importing {module} took {res['median']:.2f} ms (median) - over the budget of {budget_ms:.2f} ms")
+    if res['loaded']:
+        problems.append(f"Importing {module} loaded CLI-only modules: {', '.join(res['loaded'])}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks.imports', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=100.0, dest='budget_ms', help="Maximum median import time in milliseconds")
+    parser.add_argument('--module', type=str, default='privex.cspgen', help="The module to import")
+    parser.add_argument('--repeat', '-r', type=int, default=5, help="Number of fresh interpreters to time the import in")
+    vargs = parser.parse_args()
+    problems = check_import(vargs.budget_ms, vargs.module, vargs.repeat)
+    for p in problems:
+        print(f"FAIL: {p}", file=sys.stderr)
+    if problems:
+        return 2
+    print(f"OK: importing {vargs.module} is within the budget of {vargs.budget_ms:.2f} ms, and loads no CLI-only modules",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
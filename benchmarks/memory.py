@@ -0,0 +1,58 @@
+"""
+Measures how much memory each compiled :class:`.CSPBuilder` keeps alive, using :mod:`tracemalloc`.
+
+    python3 -m benchmarks.memory --groups 200 --count 500
+
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from typing import Dict
+
+from privex.cspgen.builder import CSPBuilder
+
+from benchmarks.generator import ConfigParams, generate_config
+
+__all__ = ['measure_builder_memory']
+
+
+def measure_builder_memory(ini: str, count: int = 100) -> Dict[str, float]:
+    """
+    Compile ``count`` separate builders from the INI string ``ini`` and keep them all alive, returning the memory
+    retained per builder (and in total) in bytes, plus the peak memory used while compiling them.
+    """
+    CSPBuilder(contents=ini).compile()  # Warm up any module level caches, so they aren't counted against the builders
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        builders = [CSPBuilder(contents=ini) for _ in range(count)]
+        for b in builders:
+            b.compile()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    retained = current - before
+    return dict(per_builder=retained / count, total=retained, peak=peak - before, count=count)
+
+
+def main():
+    defs = ConfigParams()
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks.memory', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--groups', type=int, default=defs.groups, help="Number of groups in [groups]")
+    parser.add_argument('--depth', type=int, default=defs.depth, help="How many levels deep groups are nested")
+    parser.add_argument('--hosts', type=int, default=defs.hosts, help="Number of hosts defined directly within each group")
+    parser.add_argument('--directives', type=int, default=defs.directives, help="Number of directive sections")
+    parser.add_argument('--count', '-n', type=int, default=100, help="Number of builders to keep alive")
+    vargs = parser.parse_args()
+    params = defs._replace(groups=vargs.groups, depth=vargs.depth, hosts=vargs.hosts, directives=vargs.directives)
+    res = measure_builder_memory(generate_config(params), vargs.count)
+    print(f"{res['count']} builders: {res['per_builder'] / 1024:.1f} KiB retained per builder, "
+          f"{res['total'] / 1024 / 1024:.2f} MiB total, {res['peak'] / 1024 / 1024:.2f} MiB peak", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
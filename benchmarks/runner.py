@@ -0,0 +1,116 @@
+"""
+Times each phase of compiling a CSPGen config, and compares results between runs.
+"""
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+from privex.cspgen import version
+from privex.cspgen.builder import CSPBuilder
+from privex.cspgen.helpers import MarkerResolver, dedup_dict
+
+from benchmarks.generator import ConfigParams, generate_config
+
+__all__ = ['PHASES', 'time_phase', 'run_benchmarks', 'compare_results']
+
+PHASES = ['import', 'parse', 'resolve', 'dedup', 'clean', 'render', 'generate']
+
+
+def time_phase(setup: Callable[[], object], func: Callable[[object], object], repeat: int) -> Dict[str, float]:
+    """
+    Run ``setup()`` followed by a timed ``func(setup_result)`` ``repeat`` times, returning min/median/mean/max
+    timings in milliseconds.
+    """
+    runs = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        runs.append((time.perf_counter() - start) * 1000)
+    return dict(
+        min=min(runs), median=statistics.median(runs), mean=statistics.mean(runs), max=max(runs), runs=len(runs)
+    )
+
+
+def _expanded_sections(ini: str) -> List[Dict[str, str]]:
+    """Return each section with it's markers replaced, but without de-duplication (the input to the dedup phase)"""
+    b = CSPBuilder(contents=ini)
+    resolver = MarkerResolver(b.config['groups'])
+    return [{k: resolver.expand(v) for k, v in b.config[s].items()} for s in b.clean_sections]
+
+
+def run_benchmarks(params: ConfigParams = ConfigParams(), repeat: int = 5) -> dict:
+    """
+    Generate a synthetic config using ``params``, then time each phase of compiling it ``repeat`` times:
+
+     - ``import``   - ``import privex.cspgen`` in a fresh interpreter
+     - ``parse``    - reading the INI into a :class:`.CSPBuilder` (see :mod:`privex.cspgen.loader`)
+     - ``resolve``  - resolving the ``{{markers}}`` in ``[groups]`` using :class:`.MarkerResolver`
+     - ``dedup``    - de-duplicating every (already expanded) section value using :func:`.dedup_dict`
+     - ``clean``    - the whole of :meth:`.CSPBuilder.clean`
+     - ``render``   - rendering a cleaned builder into a :class:`.CompiledPolicy` via :meth:`.CSPBuilder.compile`
+     - ``generate`` - ``str(builder)`` on an already compiled builder (the cached path)
+
+    :return dict results: ``{'meta': {...}, 'results': {phase: {'min': ms, 'median': ms, ...}}}``
+    """
+    ini = generate_config(params)
+    builder = CSPBuilder(contents=ini)
+    cleaned = lambda: CSPBuilder(contents=ini).clean()
+    compiled = CSPBuilder(contents=ini)
+    compiled.compile()
+
+    phases: Dict[str, Tuple[Callable, Callable]] = {
+        'parse': (lambda: ini, lambda c: CSPBuilder(contents=c)),
+        'resolve': (lambda: builder.config['groups'], lambda g: MarkerResolver(g)),
+        'dedup': (lambda: _expanded_sections(ini), lambda secs: [dedup_dict(s) for s in secs]),
+        'clean': (lambda: CSPBuilder(contents=ini), lambda b: b.clean()),
+        'render': (cleaned, lambda b: b.compile()),
+        'generate': (lambda: compiled, lambda b: str(b)),
+    }
+    from benchmarks.imports import measure_import
+    results = {'import': measure_import(repeat=repeat)}
+    results.update({name: time_phase(setup, func, repeat) for name, (setup, func) in phases.items()})
+    policy = compiled.compile()
+    return {
+        'meta': {
+            'cspgen_version': version.VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'params': params._asdict(),
+            'repeat': repeat,
+            'config_bytes': len(ini),
+            'header_bytes': len(policy.header_bytes()),
+        },
+        'results': results,
+    }
+
+
+def compare_results(old: dict, new: dict, threshold: float = None, metric: str = 'median') -> Tuple[List[str], bool]:
+    """
+    Compare two result dicts returned by :func:`.run_benchmarks`.
+
+    :param dict old: The baseline results
+    :param dict new: The results to compare against the baseline
+    :param float threshold: If set, phases which are more than ``threshold`` percent slower count as regressions
+    :param str metric: Which timing to compare (``min``, ``median``, ``mean`` or ``max``)
+    :return tuple res: A list of human readable comparison lines, and a bool which is True if any phase regressed
+    """
+    lines, regressed = [], False
+    if old.get('meta', {}).get('params') != new.get('meta', {}).get('params'):
+        lines.append("WARNING: the two runs used different config params - the comparison may be meaningless")
+    for phase, nres in new['results'].items():
+        ores = old['results'].get(phase)
+        if ores is None:
+            lines.append(f"{phase:>10}: {nres[metric]:10.3f} ms  (no baseline)")
+            continue
+        o, n = ores[metric], nres[metric]
+        change = ((n - o) / o * 100) if o else 0.0
+        bad = threshold is not None and change > threshold
+        regressed = regressed or bad
+        lines.append(
+            f"{phase:>10}: {o:10.3f} ms -> {n:10.3f} ms  ({change:+7.2f}%)" + ("  REGRESSION" if bad else "")
+        )
+    return lines, regressed
@@ -42,6 +42,7 @@ import warnings
 try:
     from privex.cspgen.builder import CSPBuilder, get_builder, main, log_level
     from privex.cspgen.helpers import *
+    from privex.cspgen.exceptions import *
     from privex.cspgen.cli import cli
 except ImportError as e:
     warnings.warn_explicit(f"Failed to import privex.cspgen.builder or .helpers - reason: {type(e)} - {str(e)}")
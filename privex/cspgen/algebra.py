@@ -0,0 +1,351 @@
+"""
+Policy algebra - fast set operations (union, intersection, difference) on the sources of many compiled policies,
+e.g. to find which sources tenant A allows in ``script-src`` which tenant B doesn't, or the sources which every one
+of 2,000 policies has in common.
+
+Every source token is interned into a shared :class:`.SourceUniverse`, which gives each distinct token a bit number.
+Each directive's sources are then held as a :class:`.SourceSet` - a single Python :class:`int` used as a bitset - so
+set operations are one integer operation, rather than splitting and comparing strings.
+
+    >>> universe = SourceUniverse()
+    >>> a = PolicySources.from_policy(CSPBuilder('a.ini').compile(), universe)
+    >>> b = PolicySources.from_policy(CSPBuilder('b.ini').compile(), universe)
+    >>> list(a['script-src'] - b['script-src'])
+    ['https://cdn.example.com']
+    >>> print(diff(a, b))
+    script-src:
+      - https://cdn.example.com
+    img-src:
+      + https://i.imgur.com
+
+:func:`.common_sources` finds the sources shared by all (or a given fraction) of many policies, and :func:`.extract_base`
+turns them into a ``[groups]`` section for a base INI, which each site can then ``extends`` (see the README).
+"""
+import math
+from typing import Dict, Iterable, Iterator, List, Optional
+
+__all__ = [
+    'SourceUniverse', 'SourceSet', 'PolicySources', 'PolicyDiff', 'diff', 'union', 'intersection', 'common_sources',
+    'extract_base'
+]
+
+
+_OPTION_TOKENS = ("'unsafe-inline'", "'unsafe-eval'")
+
+
+def _bits(mask: int) -> Iterator[int]:
+    """Yield the numbers of the set bits in ``mask``, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class SourceUniverse:
+    """
+    Interns source tokens, giving each distinct token a bit number - shared by every :class:`.SourceSet` built from it,
+    so sets from different policies can be combined directly.
+    """
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def bit(self, token: str) -> int:
+        """Return the bit number for ``token``, adding it to the universe if it's new"""
+        i = self.index.get(token)
+        if i is None:
+            i = self.index[token] = len(self.tokens)
+            self.tokens.append(token)
+        return i
+
+    def mask(self, tokens: Iterable[str]) -> int:
+        """Return the bitset (as an :class:`int`) of ``tokens``"""
+        m = 0
+        for t in tokens:
+            m |= 1 << self.bit(t)
+        return m
+
+    def decode(self, mask: int) -> List[str]:
+        """Return the tokens in the bitset ``mask``, in the order they were first added to the universe"""
+        return [self.tokens[i] for i in _bits(mask)]
+
+    def set(self, tokens: Iterable[str] = ()) -> 'SourceSet':
+        """Return a :class:`.SourceSet` of ``tokens`` within this universe"""
+        return SourceSet(self, self.mask(tokens))
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} tokens={len(self.tokens)}>"
+
+
+class SourceSet:
+    """
+    An immutable set of source tokens, held as a bitset over a :class:`.SourceUniverse`. Supports the usual set
+    operators (``|``, ``&``, ``-``, ``^``, ``<=`` etc.) with other sets from the same universe, and iterates over it's
+    tokens in the order they were added to the universe.
+    """
+    __slots__ = ('universe', 'mask')
+
+    def __init__(self, universe: SourceUniverse, mask: int = 0):
+        self.universe = universe
+        self.mask = mask
+
+    def _other(self, other: 'SourceSet') -> int:
+        if other.universe is not self.universe:
+            raise ValueError("Cannot combine SourceSets from different SourceUniverses")
+        return other.mask
+
+    def __or__(self, other: 'SourceSet') -> 'SourceSet':
+        return SourceSet(self.universe, self.mask | self._other(other))
+
+    def __and__(self, other: 'SourceSet') -> 'SourceSet':
+        return SourceSet(self.universe, self.mask & self._other(other))
+
+    def __sub__(self, other: 'SourceSet') -> 'SourceSet':
+        return SourceSet(self.universe, self.mask & ~self._other(other))
+
+    def __xor__(self, other: 'SourceSet') -> 'SourceSet':
+        return SourceSet(self.universe, self.mask ^ self._other(other))
+
+    def __le__(self, other: 'SourceSet') -> bool:
+        return self.mask & ~self._other(other) == 0
+
+    def __ge__(self, other: 'SourceSet') -> bool:
+        return other <= self
+
+    def __eq__(self, other):
+        if not isinstance(other, SourceSet):
+            return NotImplemented
+        return self.universe is other.universe and self.mask == other.mask
+
+    def __hash__(self):
+        return hash((id(self.universe), self.mask))
+
+    def __contains__(self, token: str) -> bool:
+        i = self.universe.index.get(token)
+        return i is not None and bool(self.mask >> i & 1)
+
+    def __iter__(self):
+        return iter(self.universe.decode(self.mask))
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def __str__(self):
+        return ' '.join(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class PolicySources:
+    """
+    The sources of each directive in a policy (plus it's flags, under ``flags``), as :class:`.SourceSet` objects
+    sharing one :class:`.SourceUniverse`. Keyword sources such as ``'unsafe-inline'`` are included as tokens.
+
+    :ivar str name: A name for the policy (e.g. the tenant / INI filename), used in reports
+    :ivar dict directives: Maps each directive name to it's :class:`.SourceSet`
+    """
+    def __init__(self, universe: SourceUniverse, directives: Dict[str, SourceSet] = None, name: str = None):
+        self.universe = universe
+        self.directives: Dict[str, SourceSet] = {} if directives is None else directives
+        self.name = name
+
+    @classmethod
+    def from_policy(cls, policy, universe: SourceUniverse, name: str = None) -> 'PolicySources':
+        """
+        Build a :class:`.PolicySources` from a :class:`.CompiledPolicy` (or a :class:`.CSPBuilder`, which is compiled)
+
+        :param policy: The :class:`.CompiledPolicy` or :class:`.CSPBuilder`
+        :param SourceUniverse universe: The universe to intern the sources into
+        :param str name: A name for the policy, used in reports
+        """
+        if hasattr(policy, 'compile'):
+            policy = policy.compile()
+        dirs = {}
+        for k, rendered in policy.directives.items():
+            # Rendered directives look like "img-src 'self' https://i.imgur.com;" (the separator after the name may vary)
+            tokens = rendered[len(k):].lstrip(':').rstrip(';').split()
+            dirs[k] = universe.set(tokens)
+        if policy.flags:
+            dirs['flags'] = universe.set(f.rstrip(';') for f in policy.flags)
+        return cls(universe, dirs, name)
+
+    def _combine(self, other: 'PolicySources', op, keep_missing: bool) -> 'PolicySources':
+        res = {}
+        empty = SourceSet(self.universe)
+        for k in dict.fromkeys(list(self.directives) + list(other.directives)):
+            a, b = self.directives.get(k), other.directives.get(k)
+            if (a is None or b is None) and not keep_missing:
+                continue
+            res[k] = op(empty if a is None else a, empty if b is None else b)
+        return PolicySources(self.universe, res)
+
+    def __or__(self, other: 'PolicySources') -> 'PolicySources':
+        """Union of each directive - directives in either policy are kept"""
+        return self._combine(other, SourceSet.__or__, True)
+
+    def __and__(self, other: 'PolicySources') -> 'PolicySources':
+        """Intersection of each directive - only directives in both policies are kept"""
+        return self._combine(other, SourceSet.__and__, False)
+
+    def __sub__(self, other: 'PolicySources') -> 'PolicySources':
+        """The sources of each directive in this policy, which aren't in the same directive of ``other``"""
+        res = {k: v - other.directives[k] if k in other.directives else v for k, v in self.directives.items()}
+        return PolicySources(self.universe, res)
+
+    def __getitem__(self, item: str) -> SourceSet:
+        return self.directives[item]
+
+    def get(self, item: str, default=None) -> Optional[SourceSet]:
+        return self.directives.get(item, default)
+
+    def __iter__(self):
+        return iter(self.directives)
+
+    def __len__(self):
+        return len(self.directives)
+
+    def __eq__(self, other):
+        if not isinstance(other, PolicySources):
+            return NotImplemented
+        return self.directives == other.directives
+
+    def as_dict(self) -> Dict[str, List[str]]:
+        """Return a dict mapping each directive to a list of it's sources"""
+        return {k: list(v) for k, v in self.directives.items()}
+
+    def __repr__(self):
+        return f"<{type(self).__name__} name={self.name!r} directives={list(self.directives)!r}>"
+
+
+class PolicyDiff:
+    """
+    The minimal difference between two policies ``a`` and ``b`` - only directives which differ are included.
+
+    :ivar dict added: Maps directive names to the sources in ``b`` which aren't in ``a``
+    :ivar dict removed: Maps directive names to the sources in ``a`` which aren't in ``b``
+    :ivar list only_a: Directives which only exist in ``a``
+    :ivar list only_b: Directives which only exist in ``b``
+    """
+    def __init__(self, a: PolicySources, b: PolicySources):
+        self.a, self.b = a, b
+        self.added: Dict[str, SourceSet] = {}
+        self.removed: Dict[str, SourceSet] = {}
+        self.only_a = [k for k in a.directives if k not in b.directives]
+        self.only_b = [k for k in b.directives if k not in a.directives]
+        for k in dict.fromkeys(list(a.directives) + list(b.directives)):
+            sa, sb = a.directives.get(k, SourceSet(a.universe)), b.directives.get(k, SourceSet(a.universe))
+            if sa.mask == sb.mask:
+                continue
+            if sb - sa: self.added[k] = sb - sa
+            if sa - sb: self.removed[k] = sa - sb
+
+    @property
+    def directives(self) -> List[str]:
+        """The names of every directive which differs, in policy order"""
+        return [
+            k for k in dict.fromkeys(list(self.a.directives) + list(self.b.directives))
+            if k in self.added or k in self.removed or k in self.only_a or k in self.only_b
+        ]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.only_a or self.only_b)
+
+    def as_dict(self) -> Dict[str, Dict[str, List[str]]]:
+        """Return ``{directive: {'added': [...], 'removed': [...]}}`` for each directive which differs"""
+        res = {}
+        for k in dict.fromkeys(list(self.a.directives) + list(self.b.directives)):
+            if k in self.added or k in self.removed:
+                res[k] = dict(added=list(self.added.get(k, ())), removed=list(self.removed.get(k, ())))
+        return res
+
+    def __str__(self):
+        lines = []
+        for k in self.directives:
+            note = f" (only in {self.a.name or 'a'})" if k in self.only_a else (
+                f" (only in {self.b.name or 'b'})" if k in self.only_b else '')
+            lines.append(f"{k}:{note}")
+            lines += [f"  - {s}" for s in self.removed.get(k, ())]
+            lines += [f"  + {s}" for s in self.added.get(k, ())]
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} added={len(self.added)} removed={len(self.removed)}>"
+
+
+def diff(a: PolicySources, b: PolicySources) -> PolicyDiff:
+    """Return the minimal :class:`.PolicyDiff` needed to turn policy ``a`` into policy ``b``"""
+    return PolicyDiff(a, b)
+
+
+def union(policies: Iterable[PolicySources]) -> PolicySources:
+    """Return the union of every policy's directives (every source allowed by any of the policies)"""
+    policies = list(policies)
+    if not policies:
+        raise ValueError("union() requires at least one policy")
+    res = {}
+    for p in policies:
+        for k, v in p.directives.items():
+            res[k] = res[k] | v if k in res else v
+    return PolicySources(policies[0].universe, res)
+
+
+def intersection(policies: Iterable[PolicySources]) -> PolicySources:
+    """Return the sources which every policy has in the same directive (directives missing from any policy are dropped)"""
+    return common_sources(policies, 1.0)
+
+
+def common_sources(policies: Iterable[PolicySources], threshold: float = 1.0) -> PolicySources:
+    """
+    Return the sources which at least ``threshold`` (a fraction from ``0.0`` - ``1.0``) of ``policies`` have in the
+    same directive. With the default of ``1.0``, this is the intersection of every policy.
+    """
+    policies = list(policies)
+    if not policies:
+        raise ValueError("common_sources() requires at least one policy")
+    universe, need = policies[0].universe, max(1, math.ceil(threshold * len(policies) - 1e-9))
+    names = dict.fromkeys(k for p in policies for k in p.directives)
+    res = {}
+    for k in names:
+        masks = [p.directives[k].mask for p in policies if k in p.directives]
+        if len(masks) < need:
+            continue
+        if need == len(policies):
+            m = masks[0]
+            for x in masks[1:]:
+                m &= x
+        else:
+            counts: Dict[int, int] = {}
+            for x in masks:
+                for i in _bits(x):
+                    counts[i] = counts.get(i, 0) + 1
+            m = 0
+            for i, c in counts.items():
+                if c >= need: m |= 1 << i
+        if m:
+            res[k] = SourceSet(universe, m)
+    return PolicySources(universe, res)
+
+
+def extract_base(policies: Iterable[PolicySources], threshold: float = 1.0, prefix: str = 'shared') -> str:
+    """
+    Find the sources shared by at least ``threshold`` of ``policies`` (see :func:`.common_sources`), and return them
+    as the ``[groups]`` section of a base INI - one group per directive, e.g. ``shared_script-src``. Sites can then
+    ``extends`` the base, and use ``{{shared_script-src}}`` in place of the shared sources.
+
+    ``'unsafe-inline'`` / ``'unsafe-eval'`` and nonces are left out, as they're set by each section's options.
+    """
+    common = common_sources(policies, threshold)
+    lines = ['[groups]']
+    for k, s in common.directives.items():
+        tokens = [t for t in s if t not in _OPTION_TOKENS and not t.startswith("'nonce-")]
+        if k == 'flags' or not tokens:
+            continue
+        lines.append(f"{prefix}_{k} = {' '.join(tokens)}")
+    return '\n'.join(lines) + '\n'
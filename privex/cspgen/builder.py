@@ -34,25 +34,34 @@ Except as contained in this notice, the name(s) of the above copyright holders s
 otherwise to promote the sale, use or other dealings in this Software without prior written authorization.
 """
 import configparser
+import logging
+import os
+import re
 import sys
-import textwrap
-from colorama import Fore
+import threading
+from functools import partial
+from time import perf_counter
 from os import getenv as env
-from privex.helpers import empty, empty_if, is_true, is_false, env_bool, T, K, ErrHelpParser
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Iterable, Iterator, Union, Optional, List, Tuple, Dict, Set
 
 from privex.cspgen import version
-from privex.cspgen.helpers import automark_str, clean_dict, dedup, literal, read_stdin
+from privex.cspgen.exceptions import ExtendsCycleError, HashConflictError, PolicyValidationError
+from privex.cspgen.model import Directive, SourceList
+from privex.cspgen.optimize import OptimizeResult, optimize_tokens
+from privex.cspgen.routes import ROUTE_SEP, RouteTable, is_route, split_route
+from privex.cspgen import stats
+from privex.cspgen.stats import TOTALS, BuildStats
+from privex.cspgen.helpers import (
+    NONCE_SLOT, MarkerResolver, document_id, empty, empty_if, is_true, iter_documents, literal, read_stdin
+)
 
 oprint = print
-from rich import print
-from pathlib import Path
-import logging
-import argparse
-from privex.loghelper import LogHelper
-from typing import Union, Optional, List, Tuple, Dict, Set
 
 __all__ = [
-    'CSPBuilder', 'get_builder', 'main', 'parser', 'log_level', 'PKG_DIR', 'EXAMPLE_DIR', 'EXAMPLE_INI'
+    'CSPBuilder', 'CompiledPolicy', 'get_builder', 'load_base', 'find_extends', 'compile_source', 'compile_policy', 'iter_compile', 'compile_document', 'iter_compile_documents', 'stream_documents', 'print_optimize_report', 'main', 'get_parser', 'get_copyright',
+    'setup_logging', 'log_level', 'PKG_DIR', 'EXAMPLE_DIR', 'EXAMPLE_INI'
 ]
 
 PKG_DIR = Path(__file__).parent.resolve()
@@ -60,139 +69,1042 @@ EXAMPLE_DIR = PKG_DIR / 'examples'
 EXAMPLE_INI = EXAMPLE_DIR / 'example.ini'
 
 log_level = env('LOG_LEVEL', 'WARNING')
-_lh = LogHelper('privex.cspgen', handler_level=logging.getLevelName(log_level))
-_lh.add_console_handler(stream=sys.stderr)
+log = logging.getLogger(__name__)
+
+
+class CompiledPolicy:
+    """
+    An immutable, pre-rendered Content Security Policy, as produced by :meth:`.CSPBuilder.compile`.
 
-log = _lh.get_logger()
+    Holds the rendered string for each directive (e.g. ``default-src 'self' https://www.privex.io;``), the
+    rendered standalone flags (e.g. ``upgrade-insecure-requests;``), plus the joined header string and it's
+    encoded bytes for each separator that has been requested - so repeatedly asking for the header (e.g. from
+    a web middleware on every response) only costs a dict lookup.
 
-argc, argv = len(sys.argv), sys.argv
+        >>> policy = CSPBuilder('example.ini').compile()
+        >>> policy.header()
+        "default-src 'self' https://www.privex.io ...; upgrade-insecure-requests;"
+        >>> policy.header_bytes(sep='\\n')
+        b"default-src 'self' https://www.privex.io ...;\\nupgrade-insecure-requests;"
+
+    Directives with ``nonce = true`` in their INI section contain a nonce "slot". Those slots are left out of
+    :meth:`.header`, while :meth:`.render_nonce` fills them in with a per-request nonce, by joining the
+    pre-encoded static byte segments which surround the slots:
+
+        >>> nonce = generate_nonce()
+        >>> policy.render_nonce(nonce)
+        b"default-src 'self' ...; script-src 'self' ... 'nonce-3q2+7w...'; upgrade-insecure-requests;"
+
+    """
+    __slots__ = (
+        'directives', 'flags', 'sections', 'nonce_directives', 'nonce_sections', '_headers', '_encoded', '_templates'
+    )
+    encoding = 'utf-8'
+
+    def __init__(self, directives: Dict[str, str], flags: Union[List[str], Tuple[str, ...]] = (),
+                 nonce_directives: Dict[str, str] = None):
+        """
+        :param dict directives: Maps each directive name to it's rendered string
+        :param flags: The rendered standalone flags, e.g. ``['upgrade-insecure-requests;']``
+        :param dict nonce_directives: Maps the names of any directives containing a nonce slot, to the directive
+                                      rendered with :data:`.NONCE_SLOT` in place of the nonce value.
+        """
+        _set = object.__setattr__
+        nonce_directives = {} if nonce_directives is None else nonce_directives
+        _set(self, 'directives', MappingProxyType(dict(directives)))
+        _set(self, 'flags', tuple(flags))
+        _set(self, 'sections', tuple(self.directives.values()) + self.flags)
+        _set(self, 'nonce_directives', MappingProxyType(dict(nonce_directives)))
+        _set(self, 'nonce_sections', tuple(nonce_directives.get(k, v) for k, v in self.directives.items()) + self.flags)
+        _set(self, '_headers', {})
+        _set(self, '_encoded', {})
+        _set(self, '_templates', {})
+        self.header_bytes(' ')
+        self.nonce_template(' ')
+
+    @property
+    def has_nonce(self) -> bool:
+        """``True`` if at least one directive contains a nonce slot"""
+        return self.nonce_sections != self.sections
+
+    def header(self, sep: str = ' ') -> str:
+        """Return the full CSP header value, with each directive / flag separated by ``sep``"""
+        h = self._headers.get(sep)
+        if h is None:
+            h = sep.join(self.sections)
+            if not h.endswith(';'): h += ';'
+            self._headers[sep] = h
+        return h
+
+    def header_bytes(self, sep: str = ' ') -> bytes:
+        """Same as :meth:`.header` but returns the header pre-encoded into :class:`.bytes` (cached per separator)"""
+        b = self._encoded.get(sep)
+        if b is None:
+            b = self._encoded[sep] = self.header(sep).encode(self.encoding)
+        return b
+
+    def nonce_template(self, sep: str = ' ') -> Tuple[bytes, ...]:
+        """
+        Return the header (separated by ``sep``) as a tuple of pre-encoded static byte segments, split
+        wherever a nonce needs to be inserted (cached per separator).
+        """
+        t = self._templates.get(sep)
+        if t is None and not self.nonce_directives:
+            # Without any nonce slots, the template is just the header - share it's bytes rather than encoding a copy
+            t = self._templates[sep] = (self.header_bytes(sep),)
+        elif t is None:
+            h = sep.join(self.nonce_sections)
+            if not h.endswith(';'): h += ';'
+            t = self._templates[sep] = tuple(h.encode(self.encoding).split(NONCE_SLOT.encode(self.encoding)))
+        return t
+
+    def render_nonce(self, nonce: Union[str, bytes], sep: str = ' ') -> bytes:
+        """
+        Return the encoded header with every nonce slot filled in with ``nonce``. This is a single
+        :meth:`bytes.join` of the segments from :meth:`.nonce_template`, so it's cheap enough to call per request.
+
+        :param str|bytes nonce: The nonce value to insert, e.g. from :func:`.generate_nonce`
+        :param str sep: The separator between each directive / flag
+        """
+        if isinstance(nonce, str): nonce = nonce.encode(self.encoding)
+        return nonce.join(self.nonce_template(sep))
+
+    def header_nonce(self, nonce: str, sep: str = ' ') -> str:
+        """Same as :meth:`.render_nonce` but returns a :class:`.str`"""
+        return self.render_nonce(nonce, sep).decode(self.encoding)
+
+    def as_dict(self) -> Dict[str, Union[str, List[str]]]:
+        """Return a new dict mapping each directive to it's rendered string, with the rendered flags under ``flags``"""
+        secd = dict(self.directives)
+        secd['flags'] = list(self.flags)
+        return secd
+
+    def replace(self, directives: Dict[str, Optional[str]] = None, flags: Union[List[str], Tuple[str, ...]] = None,
+                nonce_directives: Dict[str, Optional[str]] = None) -> "CompiledPolicy":
+        """
+        Return a new :class:`.CompiledPolicy` with the passed directives / nonce directives updated (or removed, if their
+        value is ``None``) and ``flags`` replaced (if not None). Unchanged directives keep their position and rendered strings.
+        """
+        dirs, nonced = dict(self.directives), dict(self.nonce_directives)
+        for src, dst in ((directives, dirs), (nonce_directives, nonced)):
+            for k, v in (src or {}).items():
+                if v is None:
+                    dst.pop(k, None)
+                else:
+                    dst[k] = v
+        return CompiledPolicy(dirs, self.flags if flags is None else flags, nonce_directives=nonced)
+
+    def __reduce__(self):
+        # Rebuild from the rendered strings when unpickled (e.g. when returned from a process pool), as __setattr__ is blocked
+        return type(self), (dict(self.directives), self.flags, dict(self.nonce_directives))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable - cannot set attribute {key!r}")
+
+    def __delattr__(self, item):
+        raise AttributeError(f"{self.__class__.__name__} is immutable - cannot delete attribute {item!r}")
+
+    def __str__(self):
+        return self.header()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} directives={list(self.directives.keys())!r} flags={list(self.flags)!r}>"
+
+    def __iter__(self):
+        yield from self.sections
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __getitem__(self, item: str):
+        if item == 'flags':
+            return list(self.flags)
+        return self.directives[item]
+
+    def __eq__(self, other):
+        # Compare the nonce sections too - otherwise a policy with nonce slots would be equal to the same policy without
+        if isinstance(other, CompiledPolicy):
+            return self.sections == other.sections and self.nonce_sections == other.nonce_sections
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.sections, self.nonce_sections))
 
 
 class CSPBuilder:
     def __init__(self, filename: str = None, file_handle = None, contents: Union[str, list, tuple] = None, **kwargs):
-        self.config = configparser.ConfigParser()
+        self._config: Optional[configparser.ConfigParser] = None
+        self._raw: Dict[str, Dict[str, str]] = {}
+        self._stats = BuildStats()
+        self._debug = False
         self.conf_file = None
         if not empty(filename):
             self.conf_file = Path(filename).resolve()
-            self.config.read(self.conf_file)
+        self.loader = kwargs.get('loader', 'fast')
+        """``fast`` to load the INI with :mod:`privex.cspgen.loader` (falling back to ConfigParser when needed), or ``configparser``"""
+        self.validate = str(kwargs.get('validate', 'warn')).lower()
+        """How to handle invalid directives / sources - ``warn`` (log them), ``strict`` (raise :class:`.PolicyValidationError`) or ``off``"""
+        self._validate_explicit = 'validate' in kwargs
+        self.issues: List['ValidationIssue'] = []
+        """The issues found by validating the config, the last time it was cleaned (see :mod:`privex.cspgen.validate`)"""
+        self._read_config(file_handle=file_handle, contents=contents)
+
+        self._groups: Optional[Dict[str, str]] = {}
+        self.directives: Dict[str, Directive] = {}
+        """The cleaned directive sections, as compact :class:`.Directive` objects"""
+        self.flag_sources = SourceList()
+        self.excluded = kwargs.get('excluded', ['flags', 'groups', 'cspgen', 'DEFAULT'])
+        self.strict = kwargs.get('strict', False)
+        self.resolver: Optional[MarkerResolver] = None
+        self.base: Optional[CSPBuilder] = None
+        """The (shared, read-only) builder for the base INI file this config extends, if any - see :func:`.load_base`"""
+        self._extends_chain: Tuple[Path, ...] = tuple(kwargs.get('_extends_chain', ()))
+        self.optimize = kwargs.get('optimize', False)
+        self.optimized: Dict[str, OptimizeResult] = {}
+        """When :attr:`.optimize` is enabled, maps each section name to the sources removed from it's ``zones`` (see :meth:`.optimize_report`)"""
+        self.hash_dirs: List[str] = list(kwargs.get('hash_dirs', []))
+        """Extra template folders to hash inline scripts / styles from, on top of ``hash-dirs`` in the ``[cspgen]`` section"""
+        self.hash_jobs = kwargs.get('hash_jobs', 1)
+        self.hash_cache = kwargs.get('hash_cache')
+        self.hash_sources: Dict[str, Tuple[str, ...]] = {}
+        """Maps ``script-src`` / ``style-src`` to the hash sources of the inline blocks found in the template folders"""
+        self.routes: Dict[str, Dict[str, Directive]] = {}
+        """Maps each route prefix to the directives overridden by it's ``[directive@/prefix]`` sections (see :mod:`privex.cspgen.routes`)"""
+        self.cleaned = False
+        self._compiled: Optional[CompiledPolicy] = None
+        self._route_table: Optional['RouteTable'] = None
+        # self.section_split = kwargs.get('section_split', ': ')
+        self.section_split = kwargs.get('section_split', ' ')
+
+    def _read_config(self, file_handle=None, contents: Union[str, list, tuple] = None):
+        """
+        Parse the config into plain dicts in :attr:`._raw` - using the single-pass loader in :mod:`privex.cspgen.loader`,
+        or :class:`configparser.ConfigParser` if :attr:`.loader` is ``configparser`` (or the config needs it, e.g. it
+        uses ``%`` interpolation). ConfigParser is released straight away, as it's far larger than the values.
+        """
+        from privex.cspgen.loader import find_markers, parse_ini, read_text
+        t = perf_counter()
+        if self.conf_file is not None and file_handle is None and empty(contents, itr=True):
+            source = str(self.conf_file)
+            # Like ConfigParser.read, an unreadable file is treated as empty
+            try:
+                text = read_text(self.conf_file)
+            except OSError:
+                text = ''
         elif file_handle is not None:
-            self.config.read_file(file_handle)
+            source, text = getattr(file_handle, 'name', '<???>'), file_handle.read()
         elif not empty(contents, itr=True):
-            if isinstance(contents, (tuple, list)):
-                contents = "\n".join(contents)
-            self.config.read_string(contents)
+            source = '<string>'
+            text = "\n".join(contents) if isinstance(contents, (tuple, list)) else contents
         else:
             raise ValueError(
                 "CSPBuilder expects either a filename, file handle (open()), or config string "
                 "contents to be passed. All 3 are None / empty. Nothing to parse."
             )
+        data = parse_ini(text) if self.loader == 'fast' else None
+        if data is not None:
+            self._raw, self._lines, self._markers = data
+        else:
+            if self.loader == 'fast': self._stats.incr('loader_fallbacks')
+            config = configparser.ConfigParser()
+            config.read_string(text, source=source)
+            self._raw = {k: dict(v.items()) for k, v in config.items() if k != 'DEFAULT'}
+            # Where each section / key starts and ends, so that validation issues can point at the line they're on
+            from privex.cspgen.validate import line_index
+            self._lines, self._markers = line_index(text.split('\n')), find_markers(self._raw)
+        self._config = None
+        self._stats.incr('bytes_read', len(text))
+        self._stats.lap('read', t)
+
+    @property
+    def config(self) -> configparser.ConfigParser:
+        """
+        The config as a :class:`configparser.ConfigParser`. To save memory, this is only built when it's accessed, and is
+        released again by :meth:`.compile`.
+
+        If you modify it by hand, call :meth:`.invalidate` before compiling the policy, so that your changes are picked up.
+        """
+        if self._config is None:
+            self._config = configparser.ConfigParser(interpolation=None)
+            self._config.read_dict(self._raw)
+        return self._config
+
+    @config.setter
+    def config(self, value: configparser.ConfigParser):
+        self._config = value
+        self._sync_config()
+
+    def _sync_config(self):
+        """Copy any changes made by hand to :attr:`.config` back into :attr:`._raw`"""
+        if self._config is not None:
+            self._raw = {k: dict(v.items()) for k, v in self._config.items() if k != 'DEFAULT'}
+
+    @property
+    def config_dict(self) -> Dict[str, Dict[str, str]]:
+        """The cleaned sections as a dict of dicts of strings (built from :attr:`.directives` on each access)"""
+        self.autoclean()
+        return {k: d.as_dict() for k, d in self.directives.items()}
+
+    @property
+    def groups(self) -> Dict[str, str]:
+        """
+        The resolved groups (including any inherited from the base INI) as a plain dict of space separated strings.
+
+        This is a copy, built the first time it's accessed after the config is cleaned - modifying it doesn't affect
+        :attr:`.resolver` or a shared base builder. Use :meth:`.set_group` to change a group on a live builder.
+        """
+        if self._groups is None:
+            self._groups = {} if self.resolver is None else dict(self.resolver.all_resolved)
+        return self._groups
 
-        self.groups = {}
-        self.config_dict = {}
-        self.flags = ''
-        self.excluded = kwargs.get('excluded', ['flags', 'groups', 'DEFAULT'])
+    @groups.setter
+    def groups(self, value: Dict[str, str]):
+        self._groups = value
+
+    @property
+    def flags(self) -> str:
+        """The cleaned flags as a space separated string"""
+        return str(self.flag_sources)
+
+    @flags.setter
+    def flags(self, value: Union[str, Iterable[str]]):
+        """
+        Replace the cleaned flags (a space separated string, or a list of flags) - writing through to
+        :attr:`.flag_sources`, and patching the cached policy if it's already compiled.
+
+        Like the rest of the cleaned config, this is reset the next time the config is cleaned - use
+        ``set_section('flags', 'flags', value)`` to change the INI's flags.
+        """
+        self.autoclean()
+        self.flag_sources = SourceList.from_str(value) if isinstance(value, str) else SourceList(value)
+        if self._compiled is not None:
+            self._compiled = self._compiled.replace(flags=[f + ';' for f in self.flag_sources])
+
+    def invalidate(self):
+        """
+        Discard the cleaned config and the cached :class:`.CompiledPolicy`, so that the next call to
+        :meth:`.compile` / :meth:`.generate` re-processes :attr:`.config` from scratch.
+
+        Call this after modifying :attr:`.config` by hand.
+        """
         self.cleaned = False
-        # self.section_split = kwargs.get('section_split', ': ')
-        self.section_split = kwargs.get('section_split', ' ')
-        
+        self._compiled = self._route_table = None
+        return self
+
+    def reload(self, file_handle=None, contents: Union[str, list, tuple] = None):
+        """
+        Re-read the config - either from ``file_handle`` / ``contents`` if passed, otherwise from :attr:`.conf_file` -
+        and invalidate the cached policy.
+        """
+        if self.conf_file is None and file_handle is None and empty(contents, itr=True):
+            raise ValueError("Cannot reload a CSPBuilder which wasn't loaded from a file, without a new file_handle or contents.")
+        self._read_config(file_handle=file_handle, contents=contents)
+        self._groups, self.directives, self.flag_sources = {}, {}, SourceList()
+        return self.invalidate()
 
     @property
     def sections(self) -> list:
-        return self.config.sections()
+        return self._config.sections() if self._config is not None else list(self._raw)
 
     @property
     def clean_sections(self) -> list:
         return [s for s in self.sections if s not in self.excluded]
 
+    def _load_base(self) -> Optional['CSPBuilder']:
+        """Load the base INI referenced by ``extends`` in the ``[cspgen]`` section (relative to this INI's folder), if any"""
+        extends = self._raw.get('cspgen', {}).get('extends', '').strip()
+        if empty(extends):
+            return None
+        base_dir = Path.cwd() if self.conf_file is None else self.conf_file.parent
+        chain = self._extends_chain + (() if self.conf_file is None else (self.conf_file,))
+        return load_base(base_dir / Path(extends).expanduser(), strict=self.strict, _chain=chain)
+
+    def _base_raw(self, section: str) -> Dict[str, str]:
+        """Return the raw keys of ``section`` inherited from the base INI (empty dict if there's no base / no such section)"""
+        if self.base is None:
+            return {}
+        if section == 'flags':
+            return {'flags': self.base._raw_flags} if self.base._raw_flags else {}
+        if section in self.base._raw_routes:
+            return self.base._raw_routes[section]
+        return self.base._raw_sections.get(section, {})
+
+    @property
+    def extends_files(self) -> List[Path]:
+        """The paths of the base INI file this config extends, the base that extends, and so on"""
+        self.autoclean()
+        files, base = [], self.base
+        while base is not None:
+            files.append(base.conf_file)
+            base = base.base
+        return files
+
     def clean(self):
-        # First we extract 'groups' from the config, replace it's {{markers}}, and then deduplicate all group values
-        if 'groups' in self.sections:
-            self.groups = clean_dict(self.config['groups'])
-
-        groups = self.groups
-        # Next we iterate over the Config object and extract all sections into a standard dict
-        config_dict = self.config_dict
-        for k, v in self.config.items():
-            v: configparser.SectionProxy
-            sec_items = dict(v.items())
-            config_dict[k] = sec_items
-        
-        # Remove auto-added 'DEFAULT' (not used), and 'groups' (already parsed and extracted into self.groups)
-        if 'DEFAULT' in config_dict: del config_dict['DEFAULT']
-        if 'groups' in config_dict: del config_dict['groups']
+        st, t = self._stats, perf_counter()
+        self._debug = log.isEnabledFor(logging.DEBUG)
+        # Pick up any changes made by hand to self.config
+        self._sync_config()
+        # If this config extends a base INI, load the base - which is only parsed and resolved once per process
+        self.base = self._load_base()
 
-        # Extract 'flags' if present in the config, replace {{markers}}, and deduplicate it's contents.
-        cflags = '' if 'flags' not in config_dict else config_dict['flags']['flags']
-        cflags = dedup(automark_str(cflags, groups))
-        
-        # Then we can simply remove 'flags' from the config dict
-        if 'flags' in config_dict: del config_dict['flags']
+        # Next we extract 'groups' from the config, and resolve their {{markers}} in dependency order into de-duplicated
+        # tokens. Groups which aren't defined here fall back to the base's resolved groups, which are shared - not copied.
+        resolver = MarkerResolver(
+            self._raw.get('groups', {}), strict=self.strict, parent=None if self.base is None else self.base.resolver
+        )
+        self.resolver = resolver
+        self._groups = None
+        st.incr('markers_expanded', sum(len(d) for d in resolver.deps.values()))
+        t = st.lap('resolve', t)
+
+        # Next we extract the raw values of all sections, excluding 'groups' (already parsed and extracted into
+        # self.groups), and 'cspgen' (settings for cspgen itself). Sections from the base are inherited, with our keys
+        # overriding theirs.
+        raw = {k: v for k, v in self._raw.items() if k not in ['groups', 'cspgen']}
+        if self.base is not None:
+            names = list(self.base._raw_sections) + ['flags'] + list(self.base._raw_routes) + list(raw)
+            raw = {k: {**self._base_raw(k), **raw.get(k, {})} for k in dict.fromkeys(names)}
+            if not raw['flags']: del raw['flags']
 
-        # Finally we make sure all local variables are saved back to their appropriate instance attributes
-        self.config_dict = {k: clean_dict(v, groups) for k, v in config_dict.items()}
-        self.flags = cflags
-        self.groups = groups
+        # If any template folders are set, hash their inline scripts / styles. A directive which gets hashes but isn't
+        # in the config is created from default-src, so that adding it doesn't loosen the policy.
+        self.hash_sources = self._scan_hashes()
+        for name in self.hash_sources:
+            if name not in raw:
+                raw[name] = dict(raw.get('default-src', {}))
+        if self.hash_sources: t = st.lap('hash', t)
+
+        # Extract 'flags' if present in the config - then we can simply remove 'flags' from the raw sections. Route
+        # sections ([directive@/prefix]) are kept separately, as they're layered over the main policy.
+        self._raw_flags = raw.pop('flags', {}).get('flags', '')
+        self._raw_routes = {k: raw.pop(k) for k in list(raw) if is_route(k)}
+        self._raw_sections = raw
+
+        # Finally, we replace the {{markers}} in each section and the flags, and deduplicate their contents - while
+        # indexing which groups each section depends on, so that changing a group only needs to update those sections.
+        self.group_index, self._section_deps, self.optimized = {}, {}, {}
+        self.directives = {k: self._clean_section(k, v) for k, v in raw.items()}
+        self.flag_sources = self._clean_flags()
+        t = st.lap('dedup', t)
+        if self._raw_routes:
+            self._clean_routes()
+            t = st.lap('routes', t)
+        self._validate()
+        st.lap('validate', t)
+        st.incr('cleans')
         self.cleaned = True
+        self._compiled = None
         return self
 
+    def _clean_routes(self):
+        """
+        Clean the route sections into :attr:`.routes`. Each route's keys are layered over the directive's keys in the
+        nearest parent route (or the main policy), so parent prefixes are cleaned first.
+        """
+        by_prefix: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for section, raw in self._raw_routes.items():
+            name, prefix = split_route(section)
+            by_prefix.setdefault(prefix, {})[name] = raw
+        effective: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self.routes, self._route_table = {}, None
+        for prefix in sorted(by_prefix, key=lambda p: p.count('/')):
+            parent = prefix.rpartition('/')[0]
+            while parent and parent not in effective:
+                parent = parent.rpartition('/')[0]
+            eff, dirs = dict(effective.get(parent, {})), {}
+            for name, raw in by_prefix[prefix].items():
+                inherited = eff.get(name)
+                if inherited is None:
+                    inherited = {'flags': self._raw_flags} if name == 'flags' else self._raw_sections.get(name, {})
+                eff[name] = merged = {**inherited, **raw}
+                if name == 'flags':
+                    flags = self._expand(f"flags{ROUTE_SEP}{prefix}", 'flags', merged.get('flags', ''), set())
+                    dirs[name] = Directive(name, flags)
+                else:
+                    dirs[name] = self._clean_section(name, merged, index=False)
+            effective[prefix], self.routes[prefix] = eff, dirs
+
+    def _validate(self):
+        """
+        Check the cleaned directives against the CSP grammar (see :mod:`privex.cspgen.validate`), logging or raising
+        the issues depending on :attr:`.validate`. If ``validate`` wasn't passed to the constructor, ``validate`` in the
+        ``[cspgen]`` section is used instead (when set) - an explicit argument always takes precedence over the INI.
+
+        Base INI files aren't validated by themselves, as their inherited sections are validated within each config
+        which extends them.
+        """
+        mode = self.validate if self._validate_explicit else self._raw.get('cspgen', {}).get('validate', self.validate)
+        mode = mode.strip().lower()
+        if mode not in ('warn', 'strict', 'off'):
+            raise ValueError(f"Invalid validate mode {mode!r} - must be one of: warn, strict, off")
+        if mode == 'off' or self._extends_chain:
+            self.issues = []
+            return
+        from privex.cspgen.validate import validate_builder, format_issues
+        self.issues = validate_builder(self)
+        errors = [i for i in self.issues if i.severity == 'error']
+        if mode == 'strict' and errors:
+            raise PolicyValidationError(
+                f"Found {len(errors)} invalid directive(s) / source(s) in {self.conf_file or 'config'}:\n" + format_issues(errors),
+                self.issues
+            )
+        for issue in self.issues:
+            log.warning("%s", issue)
+
+    @property
+    def template_dirs(self) -> List[Path]:
+        """The template folders to hash inline blocks from - ``hash-dirs`` in ``[cspgen]`` (relative to the INI), plus :attr:`.hash_dirs`"""
+        base_dir = Path.cwd() if self.conf_file is None else self.conf_file.parent
+        dirs = self._raw.get('cspgen', {}).get('hash-dirs', '').split()
+        return [base_dir / Path(d).expanduser() for d in dirs] + [Path(d).expanduser() for d in self.hash_dirs]
+
+    def _scan_hashes(self) -> Dict[str, Tuple[str, ...]]:
+        """Hash the inline scripts / styles in :attr:`.template_dirs` (see :mod:`privex.cspgen.hashes`)"""
+        dirs = self.template_dirs
+        if not dirs:
+            return {}
+        from privex.cspgen.hashes import DEFAULT_PATTERNS, scan_templates
+        settings = self._raw.get('cspgen', {})
+        found = scan_templates(
+            dirs, settings.get('hash-patterns', '').split() or DEFAULT_PATTERNS,
+            algorithm=settings.get('hash-algorithm', 'sha256').strip().lower(), jobs=self.hash_jobs, cache=self.hash_cache,
+        )
+        log.debug("Found %d inline script and %d inline style hashes in %s", len(found.scripts), len(found.styles), dirs)
+        return {k: v for k, v in (('script-src', found.scripts), ('style-src', found.styles)) if v}
+
+    def _expand(self, name: str, key: str, value: str, deps: Set[str]) -> List[str]:
+        """Replace markers in / deduplicate the raw value of ``key`` in section ``name``, adding the groups it uses to ``deps``"""
+        parts, sdeps = MarkerResolver.parse(value)
+        deps.update(sdeps)
+        if sdeps: self._stats.incr('markers_expanded', len(sdeps))
+        return self.resolver.expand_parts(parts, f"{name}.{key}")
+
+    def _index_deps(self, name: str, deps: Set[str]):
+        for d in deps:
+            self.group_index.setdefault(d, set()).add(name)
+        self._section_deps[name] = deps
+
+    def _clean_section(self, name: str, raw: Dict[str, str], index: bool = True) -> Directive:
+        """
+        Replace markers in / deduplicate the raw values of section ``name``, and record it's group dependencies (and
+        optimizer results) unless ``index`` is False
+        """
+        sources, options, deps = None, [], set()
+        for sk, sv in raw.items():
+            tokens = self._expand(name, sk, sv, deps)
+            if sk != 'zones':
+                options.append((sk, ' '.join(tokens)))
+                continue
+            if self.optimize:
+                res = optimize_tokens(tokens)
+                if index: self.optimized[name] = res
+                tokens = res.kept
+                if res.removed and self._debug:
+                    log.debug("Optimizer removed %d subsumed sources (%d bytes) from %s", len(res.removed), res.bytes_saved, name)
+            sources = SourceList(tokens)
+        hashes = self.hash_sources.get(name)
+        directive = Directive(name, sources, options)
+        if hashes:
+            if directive.unsafe_inline and not is_true(self._raw.get('cspgen', {}).get('hash-unsafe-inline', False)):
+                raise HashConflictError(
+                    f"[{name}] has unsafe-inline = true, but {len(hashes)} inline block hash(es) would be added to it - "
+                    f"browsers ignore 'unsafe-inline' when hashes are present. Remove unsafe-inline, or set "
+                    f"'hash-unsafe-inline = true' in [cspgen] to keep both (in {self.conf_file or 'config'})"
+                )
+            directive = Directive(name, SourceList(dict.fromkeys((sources or ()) + hashes)), options)
+        if index: self._index_deps(name, deps)
+        return directive
+
+    def _clean_flags(self) -> SourceList:
+        """Replace markers in / deduplicate the raw flags, and record their group dependencies"""
+        deps = set()
+        flags = SourceList(self._expand('flags', 'flags', self._raw_flags, deps))
+        self._index_deps('flags', deps)
+        return flags
+
+    def _refresh_sections(self, names: Iterable[str]) -> List[str]:
+        """Re-clean the sections ``names`` from their raw values, and patch the cached policy (if any) with the result"""
+        names = list(dict.fromkeys(names))
+        for name in names:
+            for d in self._section_deps.pop(name, ()):
+                self.group_index[d].discard(name)
+            if name == 'flags':
+                self.flag_sources = self._clean_flags()
+            elif name in self._raw_sections:
+                self.directives[name] = self._clean_section(name, self._raw_sections[name])
+            else:
+                self.directives.pop(name, None)
+
+        if self._compiled is not None:
+            dirs, nonced = {}, {}
+            for name in names:
+                if name in self.excluded: continue
+                dirs[name] = self.str_section(name)
+                nonced[name] = self.str_section(name, nonce=NONCE_SLOT) if dirs[name] and self.has_nonce(name) else None
+            flags = [f + ';' for f in self.flag_sources] if 'flags' in names else None
+            if any(v is not None and k not in self._compiled.directives for k, v in dirs.items()):
+                # A directive was (re-)added, so it may belong in the middle of the policy - just recompile it
+                self._compiled = None
+            else:
+                self._compiled = self._compiled.replace(dirs, flags, nonced)
+        if self._raw_routes:
+            # Routes are layered over the main policy's raw sections, so they're simply re-cleaned
+            self._clean_routes()
+        return names
+
+    def set_group(self, name: str, value: Optional[str]) -> List[str]:
+        """
+        Set the value of the group ``name`` on this (live) builder, or remove the group if ``value`` is ``None``.
+
+        Only the groups which depend on ``name`` (directly, or through nested ``{{markers}}``), and the sections / flags
+        which use those groups, are re-resolved - and the cached :class:`.CompiledPolicy` is patched rather than recompiled.
+
+            >>> builder.set_group('cdn', 'https://cdn.privex.io https://cdn2.privex.io')
+            ['default-src', 'style-src', 'script-src', 'font-src', 'img-src', ...]
+
+        :return List[str] sections: The names of the sections (and/or ``flags``) which were updated
+        """
+        self.autoclean()
+        had_groups = 'groups' in self._raw
+        old = self._raw['groups'].get(name) if had_groups else None
+        self._set_config('groups', name, value)
+        self._groups = None
+        try:
+            changed = self.resolver.update(name, value)
+        except Exception:
+            self._set_config('groups', name, old)
+            if not had_groups: self._remove_config('groups')
+            raise
+        affected = set()
+        for g in changed:
+            affected.update(self.group_index.get(g, ()))
+        return self._refresh_sections(n for n in list(self._raw_sections) + ['flags'] if n in affected)
+
+    def remove_group(self, name: str) -> List[str]:
+        """Remove the group ``name`` from this builder - same as ``set_group(name, None)``"""
+        return self.set_group(name, None)
+
+    def set_section(self, section: str, key: str, value: Optional[str]) -> List[str]:
+        """
+        Set ``key`` within ``section`` (e.g. ``set_section('img-src', 'zones', "'self' {{images}}")``) on this (live)
+        builder, or remove the key if ``value`` is ``None``. Setting a key in ``groups`` is the same as :meth:`.set_group`.
+
+        Only ``section`` is re-resolved, and the cached :class:`.CompiledPolicy` is patched rather than recompiled.
+
+        :return List[str] sections: The names of the sections which were updated
+        """
+        if section == 'groups':
+            return self.set_group(key, value)
+        self.autoclean()
+        self._set_config(section, key, value)
+        if is_route(section):
+            self._raw_routes[section] = {**self._base_raw(section), **self._raw.get(section, {})}
+            self._clean_routes()
+            return [section]
+        if section == 'flags':
+            if key == 'flags': self._raw_flags = self._base_raw('flags').get('flags', '') if value is None else value
+        elif section in self._raw:
+            self._raw_sections[section] = {**self._base_raw(section), **self._raw[section]}
+        return self._refresh_sections([section])
+
+    def remove_section(self, section: str) -> List[str]:
+        """Remove the whole section ``section`` from this (live) builder"""
+        self.autoclean()
+        if section == 'groups':
+            for g in list(self.resolver.raw.keys()):
+                self.set_group(g, None)
+            self._remove_config(section)
+            return []
+        self._remove_config(section)
+        if is_route(section):
+            self._raw_routes.pop(section, None)
+            self._clean_routes()
+            return [section]
+        if section == 'flags':
+            self._raw_flags = ''
+        self._raw_sections.pop(section, None)
+        return self._refresh_sections([section])
+
+    def _set_config(self, section: str, key: str, value: Optional[str]):
+        """Set (or remove if ``value`` is None) ``key`` in ``section`` of the raw config, and :attr:`.config` if it's been built"""
+        if value is None:
+            self._raw.get(section, {}).pop(key, None)
+        else:
+            self._raw.setdefault(section, {})[key] = value
+        if self._config is not None:
+            if value is None:
+                if self._config.has_section(section):
+                    self._config.remove_option(section, key)
+                return
+            if not self._config.has_section(section):
+                self._config.add_section(section)
+            self._config.set(section, key, value)
+
+    def _remove_config(self, section: str):
+        self._raw.pop(section, None)
+        if self._config is not None:
+            self._config.remove_section(section)
+
+    def optimize_report(self) -> Dict[str, OptimizeResult]:
+        """
+        Return the sources which the optimizer (``optimize=True``) removed from each section, as an :class:`.OptimizeResult`
+        (``kept``, ``removed`` and ``bytes_saved``) - only including sections which had sources removed.
+        """
+        self.autoclean()
+        return {k: v for k, v in self.optimized.items() if v.removed and k in self.directives}
+
     def autoclean(self):
         if self.cleaned:
             return True
         return self.clean()
 
-    def str_section(self, name: str):
+    def has_nonce(self, name: str) -> bool:
+        """Returns ``True`` if the section ``name`` has a nonce slot enabled (``nonce = true``)"""
         self.autoclean()
-        sec = self.config_dict.get(name, None)
-        if not sec: return None
-        s = f"{name}{self.section_split}{sec.get('zones', '')}"
-        if is_true(sec.get('unsafe-eval', False)): s += " 'unsafe-eval'"
-        if is_true(sec.get('unsafe-inline', False)): s += " 'unsafe-inline'"
-        s += ';'
-        return s
-
-    def generate(self, output='list', sep=' ', **kwargs):
-        
-        secs = [self.str_section(s) for s in self.clean_sections]
-        secd = dict(zip(self.clean_sections, secs))
-        secd['flags'] = [s + ';' for s in self.flags.split()]
-        secs += secd['flags'] 
+        d = self.directives.get(name)
+        return d is not None and d.nonce
+
+    def str_section(self, name: str, nonce: str = None):
+        """
+        Render the section ``name`` into a CSP directive string. If the section has ``nonce = true``, and
+        ``nonce`` is passed, then ``'nonce-<nonce>'`` is added after the section's zones.
+        """
+        self.autoclean()
+        d = self.directives.get(name)
+        return None if d is None else d.render(self.section_split, nonce)
+
+    def compile(self) -> CompiledPolicy:
+        """
+        Render every section and flag into a :class:`.CompiledPolicy`, caching the result on this builder.
+
+        Subsequent calls return the cached policy, until the cache is cleared by :meth:`.invalidate`,
+        :meth:`.reload` or :meth:`.clean`. Compiling also releases the :class:`configparser.ConfigParser` behind
+        :attr:`.config`, if it was built.
+        """
+        if self._compiled is not None:
+            self._stats.incr('compile_cache_hits')
+            return self._compiled
+        self.autoclean()
+        self._stats.incr('compile_cache_misses')
+        t = perf_counter()
+        secd, nonced, split = {}, {}, self.section_split
+        for name, d in self.directives.items():
+            if name in self.excluded: continue
+            rendered = d.render(split)
+            if rendered is None: continue
+            secd[name] = rendered
+            if d.nonce:
+                nonced[name] = d.render(split, nonce=NONCE_SLOT)
+        self._compiled = CompiledPolicy(secd, [f + ';' for f in self.flag_sources], nonce_directives=nonced)
+        self._config = None
+        self._stats.lap('render', t)
+        return self._compiled
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        Return the time spent in each phase (in milliseconds) since this builder was created, and counters - see
+        :mod:`privex.cspgen.stats`. Counters which aren't needed to build the policy (nesting depth, tokens before /
+        after de-duplication) are only computed here, so collecting stats costs nothing when they aren't requested.
+
+            >>> builder.stats()['counters']['tokens_before_dedup']
+            212
+        """
+        self.autoclean()
+        res = self._stats.as_dict()
+        before = sum(self.resolver.count_tokens(v) for sec in self._raw_sections.values() for v in sec.values())
+        before += self.resolver.count_tokens(self._raw_flags) + sum(map(len, self.hash_sources.values()))
+        after = len(self.flag_sources) + sum(
+            len(d.sources or ()) + sum(len(v.split()) for _, v in d.options) for d in self.directives.values()
+        )
+        res['counters'].update(
+            groups=len(self.resolver.raw), directives=len(self.directives), routes=len(self.routes),
+            max_depth=self.resolver.depth(), tokens_before_dedup=before, tokens_after_dedup=after,
+        )
+        res['counters'] = dict(sorted(res['counters'].items()))
+        return res
+
+    def compile_routes(self) -> RouteTable:
+        """
+        Compile every route variant (see :mod:`privex.cspgen.routes`) into a :class:`.RouteTable` of
+        :class:`.CompiledPolicy` objects, with the main policy as it's default - caching the result on this builder.
+
+        Each variant is it's parent's policy with only the route's own directives replaced, so every unchanged
+        directive shares it's rendered string with the main policy.
+
+            >>> table = CSPBuilder('site.ini').compile_routes()
+            >>> table.lookup('/admin/users').header()
+            "default-src 'self' ...; script-src 'self'; ..."
+        """
+        policy = self.compile()
+        if self._route_table is not None and self._route_table.default is policy:
+            return self._route_table
+        table, split = RouteTable(policy), self.section_split
+        # self.routes is ordered parents first, so looking a prefix up before adding it returns it's parent's policy
+        for prefix, dirs in self.routes.items():
+            rendered, nonced, flags = {}, {}, None
+            for name, d in dirs.items():
+                if name == 'flags':
+                    flags = [f + ';' for f in d.sources]
+                    continue
+                if name in self.excluded: continue
+                rendered[name] = d.render(split)
+                nonced[name] = d.render(split, nonce=NONCE_SLOT) if rendered[name] and d.nonce else None
+            table[prefix] = table.lookup(prefix).replace(rendered, flags, nonced)
+        self._route_table = table
+        return table
+
+    def generate(self, output='list', sep=' ', nonce: str = None, **kwargs):
+        policy = self.compile()
         output = output.lower()
-        if output == 'list': return secs
-        if output == 'tuple': return tuple(secs)
-        if output in ['dict', 'dictionary', 'kv', 'keyval', 'map', 'mapping']: return secd
-        if output in ['str', 'string']:
-            sj = sep.join(secs)
-            if not sj.endswith(';'): sj += ';'
-            return sj
+        if nonce is not None and policy.has_nonce:
+            if output in ['str', 'string']: return policy.header_nonce(nonce, sep)
+            secs = [s.replace(NONCE_SLOT, nonce) for s in policy.nonce_sections]
+            if output in ['dict', 'dictionary', 'kv', 'keyval', 'map', 'mapping']:
+                return {**dict(zip(policy.directives.keys(), secs)), 'flags': list(policy.flags)}
+            return tuple(secs) if output == 'tuple' else secs
+        if output == 'list': return list(policy.sections)
+        if output == 'tuple': return policy.sections
+        if output in ['dict', 'dictionary', 'kv', 'keyval', 'map', 'mapping']: return policy.as_dict()
+        if output in ['str', 'string']: return policy.header(sep)
         raise ValueError(f"Supported: (str, string, list, tuple). Unsupported output type: {output}")
 
     def __str__(self):
-        return self.generate(output='str')
+        return self.compile().header()
 
     def __iter__(self):
-        yield from self.generate(output='list')
+        yield from self.compile().sections
 
     def __len__(self):
-        return len(self.generate(output='list'))
+        return len(self.compile().sections)
 
     def __getitem__(self, item:str):
         self.autoclean()
-        if item in self.sections:
-            return self.config_dict[item]
-        gend = self.generate(output='dict')
-        if item in gend:
-            return gend[item]
+        if item in self.directives:
+            return self.directives[item].as_dict()
+        policy = self.compile()
+        if item in policy.directives or item == 'flags':
+            return policy[item]
         if item in self.groups:
             return self.groups[item]
         raise KeyError(f"Item {item!r} not found in config sections, generated sections, or group keys...")
 
 
 def get_builder(name: str = None, file_handle = None, contents: Union[str, list, tuple] = None, **kwargs) -> CSPBuilder:
-    if empty(name) and file_handle is None and empty(contents, itr=True): name = argv[1]
+    if empty(name) and file_handle is None and empty(contents, itr=True): name = sys.argv[1]
     return CSPBuilder(name, file_handle, contents, **kwargs)
 
 
-COPYRIGHT = f"""
+_base_cache: Dict[Tuple[Path, bool], Tuple[Tuple[int, int], CSPBuilder]] = {}
+_base_lock = threading.RLock()
+
+
+def load_base(filename: Union[str, Path], strict: bool = False, _chain: Tuple[Path, ...] = ()) -> CSPBuilder:
+    """
+    Load a base INI file (referenced by ``extends = base.ini`` in the ``[cspgen]`` section of another INI), returning a
+    cleaned :class:`.CSPBuilder` for it.
+
+    Each base is only parsed and resolved once per process - the builder is cached, and shared read-only by every
+    builder which extends it. If the base file's mtime or size has changed since it was cached, it's loaded again.
+    """
+    path = Path(filename).resolve()
+    if path in _chain:
+        chain = [str(p) for p in _chain[_chain.index(path):]] + [str(path)]
+        raise ExtendsCycleError(f"INI files extend each other in a loop: {' -> '.join(chain)}", chain)
+    st = path.stat()
+    stat, key = (st.st_mtime_ns, st.st_size), (path, bool(strict))
+    with _base_lock:
+        cached = _base_cache.get(key)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        log.debug("Loading base INI file %s", path)
+        base = CSPBuilder(str(path), strict=strict, _extends_chain=_chain).clean()
+        _base_cache[key] = (stat, base)
+        return base
+
+
+_re_extends = re.compile(rb'^[ \t]*extends[ \t]*[=:][ \t]*(.+?)[ \t\r]*$', re.MULTILINE | re.IGNORECASE)
+
+
+def find_extends(data: bytes, base_dir: Union[str, Path]) -> List[Path]:
+    """
+    Quickly find the base INI files which the raw INI ``data`` extends (including bases of bases), without parsing it.
+    Relative paths are resolved against ``base_dir``. Files which don't exist are skipped.
+    """
+    found, todo = {}, [(data, Path(base_dir))]
+    while todo:
+        data, base_dir = todo.pop()
+        for m in _re_extends.finditer(data):
+            p = (base_dir / Path(os.fsdecode(m.group(1))).expanduser()).resolve()
+            if p in found: continue
+            try:
+                with open(p, 'rb') as fh:
+                    found[p] = fh.read()
+            except OSError:
+                continue
+            todo.append((found[p], p.parent))
+    return list(found)
+
+
+_re_hash_dirs = re.compile(rb'^[ \t]*hash-dirs[ \t]*[=:][ \t]*(.+?)[ \t\r]*$', re.MULTILINE | re.IGNORECASE)
+
+
+def _cache_key(source: Union[str, List[str], Tuple[str, ...]], cache, **options) -> str:
+    """Return the :class:`privex.cspgen.cache.PolicyCache` key for the INI file / lines ``source`` compiled with ``options``"""
+    is_lines = isinstance(source, (list, tuple))
+    if is_lines:
+        data = '\n'.join(source).encode('utf-8')
+    else:
+        with open(source, 'rb') as fh:
+            data = fh.read()
+    base_dir = Path.cwd() if is_lines else Path(source).resolve().parent
+    # Include the contents of any base INI files in the key, so that changing a base invalidates every INI extending it
+    for p in find_extends(data, base_dir):
+        data += b'\0' + os.fsencode(str(p)) + b'\0' + p.read_bytes()
+    # Likewise, if inline blocks are hashed from templates, changing / adding / removing a template invalidates the entry
+    dirs = [base_dir / os.fsdecode(d) for m in _re_hash_dirs.finditer(data) for d in m.group(1).split()]
+    dirs += [Path(d).expanduser() for d in options.get('hash_dirs', [])]
+    if dirs:
+        from privex.cspgen.hashes import find_templates, template_fingerprint
+        data += b'\0' + template_fingerprint(find_templates(dirs, ('*',)))
+    return cache.key(data, **{k: v for k, v in options.items() if k not in ('hash_jobs', 'hash_cache')})
+
+
+def _try_cache_key(source: Union[str, List[str], Tuple[str, ...]], cache, **options) -> Optional[str]:
+    """
+    Same as :func:`._cache_key`, but returns ``None`` if ``source`` (or a base / template it references) can't be read,
+    so that it's compiled uncached - behaving exactly the same as it would without a cache.
+    """
+    try:
+        return _cache_key(source, cache, **options)
+    except OSError as e:
+        log.debug("Not caching %s - failed to read it: %s - %s", source, type(e).__name__, e)
+        return None
+
+
+def compile_source(source: Union[str, List[str], Tuple[str, ...]], sep: str = ' ', cache=None, **kwargs) -> Tuple[str, List[str]]:
+    """
+    Compile a single config - either the filename of an INI file, or a list/tuple of config lines (e.g. from
+    :func:`.read_stdin`) - returning the header as a string (separated by ``sep``) and as a list of sections.
+
+    If ``cache`` (a :class:`privex.cspgen.cache.PolicyCache`) is passed, the config is looked up in the cache by a
+    hash of it's contents, and only compiled (then stored in the cache) if it's not already cached.
+
+    This is a plain top-level function, so that it can be used with a :class:`concurrent.futures.ProcessPoolExecutor`.
+    """
+    is_lines = isinstance(source, (list, tuple))
+    key = None if cache is None else _try_cache_key(source, cache, sep=sep, **kwargs)
+    if key is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            log.debug("Cache hit for %s (key %s)", 'stdin' if is_lines else source, key)
+            TOTALS.incr('policy_cache_hits')
+            return entry['str'], entry['list']
+        TOTALS.incr('policy_cache_misses')
+    builder = CSPBuilder(contents=source, **kwargs) if is_lines else CSPBuilder(source, **kwargs)
+    policy = builder.compile()
+    TOTALS.merge(builder.stats() if stats.DETAILED else builder._stats)
+    str_sec, list_sec = policy.header(sep), list(policy.sections)
+    if key is not None:
+        cache.set(key, str_sec, list_sec, policy.as_dict(), nonce=dict(policy.nonce_directives))
+    return str_sec, list_sec
+
+
+def compile_policy(source: Union[str, List[str], Tuple[str, ...]], cache=None, **kwargs) -> CompiledPolicy:
+    """
+    Same as :func:`.compile_source`, but returns the :class:`.CompiledPolicy` - e.g. to render it into several
+    formats (see :mod:`privex.cspgen.emitters`) from a single compile. Cache entries are shared with
+    :func:`.compile_source` calls using the default ``sep`` of ``' '``.
+    """
+    is_lines = isinstance(source, (list, tuple))
+    key = None if cache is None else _try_cache_key(source, cache, sep=' ', **kwargs)
+    if key is not None:
+        entry = cache.get(key)
+        if entry is not None and 'nonce' in entry:
+            log.debug("Cache hit for %s (key %s)", 'stdin' if is_lines else source, key)
+            TOTALS.incr('policy_cache_hits')
+            directives = dict(entry['dict'])
+            flags = directives.pop('flags', [])
+            return CompiledPolicy(directives, flags, nonce_directives=entry['nonce'])
+        TOTALS.incr('policy_cache_misses')
+    builder = CSPBuilder(contents=source, **kwargs) if is_lines else CSPBuilder(source, **kwargs)
+    policy = builder.compile()
+    TOTALS.merge(builder.stats() if stats.DETAILED else builder._stats)
+    if key is not None:
+        cache.set(key, policy.header(' '), list(policy.sections), policy.as_dict(), nonce=dict(policy.nonce_directives))
+    return policy
+
+
+def _parallel_map(func, items: Iterable, jobs: int = 1) -> Iterator:
+    """
+    Yield ``func(item)`` for each of ``items`` in order - across a pool of ``jobs`` processes if ``jobs`` is greater than 1
+    (``0`` / ``None`` for one per CPU core).
+
+    Lists / tuples are split into chunks with :meth:`.ProcessPoolExecutor.map`. Any other iterable (e.g. a generator
+    reading from stdin) is consumed lazily, with at most ``jobs * 2`` items in flight, so memory use stays constant.
+    """
+    jobs = (os.cpu_count() or 1) if not jobs else jobs
+    is_seq = isinstance(items, (list, tuple))
+    if jobs == 1 or (is_seq and len(items) < 2):
+        yield from map(func, items)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    if is_seq:
+        jobs = min(jobs, len(items))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield from pool.map(func, items, chunksize=max(1, len(items) // (jobs * 4)))
+        return
+    from collections import deque
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_compile(sources: List[Union[str, List[str]]], sep: str = ' ', jobs: int = 1, **kwargs) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Compile each config in ``sources`` using :func:`.compile_source`, yielding each result in the same order as ``sources``,
+    as soon as it (and every result before it) is ready.
+
+    When ``jobs`` is greater than 1 (or ``0`` / ``None`` for one job per CPU core), the configs are compiled across a
+    pool of ``jobs`` processes.
+    """
+    yield from _parallel_map(partial(compile_source, sep=sep, **kwargs), sources, jobs)
+
+
+def compile_document(doc: Tuple[Any, List[str]], sep: str = ' ', **kwargs) -> Tuple[Any, Optional[str], Optional[str]]:
+    """
+    Compile a single ``(index, lines)`` INI document (see :func:`.iter_compile_documents`), returning
+    ``(doc_id, header, error)`` - where ``doc_id`` is the ``id`` from the document's ``[cspgen]`` section (or ``index``),
+    and either ``header`` or ``error`` is ``None``.
+    """
+    index, lines = doc
+    doc_id = document_id(lines, index)
+    try:
+        return doc_id, compile_source(lines, sep, **kwargs)[0], None
+    except Exception as e:
+        return doc_id, None, f"{type(e).__name__}: {e}"
+
+
+def iter_compile_documents(documents: Iterable[List[str]], sep: str = ' ', jobs: int = 1,
+                           **kwargs) -> Iterator[Tuple[Any, Optional[str], Optional[str]]]:
+    """
+    Compile a stream of INI documents (e.g. from :func:`.iter_documents`), yielding ``(doc_id, header, error)`` for each
+    one in order, as soon as it's ready (see :func:`.compile_document`). A document which fails to compile doesn't
+    stop the stream - it's yielded with ``error`` set instead.
+
+    The documents are consumed lazily, so this runs in constant memory no matter how many documents are streamed.
+    """
+    yield from _parallel_map(partial(compile_document, sep=sep, **kwargs), enumerate(documents), jobs)
+
+
+def get_copyright() -> str:
+    """Return the (coloured) version + copyright text shown by ``csp-gen --version``"""
+    from colorama import Fore
+    return f"""
     {Fore.GREEN}Content Security Policy (CSP) Generator{Fore.RESET}
         
         {Fore.CYAN}Version: v{version.VERSION}
@@ -202,9 +1114,32 @@ COPYRIGHT = f"""
         (C) 2021 Privex Inc. ( https://www.privex.io ){Fore.RESET}
 """
 
-parser = ErrHelpParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    epilog=textwrap.dedent(f"""
+
+def read_example_file() -> Tuple[str, Path]:
+    with open(EXAMPLE_INI, 'r') as fh:
+        data = fh.read()
+    return data, EXAMPLE_INI
+
+
+_parser = None
+
+
+def get_parser():
+    """
+    Build the ``csp-gen`` argument parser on first use, so that argparse, colorama and privex-helpers are only
+    imported when the CLI is actually being used - not when :class:`.CSPBuilder` is imported as a library.
+    """
+    global _parser
+    if _parser is not None:
+        return _parser
+    import argparse
+    import textwrap
+    from colorama import Fore
+    from privex.helpers import ErrHelpParser
+    COPYRIGHT = get_copyright()
+    parser = ErrHelpParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=textwrap.dedent(f"""
 {COPYRIGHT}
     
 
@@ -214,8 +1149,7 @@ parser = ErrHelpParser(
     per "type", and two special headers:{Fore.RESET}
         {Fore.BLUE}
         'groups' - Groups of variables that can be used in each type's 'zones = ' key, AND can also include
-                   other group names (as long as the included vars are defined higher up, and doesn't include
-                   the var including it).
+                   other group names (as long as the included var doesn't include the var including it).
 
         'flags'  - Contains "flags", which are CSP strings that standalone, such as 'upgrade-insecure-requests',
                    instead of being a key with zones as a value.
@@ -258,42 +1192,190 @@ parser = ErrHelpParser(
     {Fore.GREEN}End of config{Fore.RESET}
 
     """),
-)
+    )
 
+    parser.add_argument('--section-sep', type=str, default=' ', dest='section_sep',
+                        help="Separator between each CSP section (default-src, media-src, img-src etc.) - Textual \\n, \\r, and \\t will "
+                             "be auto-converted into the literal characters for newline/carriage return/tab")
+    parser.add_argument('--file-sep', type=str, default='\n\n', dest='file_sep', help="Separator used between each file's config output")
+    parser.add_argument('--version', '-V', action='store_true', default=False, dest='show_version', help="Show version + copyright info")
+    parser.add_argument('--verbose', '-v', action='store_true', default=False, dest='verbose_mode', help="Verbose Mode - Show DEBUG logs")
+    parser.add_argument('--example', '-E', action='store_true', default=False, dest='show_example',
+                        help="Output the template example.ini to STDOUT for use as a CSP INI config template")
+    parser.add_argument('--jobs', '-j', type=int, default=1, dest='jobs',
+                        help="Compile the INI files across this many processes (0 = one per CPU core). Output order is unchanged.")
+    parser.add_argument('--stream', '-s', action='store_true', default=False, dest='stream',
+                        help="Write each file's policy as soon as it's compiled, instead of after all files are compiled")
+    parser.add_argument('--output', '-o', type=str, default=None, dest='output',
+                        help="Atomically write the output to this file instead of stdout. If it contains {name}, each INI file is "
+                             "written to it's own file, with {name} replaced by the INI's filename (minus extension)")
+    parser.add_argument('--watch', '-w', action='store_true', default=False, dest='watch',
+                        help="Keep running, and recompile each INI file into --output whenever it changes")
+    parser.add_argument('--debounce', type=float, default=0.5, dest='debounce',
+                        help="(--watch) Wait until files haven't changed for this many seconds before recompiling")
+    parser.add_argument('--reload-cmd', type=str, default=None, dest='reload_cmd',
+                        help="(--watch) Shell command to run after each successful write, e.g. 'nginx -s reload'")
+    parser.add_argument('--poll', type=float, default=None, dest='poll_interval',
+                        help="(--watch) Poll the files for changes every N seconds, instead of using inotify")
+    parser.add_argument('--multi', '-M', action='store_true', default=False, dest='multi_doc',
+                        help="Read a stream of INI documents from stdin, separated by --doc-sep, writing each document's policy "
+                             "as soon as it's compiled")
+    parser.add_argument('--doc-sep', type=str, default='---', dest='doc_sep',
+                        help="(--multi) Line which separates each INI document on stdin (default: ---)")
+    parser.add_argument('--ndjson', action='store_true', default=False, dest='ndjson',
+                        help="Output one JSON object per line: {\"id\": ..., \"header\": ...} - the id is the INI's filename, or "
+                             "for --multi, the 'id' key in the document's [cspgen] section (or it's position in the stream). With "
+                             "--evaluate, output the counts as a single JSON object")
+    parser.add_argument('--optimize', '-O', action='store_true', default=False, dest='optimize',
+                        help="Remove sources which are already covered by broader sources in the same directive (e.g. "
+                             "https://www.privex.io when *.privex.io is allowed), without changing what the policy allows")
+    parser.add_argument('--optimize-report', action='store_true', default=False, dest='optimize_report',
+                        help="Instead of outputting the policies, show how many bytes --optimize saves in each directive, "
+                             "and which sources it removes")
+    parser.add_argument('--cache', action='store_true', default=None, dest='use_cache',
+                        help="Cache compiled policies on disk, so unchanged INI files are only compiled once (off by default)")
+    parser.add_argument('--cache-dir', type=str, default=None, dest='cache_dir',
+                        help="Cache compiled policies in this folder - implies --cache (default: $CSPGEN_CACHE_DIR or ~/.cache/cspgen)")
+    parser.add_argument('--cache-size', type=float, default=32, dest='cache_size',
+                        help="Maximum size of the cache in MiB - the least recently used entries are evicted beyond this")
+    parser.add_argument('--no-cache', action='store_false', dest='use_cache',
+                        help="Don't read or write the compiled policy cache, even if --cache-dir is set")
+    parser.add_argument('--emit', type=str, action='append', default=[], dest='emit',
+                        help="Render the policies as FORMAT[:PATH] - one of nginx, apache, haproxy, json, ndjson or header - "
+                             "written to PATH (which may contain {name}), or stdout. Can be repeated to emit several "
+                             "formats from one compile")
+    parser.add_argument('--report-only', action='store_true', default=False, dest='report_only',
+                        help="(--emit) Use the Content-Security-Policy-Report-Only header instead of Content-Security-Policy")
+    parser.add_argument('--hash-dir', type=str, action='append', default=[], dest='hash_dirs',
+                        help="Add the hashes of the inline <script> / <style> blocks in the templates within this folder to "
+                             "script-src / style-src (can be repeated, and is added to 'hash-dirs' in the INI's [cspgen] section)")
+    parser.add_argument('--hash-jobs', type=int, default=1, dest='hash_jobs',
+                        help="Hash changed templates across this many processes (0 = one per CPU core)")
+    parser.add_argument('--validate', action='store_true', default=False, dest='validate',
+                        help="Only validate the INI files against the CSP grammar - print any invalid directives / sources "
+                             "(with their file and line), and exit with status 1 if there are any errors")
+    parser.add_argument('--stats', action='store_true', default=False, dest='show_stats',
+                        help="Print the time spent in each phase (reading, resolving groups, de-duplicating, rendering...) "
+                             "and counters such as markers expanded and cache hits to stderr once done (implies -j 1)")
+    parser.add_argument('--profile', type=str, default=None, dest='profile', metavar='FILE',
+                        help="Profile the run with cProfile, and write the stats to FILE (for pstats / snakeviz)")
+    parser.add_argument('--evaluate', type=str, default=None, dest='evaluate', metavar='LOGFILE',
+                        help="Evaluate each 'directive URL' line of LOGFILE against the policy (across --jobs processes), and "
+                             "print how many requests each directive allows / blocks, and the most blocked origins")
+    parser.add_argument('--origin', type=str, default=None, dest='origin',
+                        help="With --evaluate: the origin of the protected site (e.g. https://www.privex.io), which 'self' "
+                             "and scheme-less sources are matched against")
+    parser.add_argument('--directive', type=str, default=None, dest='directive',
+                        help="With --evaluate: LOGFILE only contains URLs, which are all evaluated against this directive")
+    parser.add_argument('--top', type=int, default=10, dest='top',
+                        help="With --evaluate: how many of the most blocked origins to show (default: 10)")
+    parser.add_argument('filenames', nargs='*', default=[], help="One or more INI files to parse into CSP configs")
+    _parser = parser
+    return parser
+
+
+def __getattr__(name: str):
+    # Lazily build the module attributes 'parser' and 'COPYRIGHT' for backwards compatibility
+    if name == 'parser':
+        return get_parser()
+    if name == 'COPYRIGHT':
+        return get_copyright()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def setup_logging(level: Union[str, int] = None):
+    """Attach a stderr console handler to the ``privex.cspgen`` logger (used by the CLI - library users configure their own logging)"""
+    from privex.loghelper import LogHelper
+    level = log_level if level is None else level
+    _lh = LogHelper('privex.cspgen', handler_level=logging.getLevelName(level) if isinstance(level, str) else level)
+    _lh.add_console_handler(stream=sys.stderr)
+    return _lh.get_logger()
 
-def read_example_file() -> Tuple[str, Path]:
-    with open(EXAMPLE_INI, 'r') as fh:
-        data = fh.read()
-    return data, EXAMPLE_INI
 
+def stream_documents(stream, delimiter: str = '---', sep: str = ' ', file_sep: str = '\n\n', ndjson: bool = False,
+                     jobs: int = 1, out=None, **kwargs) -> int:
+    """
+    Compile a stream of INI documents separated by ``delimiter`` lines (see :func:`.iter_documents`), writing each
+    policy to ``out`` (default: stdout) as soon as it's compiled - either separated by ``file_sep``, or if ``ndjson`` is
+    True, as one ``{"id": ..., "header": ...}`` JSON object per line (``{"id": ..., "error": ...}`` for failures).
 
-parser.add_argument('--section-sep', type=str, default=' ', dest='section_sep',
-                    help="Separator between each CSP section (default-src, media-src, img-src etc.) - Textual \\n, \\r, and \\t will "
-                         "be auto-converted into the literal characters for newline/carriage return/tab")
-parser.add_argument('--file-sep', type=str, default='\n\n', dest='file_sep', help="Separator used between each file's config output")
-parser.add_argument('--version', '-V', action='store_true', default=False, dest='show_version', help="Show version + copyright info")
-parser.add_argument('--verbose', '-v', action='store_true', default=False, dest='verbose_mode', help="Verbose Mode - Show DEBUG logs")
-parser.add_argument('--example', '-E', action='store_true', default=False, dest='show_example',
-                    help="Output the template example.ini to STDOUT for use as a CSP INI config template")
-parser.add_argument('filenames', nargs='*', default=[], help="One or more INI files to parse into CSP configs")
+    :return int failed: The number of documents which failed to compile
+    """
+    import json
+    out = sys.stdout if out is None else out
+    failed, written = 0, 0
+    for doc_id, header, error in iter_compile_documents(iter_documents(stream, delimiter), sep=sep, jobs=jobs, **kwargs):
+        if error is not None:
+            failed += 1
+            log.error("Failed to compile document %r - %s", doc_id, error)
+        if ndjson:
+            out.write(json.dumps(dict(id=doc_id, header=header) if error is None else dict(id=doc_id, error=error)) + '\n')
+        elif error is None:
+            out.write((file_sep if written > 0 else '') + header)
+            written += 1
+        out.flush()
+    if not ndjson and written > 0:
+        out.write('\n')
+    return failed
+
+
+def print_optimize_report(sources: List[Union[str, List[str]]], out=None, **builder_kwargs):
+    """
+    Print how many bytes the optimizer saves in each directive of each config in ``sources``, and which sources it removes.
+
+    Any ``builder_kwargs`` (e.g. ``hash_dirs``) are passed through to each :class:`.CSPBuilder`, so the report matches
+    what the CLI would output with the same options.
+    """
+    out = sys.stdout if out is None else out
+    builder_kwargs = {**builder_kwargs, 'optimize': True}
+    for src in sources:
+        builder = CSPBuilder(contents=src, **builder_kwargs) if isinstance(src, list) else CSPBuilder(src, **builder_kwargs)
+        report = builder.optimize_report()
+        out.write(f"{'stdin' if isinstance(src, list) else src}:\n")
+        for name, res in report.items():
+            out.write(f"    {name}: saved {res.bytes_saved} bytes by removing {len(res.removed)} sources: {' '.join(res.removed)}\n")
+        total = sum(res.bytes_saved for res in report.values())
+        out.write(f"    Total: saved {total} bytes ({len(str(builder))} bytes after optimizing)\n\n")
+    out.flush()
 
 
 def main():
-    global log
+    parser = get_parser()
     try:
         vargs = parser.parse_args()
     except Exception as e:
         parser.error(f"{type(e)} - {str(e)}")
         return sys.exit(1)
-    if vargs.verbose_mode:
-        _lh2 = LogHelper('privex.cspgen', handler_level=logging.DEBUG)
-        _lh2.add_console_handler(stream=sys.stderr)
-        log = _lh2.get_logger()
+    setup_logging(logging.DEBUG if vargs.verbose_mode else log_level)
         
-    log.debug(f"parser args: {vargs!r}")
+    log.debug("parser args: %r", vargs)
+    if vargs.show_stats:
+        stats.DETAILED = True
+        if vargs.jobs != 1:
+            log.warning("--stats only collects stats from this process - ignoring --jobs %s", vargs.jobs)
+            vargs.jobs = 1
+    prof = None
+    if vargs.profile:
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+    try:
+        return _run(parser, vargs)
+    finally:
+        if prof is not None:
+            prof.disable()
+            prof.dump_stats(vargs.profile)
+            print(f"Wrote cProfile output to {vargs.profile} - view it with: python3 -m pstats {vargs.profile}", file=sys.stderr)
+        if vargs.show_stats:
+            print(TOTALS.format(), file=sys.stderr)
+
+
+def _run(parser, vargs):
+    """Run the ``csp-gen`` command for the parsed arguments ``vargs`` (see :func:`.main`)"""
     if vargs.show_version:
-        oprint(COPYRIGHT)
-        return COPYRIGHT
+        copyright_text = get_copyright()
+        oprint(copyright_text)
+        return copyright_text
     if vargs.show_example:
         exfile, expath = read_example_file()
         exnote = "#####", "#", "# Privex CSPGen example.ini file", f"# Original Location within Python Package: {expath}", "#", "#####\n"
@@ -303,25 +1385,128 @@ def main():
     file_sep, sec_sep = literal(vargs.file_sep), literal(vargs.section_sep)
     str_secs = []
     list_secs = []
+    sources = []
+    cache = None
+    # The cache is opt-in - enabled by --cache or --cache-dir, unless --no-cache is passed
+    if vargs.use_cache or (vargs.use_cache is None and vargs.cache_dir is not None):
+        from privex.cspgen.cache import PolicyCache
+        cache = PolicyCache(vargs.cache_dir, max_size=int(vargs.cache_size * 1024 * 1024))
+    builder_kwargs = dict(cache=cache)
+    if vargs.optimize:
+        builder_kwargs['optimize'] = True
+    if vargs.hash_dirs:
+        builder_kwargs['hash_dirs'] = vargs.hash_dirs
+    if vargs.hash_jobs != 1:
+        builder_kwargs['hash_jobs'] = vargs.hash_jobs
+    if cache is not None:
+        # Persist template hashes alongside the compiled policies, so re-runs only hash the templates which changed
+        from privex.cspgen.hashes import HashCache
+        builder_kwargs['hash_cache'] = HashCache(cache.cache_dir / 'hashes.json')
+    if vargs.watch:
+        from privex.cspgen.watch import watch_files
+        if empty(vargs.output) or empty(filenames, itr=True) or any(fn in ['-', '/dev/stdin', 'STDIN'] for fn in filenames):
+            parser.error("--watch requires --output, and one or more INI filenames (stdin cannot be watched)")
+            return sys.exit(1)
+        return watch_files(
+            filenames, vargs.output, sep=sec_sep, file_sep=file_sep, debounce=vargs.debounce, reload_cmd=vargs.reload_cmd,
+            poll_interval=empty_if(vargs.poll_interval, 1.0), use_inotify=vargs.poll_interval is None, **builder_kwargs,
+        )
+    if vargs.multi_doc:
+        if any(fn not in ['-', '/dev/stdin', 'STDIN'] for fn in filenames) or not empty(vargs.output):
+            parser.error("--multi reads INI documents from stdin - it can't be combined with INI filenames or --output")
+            return sys.exit(1)
+        if sys.stdin.isatty():
+            parser.error("--multi was specified, but no data was piped to stdin")
+            return sys.exit(1)
+        if stream_documents(sys.stdin, literal(vargs.doc_sep), sec_sep, file_sep, vargs.ndjson, vargs.jobs, **builder_kwargs) > 0:
+            return sys.exit(1)
+        return list_secs, str_secs
     if empty(filenames, itr=True):
         if sys.stdin.isatty():
             parser.error("No filenames specified, and no data piped to stdin")
             return sys.exit(1)
         log.debug("Assuming config piped via STDIN. Reading config from stdin.")
-        confd = read_stdin()
-        builder = get_builder(contents=confd)
-        str_secs += [builder.generate('string', sep=sec_sep)]
-        list_secs += [builder.generate('list')]
+        sources.append(read_stdin())
     else:
         for fn in filenames:
             if fn in ['-', '/dev/stdin', 'STDIN']:
                 log.debug("Assuming config piped via STDIN. Reading config from stdin.")
-                builder = get_builder(contents=read_stdin())
+                sources.append(read_stdin())
             else:
-                builder = get_builder(fn)
+                sources.append(fn)
+
+    if vargs.optimize_report:
+        print_optimize_report(sources, **builder_kwargs)
+        return list_secs, str_secs
+
+    if vargs.validate:
+        from privex.cspgen.validate import validate_sources
+        if validate_sources(sources, jobs=vargs.jobs, **builder_kwargs) > 0:
+            return sys.exit(1)
+        return list_secs, str_secs
+
+    if vargs.evaluate:
+        if len(sources) != 1:
+            parser.error("--evaluate tests a single policy - specify exactly one INI file")
+            return sys.exit(1)
+        from privex.cspgen.evaluate import PolicyEvaluator, evaluate_file
+        try:
+            src = sources[0]
+            builder = CSPBuilder(contents=src, **builder_kwargs) if isinstance(src, list) else CSPBuilder(src, **builder_kwargs)
+            evaluator = PolicyEvaluator.from_builder(builder, origin=vargs.origin)
+        except ValueError as e:
+            parser.error(str(e))
+            return sys.exit(1)
+        result = evaluate_file(vargs.evaluate, evaluator, jobs=vargs.jobs, directive=vargs.directive)
+        if vargs.ndjson:
+            import json
+            oprint(json.dumps(result.as_dict(vargs.top)))
+        else:
+            oprint(result.format(vargs.top))
+        return result
+
+    if vargs.emit:
+        from privex.cspgen.emitters import emit_targets, parse_target
+        try:
+            for t in vargs.emit: parse_target(t)
+        except KeyError as e:
+            parser.error(str(e.args[0]))
+            return sys.exit(1)
+        if emit_targets(sources, vargs.emit, jobs=vargs.jobs, report_only=vargs.report_only, **builder_kwargs) > 0:
+            return sys.exit(1)
+        return list_secs, str_secs
+
+    compiled = iter_compile(sources, sep=sec_sep, jobs=vargs.jobs, **builder_kwargs)
+    if not empty(vargs.output):
+        from privex.cspgen.watch import output_path, write_output
+        per_file = '{name}' in vargs.output
+        for src, (str_sec, list_sec) in zip(sources, compiled):
+            if per_file:
+                write_output(output_path(vargs.output, 'stdin' if isinstance(src, list) else src), str_sec)
+            str_secs.append(str_sec)
+            list_secs.append(list_sec)
+        if not per_file:
+            write_output(Path(vargs.output), file_sep.join(str_secs))
+        return list_secs, str_secs
+
+    if vargs.ndjson:
+        import json
+        for src, (str_sec, _) in zip(sources, compiled):
+            sys.stdout.write(json.dumps(dict(id='stdin' if isinstance(src, list) else src, header=str_sec)) + '\n')
+            sys.stdout.flush()
+        return list_secs, str_secs
+
+    if vargs.stream:
+        # Write each policy as soon as it's ready, without holding the results in memory
+        for i, (str_sec, _) in enumerate(compiled):
+            sys.stdout.write((file_sep if i > 0 else '') + str_sec)
+            sys.stdout.flush()
+        sys.stdout.write('\n')
+        return list_secs, str_secs
 
-            str_secs += [builder.generate('string', sep=sec_sep)]
-            list_secs += [builder.generate('list')]
+    for str_sec, list_sec in compiled:
+        str_secs.append(str_sec)
+        list_secs.append(list_sec)
 
     # oprint('file_sep: ', repr(file_sep))
     # oprint('sec_sep: ', repr(sec_sep))
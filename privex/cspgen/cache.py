@@ -0,0 +1,208 @@
+"""
+Content-addressed on-disk cache of compiled policies, used by :func:`.compile_source` and the ``csp-gen`` CLI.
+
+Each entry is keyed by a SHA-256 hash of the INI file's bytes, the cspgen version, and the options which affect the
+output (e.g. ``--section-sep``), and stores the compiled policy as a string, list and dict - so a cache hit skips
+parsing and marker resolution entirely. Entries are small JSON files, written atomically, so the cache can be safely
+shared between concurrent ``csp-gen`` processes.
+
+The total size of the cache is bounded - once it grows over ``max_size`` bytes, the least recently used entries
+(by mtime, which is updated on each hit) are removed. The cache folder is only scanned once per :class:`.PolicyCache`
+to find it's size, which is then kept up to date as entries are written - so storing N entries doesn't cost N scans.
+
+    >>> cache = PolicyCache('/tmp/cspgen-cache')
+    >>> key = cache.key(b'[default-src]\\nzones = self\\n', sep=' ')
+    >>> cache.get(key) is None
+    True
+
+"""
+import hashlib
+import json
+import logging
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from privex.cspgen import version
+from privex.cspgen.helpers import atomic_write
+
+log = logging.getLogger(__name__)
+
+__all__ = ['DEFAULT_MAX_SIZE', 'EVICT_TO', 'default_cache_dir', 'PolicyCache']
+
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+"""Default maximum total size of the cache in bytes (32 MiB)"""
+
+EVICT_TO = 0.9
+"""When the cache grows over ``max_size``, entries are evicted until it's this fraction of ``max_size``, so that a full cache isn't re-scanned on every write"""
+
+_ENTRY_SUFFIX = '.json'
+
+
+def default_cache_dir() -> Path:
+    """
+    Return the default cache folder - ``$CSPGEN_CACHE_DIR`` if set, otherwise ``cspgen`` within ``$XDG_CACHE_HOME``
+    (defaulting to ``~/.cache``).
+    """
+    if os.environ.get('CSPGEN_CACHE_DIR'):
+        return Path(os.environ['CSPGEN_CACHE_DIR']).expanduser()
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache').expanduser() / 'cspgen'
+
+
+class PolicyCache:
+    """
+    A size-bounded, content-addressed cache of compiled policies stored as JSON files within ``cache_dir``.
+
+    Errors reading or writing the cache are logged and treated as cache misses - a broken cache never stops a
+    policy from being compiled.
+
+    :param cache_dir: The folder to store cache entries in (default: :func:`.default_cache_dir`)
+    :param int max_size: Evict the least recently used entries once the cache is larger than this many bytes
+    """
+    def __init__(self, cache_dir: Union[str, PathLike] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = default_cache_dir() if cache_dir is None else Path(cache_dir).expanduser()
+        self.max_size = max_size
+        self._size: Optional[int] = None
+        """The running total size of the cache in bytes - ``None`` until the cache folder has been scanned"""
+
+    @staticmethod
+    def key(data: bytes, **options) -> str:
+        """
+        Return the cache key for the config ``data`` when compiled with ``options`` (e.g. ``sep``, or any
+        :class:`.CSPBuilder` keyword arguments). Options must be JSON serializable, or have a stable ``repr``.
+        """
+        h = hashlib.sha256()
+        h.update(f"cspgen {version.VERSION}\n".encode('utf-8'))
+        h.update(json.dumps(options, sort_keys=True, default=repr).encode('utf-8') + b'\n')
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key: str) -> Path:
+        """Return the path to the entry file for ``key`` - entries are split into sub-folders by the first 2 hex chars"""
+        return self.cache_dir / key[:2] / f"{key}{_ENTRY_SUFFIX}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the entry stored under ``key`` (a dict with the keys ``str``, ``list``, ``dict`` and optionally ``nonce``),
+        or ``None`` if there's no such entry. Refreshes the entry's mtime, so that it's treated as recently used.
+        """
+        p = self.path(key)
+        try:
+            with open(p, 'rb') as fh:
+                entry = json.loads(fh.read().decode('utf-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable cache entry %s - reason: %s - %s", p, type(e).__name__, e)
+            self._unlink(p)
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != version.VERSION or not all(k in entry for k in ('str', 'list', 'dict')):
+            log.debug("Ignoring invalid / outdated cache entry %s", p)
+            self._unlink(p)
+            return None
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key: str, str_sec: str, list_sec: List[str], dict_sec: Dict[str, Union[str, List[str]]],
+            nonce: Dict[str, str] = None) -> bool:
+        """
+        Store the string, list and dict forms of a compiled policy under ``key`` (plus it's nonce directives, if
+        passed), then evict old entries if the cache has grown over :attr:`.max_size`.
+
+        The size of the cache is tracked as entries are written, so the cache folder is only re-scanned when the running
+        total goes over :attr:`.max_size` (entries written by other processes are picked up by that scan) - and then
+        evicts down to :data:`.EVICT_TO` of :attr:`.max_size`.
+
+        :return bool stored: ``True`` if the entry was written successfully
+        """
+        p = self.path(key)
+        entry = dict(version=version.VERSION, str=str_sec, list=list_sec, dict=dict_sec)
+        if nonce is not None:
+            entry['nonce'] = nonce
+        data = json.dumps(entry, separators=(',', ':'))
+        if self._size is None:
+            self._size = self.size()
+        try:
+            old_size = p.stat().st_size
+        except OSError:
+            old_size = 0
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(p, data)
+        except OSError as e:
+            log.warning("Failed to write cache entry %s - reason: %s - %s", p, type(e).__name__, e)
+            return False
+        self._size += len(data.encode('utf-8')) - old_size
+        if self._size > self.max_size:
+            self.evict(int(self.max_size * EVICT_TO))
+        return True
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        try:
+            subdirs = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return entries
+        for d in subdirs:
+            if not d.is_dir():
+                continue
+            try:
+                files = list(os.scandir(d.path))
+            except FileNotFoundError:
+                continue
+            for f in files:
+                if not f.name.endswith(_ENTRY_SUFFIX):
+                    continue
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, Path(f.path)))
+        return entries
+
+    def size(self) -> int:
+        """Return the total size of every entry in the cache, in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_size: int = None) -> int:
+        """
+        Remove the least recently used entries until the cache is no larger than ``max_size`` bytes
+        (default: :attr:`.max_size`).
+
+        :return int removed: The number of entries removed
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        self._size = total
+        if total <= max_size:
+            return 0
+        removed = 0
+        for _, size, p in sorted(entries):
+            if total <= max_size:
+                break
+            if self._unlink(p):
+                removed += 1
+            total -= size
+        self._size = total
+        log.debug("Evicted %d entries from the cache %s", removed, self.cache_dir)
+        return removed
+
+    def clear(self) -> int:
+        """Remove every entry from the cache, returning the number of entries removed"""
+        return self.evict(0)
+
+    @staticmethod
+    def _unlink(p: Path) -> bool:
+        try:
+            os.unlink(p)
+            return True
+        except OSError:
+            return False
+
+    def __repr__(self):
+        return f"<{type(self).__name__} cache_dir={str(self.cache_dir)!r} max_size={self.max_size}>"
@@ -0,0 +1,200 @@
+"""
+Emitters which render compiled policies into ready-to-include web server config, or JSON - so the policy can be
+served from static config, with no work done by the application at all.
+
+    >>> policy = CSPBuilder('site.ini').compile()
+    >>> print(emit('nginx', [('site', policy)]))
+    add_header Content-Security-Policy "default-src 'self' https://www.privex.io; upgrade-insecure-requests;" always;
+    >>> print(emit('apache', [('site', policy)], report_only=True))
+    Header always set Content-Security-Policy-Report-Only "default-src 'self' https://www.privex.io; upgrade-insecure-requests;"
+
+Each emitter escapes the header for it's target's config syntax. Characters which can't appear in a header value
+(newlines, NUL etc.), or can't be safely expressed in the target's syntax (``$`` for nginx), raise :class:`ValueError`
+rather than producing a config which the server would misread.
+
+Static config can't generate a fresh nonce per request, so any nonce slots are left out of the emitted headers (the
+same as :meth:`.CompiledPolicy.header`).
+
+From the CLI, pass ``--emit FORMAT[:PATH]`` once per target - every target is rendered from the same compile::
+
+    csp-gen site.ini --emit nginx:/etc/nginx/csp.conf --emit apache:/etc/apache2/csp.conf --emit json
+
+"""
+import json
+import logging
+import sys
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from privex.cspgen.builder import CompiledPolicy, _parallel_map, compile_policy
+from privex.cspgen.middleware import HEADER_CSP, HEADER_CSP_REPORT_ONLY
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'EMITTERS', 'header_name', 'check_header', 'emit_nginx', 'emit_apache',
+    'emit_haproxy', 'emit_json', 'emit_ndjson', 'emit_header', 'emit',
+    'parse_target', 'emit_targets'
+]
+
+_INVALID_CHARS = {chr(c) for c in range(0x20) if c != 0x09} | {'\x7f'}
+
+# Characters which must be escaped within a double quoted string, for each target
+_ESCAPE_NGINX = {'\\': '\\\\', '"': '\\"'}
+_ESCAPE_APACHE = {**_ESCAPE_NGINX, '%': '%%'}
+_ESCAPE_HAPROXY = {**_ESCAPE_NGINX, '$': '\\$', '%': '%%'}
+
+
+def header_name(report_only: bool = False) -> str:
+    """Return the CSP header name - ``Content-Security-Policy``, or ``Content-Security-Policy-Report-Only``"""
+    return HEADER_CSP_REPORT_ONLY if report_only else HEADER_CSP
+
+
+def check_header(value: str, target: str = 'header') -> str:
+    """Raise :class:`ValueError` if ``value`` contains characters which aren't allowed within a HTTP header value"""
+    bad = _INVALID_CHARS.intersection(value)
+    if bad:
+        raise ValueError(
+            f"Cannot emit {target} config - the header contains characters not allowed in a HTTP header: "
+            f"{', '.join(sorted(repr(c) for c in bad))}. Did you use a --section-sep containing a newline?"
+        )
+    return value
+
+
+def _quote(value: str, escapes: Dict[str, str]) -> str:
+    return '"' + ''.join(escapes.get(c, c) for c in value) + '"'
+
+
+def _headers(policies: Iterable[Tuple[str, CompiledPolicy]], target: str) -> List[Tuple[str, str]]:
+    res = []
+    for name, policy in policies:
+        if policy.has_nonce:
+            log.warning("Policy %s contains nonce slots - static %s config can't use per-request nonces, so they're left out",
+                        name, target)
+        res.append((name, check_header(policy.header(' '), target)))
+    return res
+
+
+def emit_nginx(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """
+    Render ``add_header`` directives for nginx (one per policy), with ``always`` so they're added to error responses too.
+
+    :raises ValueError: If a header contains ``$`` - nginx would treat it as a variable, and has no way to escape it
+    """
+    lines = []
+    for name, header in _headers(policies, 'nginx'):
+        if '$' in header:
+            raise ValueError(f"Cannot emit nginx config for {name} - nginx can't escape the '$' in the policy: {header!r}")
+        lines.append(f"add_header {header_name(report_only)} {_quote(header, _ESCAPE_NGINX)} always;")
+    return '\n'.join(lines)
+
+
+def emit_apache(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """Render ``Header always set`` directives for Apache httpd (mod_headers) - ``%`` is escaped as it starts a format specifier"""
+    name = header_name(report_only)
+    return '\n'.join(
+        f"Header always set {name} {_quote(header, _ESCAPE_APACHE)}"
+        for _, header in _headers(policies, 'apache')
+    )
+
+
+def emit_haproxy(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """
+    Render ``http-response set-header`` (or ``add-header`` for every policy after the first) rules for HAProxy -
+    ``%`` is escaped as it starts a log-format variable, and ``$`` as it starts an environment variable.
+    """
+    name, lines = header_name(report_only), []
+    for i, (_, header) in enumerate(_headers(policies, 'haproxy')):
+        value = _quote(header, _ESCAPE_HAPROXY)
+        lines.append(f"http-response {'set' if i == 0 else 'add'}-header {name} {value}")
+    return '\n'.join(lines)
+
+
+def _json_obj(name: str, policy: CompiledPolicy, report_only: bool) -> dict:
+    return dict(
+        id=name, header_name=header_name(report_only), header=policy.header(' '), directives=dict(policy.directives),
+        flags=list(policy.flags),
+    )
+
+
+def emit_json(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """Render a JSON list, with an object for each policy containing it's ``id``, ``header_name``, ``header``, ``directives`` and ``flags``"""
+    return json.dumps([_json_obj(name, p, report_only) for name, p in policies], indent=2)
+
+
+def emit_ndjson(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """Same as :func:`.emit_json`, but with one compact JSON object per line"""
+    return '\n'.join(json.dumps(_json_obj(name, p, report_only), separators=(',', ':')) for name, p in policies)
+
+
+def emit_header(policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """Render plain ``Name: value`` HTTP header lines, e.g. for ``_headers`` files used by static hosts"""
+    name = header_name(report_only)
+    return '\n'.join(f"{name}: {header}" for _, header in _headers(policies, 'header'))
+
+
+EMITTERS: Dict[str, Callable[..., str]] = {
+    'nginx': emit_nginx,
+    'apache': emit_apache,
+    'haproxy': emit_haproxy,
+    'json': emit_json,
+    'ndjson': emit_ndjson,
+    'header': emit_header,
+}
+"""Maps each output format name to it's emitter function"""
+
+
+def emit(fmt: str, policies: Iterable[Tuple[str, CompiledPolicy]], report_only: bool = False) -> str:
+    """
+    Render ``(name, policy)`` pairs into the output format ``fmt`` (one of :data:`.EMITTERS`)
+
+    :raises KeyError: When ``fmt`` isn't a known output format
+    """
+    fmt = fmt.lower()
+    if fmt not in EMITTERS:
+        raise KeyError(f"Unknown output format {fmt!r} - must be one of: {', '.join(EMITTERS)}")
+    return EMITTERS[fmt](list(policies), report_only=report_only)
+
+
+def parse_target(target: str) -> Tuple[str, Optional[str]]:
+    """
+    Parse a ``FORMAT[:PATH]`` output target (as passed to ``--emit``) into ``(format, path)`` - ``path`` is ``None``
+    when the target should be written to stdout.
+
+    :raises KeyError: When the format isn't one of :data:`.EMITTERS`
+    """
+    fmt, _, path = target.partition(':')
+    fmt = fmt.strip().lower()
+    if fmt not in EMITTERS:
+        raise KeyError(f"Unknown output format {fmt!r} - must be one of: {', '.join(EMITTERS)}")
+    return fmt, (path or None)
+
+
+def emit_targets(sources: List[Union[str, List[str]]], targets: Iterable[str], jobs: int = 1, report_only: bool = False,
+                 out=None, **kwargs) -> int:
+    """
+    Compile each INI file / list of lines in ``sources`` once (across ``jobs`` processes, see :func:`.compile_policy`),
+    then render every policy into each of the ``FORMAT[:PATH]`` ``targets``.
+
+    Targets without a path are written to ``out`` (default: stdout). If a target's path contains ``{name}``, each INI
+    is written to it's own file, with ``{name}`` replaced by the INI's filename (minus extension) - otherwise every
+    policy is written to the one file.
+
+    :return int failed: The number of files which failed to be written
+    """
+    from privex.cspgen.watch import output_path, write_output
+    out = sys.stdout if out is None else out
+    targets = [parse_target(t) for t in targets]
+    ids = ['stdin' if isinstance(src, (list, tuple)) else src for src in sources]
+    policies = list(zip(ids, _parallel_map(partial(compile_policy, **kwargs), sources, jobs)))
+    failed = 0
+    for fmt, path in targets:
+        if path is None:
+            out.write(emit(fmt, policies, report_only) + '\n')
+        elif '{name}' in path:
+            for name, policy in policies:
+                failed += not write_output(output_path(path, name), emit(fmt, [(name, policy)], report_only))
+        else:
+            failed += not write_output(path, emit(fmt, policies, report_only))
+    out.flush()
+    return failed
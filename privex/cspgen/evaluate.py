@@ -0,0 +1,471 @@
+"""
+Test a policy against real traffic - evaluate large numbers of ``(directive, URL)`` pairs (e.g. extracted from access
+logs or a HAR export), and count how many requests each directive would allow or block, and which origins are blocked
+most often. Useful for checking that tightening a policy won't break anything before deploying it.
+
+:class:`.PolicyEvaluator` compiles each directive of a :class:`.CSPBuilder` policy into a :class:`.DirectiveMatcher` -
+a set of indexes rather than a list of sources to try in turn:
+
+* a **scheme table** of the schemes allowed by scheme sources (``https:``, ``data:``) and ``*``
+* an **exact host table**, and a **host suffix trie** (reversed labels) for wildcard hosts like ``*.privex.io`` -
+  so finding the rules for a host costs time proportional to it's number of labels, however many sources there are
+* per host, a **port table**, and **path tables** - exact paths in a set, and ``/prefix/`` paths matched by looking up
+  each ``/``-terminated prefix of the URL's path
+
+URLs are matched with the CSP Level 3 rules, the same as :mod:`privex.cspgen.optimize`. Scheme-less host sources and
+``'self'`` match relative to the page's origin, which can be given as ``origin`` (e.g. ``https://www.privex.io``) -
+without one, scheme-less sources are matched as if the page was served over ``https:``, and ``'self'`` never matches.
+Directives which aren't in the policy fall back the same way a browser would (``script-src-elem`` -> ``script-src`` ->
+``default-src``), and directives with nothing to fall back to allow everything.
+
+:meth:`.PolicyEvaluator.evaluate` works in batches - identical pairs within a batch are counted once and evaluated once,
+which for typical logs (the same few hundred assets requested over and over) skips most of the work. :func:`.evaluate_file`
+splits a log file into byte ranges and evaluates them across multiple processes::
+
+    >>> ev = PolicyEvaluator.from_builder(CSPBuilder('site.ini'), origin='https://www.privex.io')
+    >>> ev.allows('img-src', 'https://i.imgur.com/abc.png')
+    False
+    >>> res = evaluate_file('requests.log', ev, jobs=0)
+    >>> print(res.format())
+
+Or from the command line, where each line of the log is ``directive URL``::
+
+    csp-gen --evaluate requests.log --origin https://www.privex.io -j 0 site.ini
+
+"""
+import logging
+import os
+from collections import Counter
+from functools import partial
+from os import PathLike
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+from privex.cspgen.optimize import DEFAULT_PORTS, KIND_HOST, KIND_SCHEME, KIND_STAR, PAGE_SCHEMES, SCHEME_MATCHES, parse_source
+from privex.cspgen.reports import DIRECTIVE_FALLBACKS, NO_FALLBACK
+
+log = logging.getLogger(__name__)
+
+__all__ = ['split_url', 'url_origin', 'DirectiveMatcher', 'PolicyEvaluator', 'EvaluationResult', 'evaluate_file', 'CHUNK_SIZE']
+
+CHUNK_SIZE = 8 * 1024 * 1024
+"""Log files are split into byte ranges of this size, which are evaluated in parallel by :func:`.evaluate_file`"""
+
+BATCH_SIZE = 100000
+"""The number of pairs :meth:`.PolicyEvaluator.evaluate` counts (de-duplicates) at a time"""
+
+URLParts = Tuple[str, str, Optional[int], str]
+
+
+def split_url(url: str) -> Optional[URLParts]:
+    """
+    Split an absolute URL into ``(scheme, host, port, path)`` - lowercasing the scheme and host, setting ``port`` to
+    ``None`` if it's the scheme's default, and dropping any userinfo, query string and fragment. URLs without an
+    authority (``data:``, ``blob:``) have an empty host. Returns ``None`` for URLs which can't be parsed.
+
+        >>> split_url('HTTPS://User@CDN.Privex.io:443/js/app.js?v=2')
+        ('https', 'cdn.privex.io', None, '/js/app.js')
+
+    This is several times faster than :func:`urllib.parse.urlsplit`, which matters when evaluating millions of URLs.
+    """
+    i = url.find(':')
+    if i <= 0:
+        return None
+    scheme, rest = url[:i].lower(), url[i + 1:]
+    host, port = '', None
+    if rest.startswith('//'):
+        end = len(rest)
+        for c in '/?#':
+            j = rest.find(c, 2)
+            if j != -1 and j < end:
+                end = j
+        auth, path = rest[2:end], rest[end:] or '/'
+        at = auth.rfind('@')
+        if at != -1:
+            auth = auth[at + 1:]
+        if auth.startswith('['):
+            j = auth.find(']')
+            if j == -1:
+                return None
+            host, port_str = auth[:j + 1], auth[j + 2:] if auth[j + 1:j + 2] == ':' else ''
+        else:
+            host, _, port_str = auth.partition(':')
+        if port_str:
+            if not port_str.isdigit():
+                return None
+            port = int(port_str)
+            if port == DEFAULT_PORTS.get(scheme):
+                port = None
+        host = host.lower().rstrip('.')
+        if not host:
+            return None
+    else:
+        path = rest
+    for c in '?#':
+        j = path.find(c)
+        if j != -1:
+            path = path[:j]
+    return scheme, host, port, path
+
+
+def url_origin(parts: URLParts) -> str:
+    """The origin of a :func:`.split_url` result, e.g. ``https://cdn.privex.io:8443`` - or ``data:`` for URLs without a host"""
+    scheme, host, port, _ = parts
+    if not host:
+        return f"{scheme}:"
+    return f"{scheme}://{host}" if port is None else f"{scheme}://{host}:{port}"
+
+
+class _PathTable:
+    """The paths allowed for one host / scheme / port - any path, exact paths, and ``/``-terminated prefixes"""
+    __slots__ = ('any', 'exact', 'prefixes')
+
+    def __init__(self):
+        self.any = False
+        self.exact = set()
+        self.prefixes = set()
+
+    def add(self, path: str):
+        if not path:
+            self.any = True
+        elif path.endswith('/'):
+            self.prefixes.add(path)
+        else:
+            self.exact.add(path)
+
+    def match(self, path: str) -> bool:
+        if self.any or path in self.exact:
+            return True
+        prefixes = self.prefixes
+        if prefixes:
+            i = path.find('/')
+            while i != -1:
+                if path[:i + 1] in prefixes:
+                    return True
+                i = path.find('/', i + 1)
+        return False
+
+
+# Maps (schemes, port) -> the paths allowed for them, where port is None (the default port), '*' or a number
+_HostRules = Dict[Tuple[FrozenSet[str], Union[None, int, str]], _PathTable]
+
+
+class _SuffixNode:
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children: Dict[str, _SuffixNode] = {}
+        self.rules: Optional[_HostRules] = None
+
+
+def _port_matches(expr, scheme: str, port: Optional[int]) -> bool:
+    # CSP3 port-part matching - 'port' has already been normalised to None when it's the scheme's default
+    if expr == '*':
+        return True
+    if expr is None:
+        return port is None
+    return expr == port or (port is None and expr == DEFAULT_PORTS.get(scheme))
+
+
+def _rules_match(rules: _HostRules, scheme: str, port: Optional[int], path: str) -> bool:
+    for (schemes, expr_port), paths in rules.items():
+        if scheme in schemes and _port_matches(expr_port, scheme, port) and paths.match(path):
+            return True
+    return False
+
+
+class DirectiveMatcher:
+    """
+    The sources of a single directive, compiled into indexes for matching URLs against (see the module docs).
+
+        >>> m = DirectiveMatcher(["'self'", 'https://*.privex.io', 'cdn.example.com/js/', 'data:'], 'https://www.privex.io')
+        >>> m.allows('https://files.privex.io/a.png'), m.allows('https://privex.io/a.png'), m.allows('data:image/png,...')
+        (True, False, True)
+        >>> m.allows('https://cdn.example.com/js/app.js'), m.allows('https://cdn.example.com/app.js')
+        (True, False)
+
+    :param sources: The directive's source expressions (keywords other than ``'self'`` and ``'none'``, nonces and hashes
+                    don't affect which URLs are allowed, and are ignored)
+    :param origin: The origin of the protected page, as a URL or :func:`.split_url` result (see the module docs)
+    """
+    __slots__ = ('schemes', 'star', 'self_origin', 'hosts', 'suffixes', 'any_host', 'page_scheme')
+
+    def __init__(self, sources: Iterable[str], origin: Union[str, URLParts, None] = None):
+        if isinstance(origin, str):
+            origin = split_url(origin)
+        self.page_scheme = origin[0] if origin else PAGE_SCHEMES[-1]
+        self.self_origin: Optional[URLParts] = None
+        self.star = False
+        self.schemes = set()
+        """URL schemes allowed outright by scheme sources (already expanded with :data:`.SCHEME_MATCHES`)"""
+        self.hosts: Dict[str, _HostRules] = {}
+        self.suffixes = _SuffixNode()
+        self.any_host: _HostRules = {}
+        for token in sources:
+            if token == "'self'":
+                self.self_origin = origin
+                continue
+            src = parse_source(token)
+            if src.kind == KIND_STAR:
+                self.star = True
+            elif src.kind == KIND_SCHEME:
+                self.schemes.update(SCHEME_MATCHES.get(src.scheme, (src.scheme,)))
+            elif src.kind == KIND_HOST:
+                self._add_host(src)
+
+    def _add_host(self, src):
+        scheme = src.scheme or self.page_scheme
+        schemes = SCHEME_MATCHES.get(scheme, frozenset((scheme,)))
+        port = src.port if src.port in (None, '*') else int(src.port)
+        if src.host == '*':
+            rules = self.any_host
+        elif src.host.startswith('*.'):
+            node = self.suffixes
+            for label in reversed(src.host[2:].split('.')):
+                node = node.children.setdefault(label, _SuffixNode())
+            if node.rules is None:
+                node.rules = {}
+            rules = node.rules
+        else:
+            rules = self.hosts.setdefault(src.host, {})
+        rules.setdefault((schemes, port), _PathTable()).add(src.path)
+
+    def _matches_self(self, scheme: str, host: str, port: Optional[int]) -> bool:
+        o_scheme, o_host, o_port, _ = self.self_origin
+        if host != o_host or port != o_port:
+            return False
+        return scheme == o_scheme or scheme in ('https', 'wss') or (o_scheme == 'http' and scheme == 'ws')
+
+    def match(self, parts: URLParts) -> bool:
+        """Return ``True`` if the :func:`.split_url` result ``parts`` is allowed by this directive"""
+        scheme, host, port, path = parts
+        if scheme in self.schemes:
+            return True
+        if self.star and (scheme in PAGE_SCHEMES or scheme == self.page_scheme):
+            return True
+        if not host:
+            return False
+        if self.self_origin is not None and self._matches_self(scheme, host, port):
+            return True
+        rules = self.hosts.get(host)
+        if rules is not None and _rules_match(rules, scheme, port, path):
+            return True
+        if self.any_host and _rules_match(self.any_host, scheme, port, path):
+            return True
+        # Walk the suffix trie - every node passed before the host's last (leftmost) label is a wildcard which matches it
+        node, labels = self.suffixes, host.split('.')
+        for i in range(len(labels) - 1, 0, -1):
+            node = node.children.get(labels[i])
+            if node is None:
+                break
+            if node.rules is not None and _rules_match(node.rules, scheme, port, path):
+                return True
+        return False
+
+    def allows(self, url: str) -> bool:
+        """Return ``True`` if the absolute URL ``url`` is allowed by this directive (``False`` if it can't be parsed)"""
+        parts = split_url(url)
+        return parts is not None and self.match(parts)
+
+
+class EvaluationResult:
+    """
+    The outcome of evaluating a batch (or file) of ``(directive, URL)`` pairs - results from separate batches or
+    processes can be combined with :meth:`.merge`.
+    """
+    __slots__ = ('counts', 'blocked', 'invalid')
+
+    def __init__(self):
+        self.counts: Dict[str, List[int]] = {}
+        """Maps each directive to ``[allowed, blocked]``"""
+        self.blocked: Counter = Counter()
+        """Maps ``(directive, origin)`` to the number of requests blocked"""
+        self.invalid = 0
+        """The number of lines / URLs which couldn't be parsed (these aren't counted as allowed or blocked)"""
+
+    def add(self, directive: str, allowed: bool, origin: str = None, count: int = 1):
+        entry = self.counts.get(directive)
+        if entry is None:
+            entry = self.counts[directive] = [0, 0]
+        if allowed:
+            entry[0] += count
+        else:
+            entry[1] += count
+            self.blocked[(directive, origin)] += count
+
+    def merge(self, other: 'EvaluationResult') -> 'EvaluationResult':
+        for directive, (allowed, blocked) in other.counts.items():
+            entry = self.counts.setdefault(directive, [0, 0])
+            entry[0] += allowed
+            entry[1] += blocked
+        self.blocked.update(other.blocked)
+        self.invalid += other.invalid
+        return self
+
+    @property
+    def total(self) -> int:
+        return sum(a + b for a, b in self.counts.values())
+
+    def top_blocked(self, n: int = 10, directive: str = None) -> List[Tuple[str, str, int]]:
+        """Return the ``n`` most often blocked ``(directive, origin, count)`` - optionally only for ``directive``"""
+        items = self.blocked.items() if directive is None else ((k, v) for k, v in self.blocked.items() if k[0] == directive)
+        items = sorted(items, key=lambda kv: (-kv[1], kv[0]))
+        return [(d, o, c) for (d, o), c in items[:n]]
+
+    def as_dict(self, top: int = 10) -> dict:
+        return {
+            'directives': {d: {'allowed': a, 'blocked': b} for d, (a, b) in sorted(self.counts.items())},
+            'top_blocked': [{'directive': d, 'origin': o, 'count': c} for d, o, c in self.top_blocked(top)],
+            'invalid': self.invalid,
+        }
+
+    def format(self, top: int = 10) -> str:
+        """Render the per-directive counts and the ``top`` most blocked origins as an aligned, human readable table"""
+        lines = [f"{'Directive':<28} {'Allowed':>12} {'Blocked':>12} {'Blocked %':>10}"]
+        for d, (a, b) in sorted(self.counts.items()):
+            lines.append(f"{d:<28} {a:>12} {b:>12} {(b / (a + b) * 100) if a + b else 0:>9.2f}%")
+        allowed, blocked = sum(a for a, _ in self.counts.values()), sum(b for _, b in self.counts.values())
+        lines.append(f"{'total':<28} {allowed:>12} {blocked:>12} {(blocked / (allowed + blocked) * 100) if allowed + blocked else 0:>9.2f}%")
+        if self.invalid:
+            lines.append(f"Skipped {self.invalid} line(s) which couldn't be parsed")
+        blocked = self.top_blocked(top)
+        if blocked:
+            lines.append('')
+            lines.append('Most blocked origins:')
+            lines.extend(f"    {d:<24} {o:<48} {c:>10}" for d, o, c in blocked)
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} total={self.total} directives={len(self.counts)} invalid={self.invalid}>"
+
+
+class PolicyEvaluator:
+    """
+    Evaluates ``(directive, URL)`` pairs against a policy, compiling each directive into a :class:`.DirectiveMatcher`
+    the first time it's needed.
+
+    Evaluators only hold the policy's source lists and origin, so they're cheap to pickle - worker processes compile
+    their own matchers.
+
+    :param directives: Maps directive names to their source expressions (see :meth:`.from_builder`)
+    :param origin: The origin of the protected page, e.g. ``https://www.privex.io`` (see the module docs)
+    """
+    def __init__(self, directives: Dict[str, Sequence[str]], origin: str = None):
+        self.directives = {k: tuple(v) for k, v in directives.items()}
+        self.origin = origin
+        self._origin = split_url(origin) if origin else None
+        if origin and (self._origin is None or not self._origin[1]):
+            raise ValueError(f"Invalid origin {origin!r} - expected an absolute URL such as https://www.privex.io")
+        self._matchers: Dict[str, Optional[DirectiveMatcher]] = {}
+
+    @classmethod
+    def from_builder(cls, builder, origin: str = None) -> 'PolicyEvaluator':
+        """Create an evaluator for the policy of a :class:`.CSPBuilder` (directives with sources only - not flags)"""
+        builder.autoclean()
+        return cls({k: list(d.sources) for k, d in builder.directives.items() if d.sources is not None}, origin)
+
+    def __reduce__(self):
+        return type(self), (self.directives, self.origin)
+
+    def matcher(self, directive: str) -> Optional[DirectiveMatcher]:
+        """
+        Return the matcher for the directive governing ``directive`` (following browser fallbacks), or ``None`` if
+        nothing in the policy restricts it
+        """
+        try:
+            return self._matchers[directive]
+        except KeyError:
+            pass
+        names = (directive,) + DIRECTIVE_FALLBACKS.get(directive, ('default-src',) if directive not in NO_FALLBACK else ())
+        m = None
+        for name in names:
+            if name in self.directives:
+                m = self._matchers.get(name) or DirectiveMatcher(self.directives[name], self._origin)
+                self._matchers[name] = m
+                break
+        self._matchers[directive] = m
+        return m
+
+    def allows(self, directive: str, url: str) -> bool:
+        """Return ``True`` if the policy allows loading ``url`` for ``directive``"""
+        m = self.matcher(directive.lower())
+        return m is None or m.allows(url)
+
+    def evaluate(self, pairs: Iterable[Tuple[str, str]], result: EvaluationResult = None) -> EvaluationResult:
+        """
+        Evaluate ``(directive, URL)`` pairs, adding the outcome to ``result`` (or a new :class:`.EvaluationResult`).
+        Pairs are counted in batches of :data:`.BATCH_SIZE`, so repeated pairs are only matched once per batch.
+        """
+        result = EvaluationResult() if result is None else result
+        batch = Counter()
+        for pair in pairs:
+            batch[pair] += 1
+            if len(batch) >= BATCH_SIZE:
+                self._evaluate_counts(batch, result)
+                batch.clear()
+        self._evaluate_counts(batch, result)
+        return result
+
+    def _evaluate_counts(self, batch: Dict[Tuple[str, str], int], result: EvaluationResult):
+        for (directive, url), count in batch.items():
+            directive = directive.lower()
+            parts = split_url(url)
+            if parts is None:
+                result.invalid += count
+                continue
+            m = self.matcher(directive)
+            allowed = m is None or m.match(parts)
+            result.add(directive, allowed, None if allowed else url_origin(parts), count)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} directives={list(self.directives)!r} origin={self.origin!r}>"
+
+
+def _iter_pairs(lines: Iterable[bytes], directive: Optional[str], result: EvaluationResult) -> Iterable[Tuple[str, str]]:
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if directive is not None:
+            yield directive, fields[0].decode('utf-8', 'replace')
+        elif len(fields) >= 2:
+            yield fields[0].decode('utf-8', 'replace'), fields[1].decode('utf-8', 'replace')
+        else:
+            result.invalid += 1
+
+
+def _evaluate_range(span: Tuple[int, int], path: str, evaluator: PolicyEvaluator, directive: str = None) -> EvaluationResult:
+    """Evaluate the lines of ``path`` which start within the byte range ``span`` (used by :func:`.evaluate_file`)"""
+    start, end = span
+    result = EvaluationResult()
+    with open(path, 'rb') as fh:
+        if start > 0:
+            # Skip the line that started in the previous range - unless this range starts exactly on a new line
+            fh.seek(start - 1)
+            fh.readline()
+        pos = fh.tell()
+        if pos >= end:
+            return result
+        data = fh.read(end - pos)
+        if data and not data.endswith(b'\n'):
+            data += fh.readline()
+    return evaluator.evaluate(_iter_pairs(data.splitlines(), directive, result), result)
+
+
+def evaluate_file(path: Union[str, PathLike], evaluator: PolicyEvaluator, jobs: int = 1, directive: str = None,
+                  chunk_size: int = CHUNK_SIZE) -> EvaluationResult:
+    """
+    Evaluate every line of the log file ``path`` against ``evaluator``, splitting it into byte ranges of ``chunk_size``
+    which are evaluated across ``jobs`` processes (``0`` for one per CPU core), and merging the results.
+
+    Each line should be ``directive URL`` (separated by whitespace, with anything after the URL ignored) - or, if
+    ``directive`` is given, just a URL, which is evaluated against ``directive``.
+    """
+    from privex.cspgen.builder import _parallel_map
+    path = os.fspath(path)
+    size = os.path.getsize(path)
+    spans = [(s, min(s + chunk_size, size)) for s in range(0, size, chunk_size)]
+    log.debug("Evaluating %s (%d bytes) in %d range(s) with %s job(s)", path, size, len(spans), jobs)
+    result = EvaluationResult()
+    for res in _parallel_map(partial(_evaluate_range, path=path, evaluator=evaluator, directive=directive), spans, jobs):
+        result.merge(res)
+    return result
@@ -0,0 +1,71 @@
+"""
+Exception classes used by CSPGen.
+
+All CSPGen specific exceptions inherit from :class:`.CSPGenException`, so they can be caught in one go.
+"""
+from typing import Iterable
+
+__all__ = [
+    'CSPGenException', 'MarkerError', 'MarkerCycleError', 'UndefinedMarkerError', 'ExtendsCycleError', 'PolicyValidationError',
+    'HashConflictError'
+]
+
+
+class CSPGenException(Exception):
+    """Base exception for all CSPGen specific exceptions"""
+    pass
+
+
+class MarkerError(CSPGenException, ValueError):
+    """
+    Raised when a ``{{marker}}`` cannot be resolved.
+
+    :ivar tuple path: The chain of sections / groups followed to reach the problematic marker,
+                      e.g. ``('img-src.zones', 'defaultsrc', 'websites')``
+    """
+    def __init__(self, message: str, path: Iterable[str] = ()):
+        super().__init__(message)
+        self.path = tuple(path)
+
+
+class MarkerCycleError(MarkerError):
+    """Raised when groups include each other in a loop, e.g. ``a = {{b}}`` and ``b = {{a}}``"""
+    pass
+
+
+class UndefinedMarkerError(MarkerError):
+    """Raised (in strict mode) when a ``{{marker}}`` refers to a group which doesn't exist"""
+    pass
+
+
+class ExtendsCycleError(CSPGenException, ValueError):
+    """
+    Raised when INI files extend each other in a loop, e.g. ``a.ini`` extends ``b.ini`` which extends ``a.ini``
+
+    :ivar tuple path: The chain of INI files which led to the loop
+    """
+    def __init__(self, message: str, path: Iterable[str] = ()):
+        super().__init__(message)
+        self.path = tuple(path)
+
+
+class PolicyValidationError(CSPGenException, ValueError):
+    """
+    Raised (when validation is set to ``strict``) if a config contains invalid directive names or source expressions.
+
+    :ivar tuple issues: Every :class:`privex.cspgen.validate.ValidationIssue` found in the config
+    """
+    def __init__(self, message: str, issues: Iterable = ()):
+        super().__init__(message)
+        self.issues = tuple(issues)
+
+
+class HashConflictError(CSPGenException, ValueError):
+    """
+    Raised when inline block hashes would be added to a directive which has ``unsafe-inline = true`` - browsers ignore
+    ``'unsafe-inline'`` in a directive containing hashes, so the config wouldn't do what it says.
+
+    Set ``hash-unsafe-inline = true`` in the ``[cspgen]`` section to allow it anyway (e.g. so that old browsers which
+    don't support hashes fall back to ``'unsafe-inline'``).
+    """
+    pass
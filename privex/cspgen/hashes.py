@@ -0,0 +1,281 @@
+"""
+Generates CSP hash sources (``'sha256-...'``) for the inline ``<script>`` and ``<style>`` blocks within a folder of
+HTML templates - so that ``'unsafe-inline'`` can be dropped from ``script-src`` / ``style-src``.
+
+Hashing is enabled per INI file from the ``[cspgen]`` section, with folders relative to the INI file::
+
+    [cspgen]
+    hash-dirs = templates/ static/html/
+    # Optional - the default patterns and algorithm are shown
+    hash-patterns = *.html *.htm *.j2 *.jinja *.jinja2
+    hash-algorithm = sha256
+
+:meth:`.CSPBuilder.clean` then scans every matching file (recursively), and adds the hashes of their inline scripts
+to ``script-src``, and inline styles to ``style-src``. If either directive isn't in the INI, it's created with the
+same sources / options as ``default-src``, so that adding the hashes doesn't loosen the policy.
+
+Blocks containing template syntax (``{{`` or ``{%``) are skipped, as their contents change when the template is
+rendered - so the hash of the raw template wouldn't match. A warning is logged naming each skipped block, as the browser
+will block it unless it's allowed another way (e.g. a nonce). Scripts with a ``src`` attribute are skipped silently.
+
+Browsers ignore ``'unsafe-inline'`` in a directive containing hashes, so :meth:`.CSPBuilder.clean` raises
+:class:`.HashConflictError` if hashes would be added to a directive with ``unsafe-inline = true`` - unless
+``hash-unsafe-inline = true`` is set in ``[cspgen]``.
+
+Each file's hashes are cached by it's path, mtime and size (see :class:`.HashCache`), so re-running only re-reads and
+hashes the templates which changed. Files which need hashing can be spread across a pool of processes (``hash_jobs``).
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from functools import partial
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from privex.cspgen import version
+from privex.cspgen.helpers import atomic_write
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'DEFAULT_PATTERNS', 'HASH_ALGORITHMS', 'FileHashes', 'extract_inline', 'hash_source', 'hash_file', 'find_templates',
+    'HashCache', 'scan_templates', 'template_fingerprint'
+]
+
+DEFAULT_PATTERNS = ('*.html', '*.htm', '*.j2', '*.jinja', '*.jinja2')
+"""The filename patterns scanned for inline blocks, when ``hash-patterns`` isn't set"""
+
+HASH_ALGORITHMS = ('sha256', 'sha384', 'sha512')
+"""The hash algorithms supported by CSP hash sources"""
+
+_re_script = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+_re_style = re.compile(r'<style\b[^>]*>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+_re_src_attr = re.compile(r'(?:^|\s)src\s*=', re.IGNORECASE)
+_TEMPLATE_MARKERS = ('{{', '{%')
+
+
+class FileHashes(NamedTuple):
+    """
+    The hash sources of the inline blocks found in a template (or many templates), plus the location of each block
+    which was skipped because it contains template syntax, e.g. ``'templates/base.html:12 <script>'``
+    """
+    scripts: Tuple[str, ...] = ()
+    styles: Tuple[str, ...] = ()
+    skipped: Tuple[str, ...] = ()
+
+
+def _is_static(block: str) -> bool:
+    return not any(m in block for m in _TEMPLATE_MARKERS)
+
+
+def extract_inline(html: str, skipped: list = None) -> Tuple[List[str], List[str]]:
+    """
+    Return the contents of every static inline ``<script>`` and ``<style>`` block in ``html``, exactly as they appear
+    between the tags (which is what browsers hash) - as ``(scripts, styles)``.
+
+        >>> extract_inline('<script>alert(1)</script><script src="/a.js"></script><style>p { color: red }</style>')
+        (['alert(1)'], ['p { color: red }'])
+
+    :param list skipped: If passed, ``(tag, line)`` is appended to it for each block skipped due to template syntax
+    """
+    found = {'script': [], 'style': []}
+    blocks = [('script', m, m.group(2)) for m in _re_script.finditer(html) if not _re_src_attr.search(m.group(1))]
+    blocks += [('style', m, m.group(1)) for m in _re_style.finditer(html)]
+    for tag, m, content in blocks:
+        if not content:
+            continue
+        if _is_static(content):
+            found[tag].append(content)
+        elif skipped is not None:
+            skipped.append((tag, html.count('\n', 0, m.start()) + 1))
+    return found['script'], found['style']
+
+
+def hash_source(content: Union[str, bytes], algorithm: str = 'sha256') -> str:
+    """
+    Return the CSP hash source for ``content``, e.g. ``'sha256-bhHHL3z2vDgxUt0W3dWQOrprscmda2Y5pLsLg4GF+pI='``
+
+    :raises ValueError: When ``algorithm`` isn't one of :data:`.HASH_ALGORITHMS`
+    """
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported CSP hash algorithm {algorithm!r} - must be one of: {', '.join(HASH_ALGORITHMS)}")
+    if isinstance(content, str): content = content.encode('utf-8')
+    digest = base64.b64encode(hashlib.new(algorithm, content).digest()).decode('ascii')
+    return f"'{algorithm}-{digest}'"
+
+
+def hash_file(path: Union[str, PathLike], algorithm: str = 'sha256') -> FileHashes:
+    """
+    Read the template ``path``, and return the hash sources of it's inline scripts and styles.
+
+    This is a plain top-level function, so that it can be used with a :class:`concurrent.futures.ProcessPoolExecutor`.
+    """
+    skipped = []
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape') as fh:
+        scripts, styles = extract_inline(fh.read(), skipped)
+    return FileHashes(
+        tuple(dict.fromkeys(hash_source(s.encode('utf-8', 'surrogateescape'), algorithm) for s in scripts)),
+        tuple(dict.fromkeys(hash_source(s.encode('utf-8', 'surrogateescape'), algorithm) for s in styles)),
+        tuple(f"{path}:{line} <{tag}>" for tag, line in sorted(skipped, key=lambda b: b[1])),
+    )
+
+
+def find_templates(dirs: Iterable[Union[str, PathLike]], patterns: Iterable[str] = DEFAULT_PATTERNS) -> List[Path]:
+    """Return every file (recursively) within ``dirs`` matching any of ``patterns``, sorted, without duplicates"""
+    found = {}
+    for d in dirs:
+        d = Path(d)
+        if not d.is_dir():
+            log.warning("Template folder %s doesn't exist - no hashes will be generated from it", d)
+            continue
+        for pattern in patterns:
+            for f in d.rglob(pattern):
+                if f.is_file():
+                    found[f.resolve()] = True
+    return sorted(found)
+
+
+def template_fingerprint(files: Iterable[Path]) -> bytes:
+    """
+    Return a cheap fingerprint of ``files`` (their paths, mtimes and sizes) - for cache keys which need to change
+    whenever a template is added, removed or modified.
+    """
+    parts = []
+    for f in files:
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        parts.append(f"{f}\0{st.st_mtime_ns}\0{st.st_size}")
+    return '\n'.join(parts).encode('utf-8', 'surrogateescape')
+
+
+class HashCache:
+    """
+    Caches the :class:`.FileHashes` of each template by it's path, mtime and size - so a template is only read and
+    hashed again once it changes.
+
+    If ``path`` is set, the cache is loaded from that JSON file when it's first used, and :meth:`.save` writes it back
+    (atomically), so the cache persists between runs. Otherwise it only lives in memory.
+
+    :param path: The JSON file to persist the cache to (``None`` for an in-memory cache)
+    """
+    def __init__(self, path: Union[str, PathLike] = None):
+        self.path = None if path is None else Path(path).expanduser()
+        self.entries: Dict[str, Tuple[int, int, str, FileHashes]] = {}
+        self.dirty = False
+        self._loaded = self.path is None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock can't be pickled - e.g. when the cache is passed to compile_source in a process pool
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable hash cache %s - reason: %s - %s", self.path, type(e).__name__, e)
+            return
+        if not isinstance(data, dict) or data.get('version') != version.VERSION:
+            return
+        for k, (mtime, size, algorithm, *hashes) in data.get('entries', {}).items():
+            self.entries[k] = (mtime, size, algorithm, FileHashes(*map(tuple, hashes)))
+
+    def get(self, path: Path, st: os.stat_result, algorithm: str) -> Optional[FileHashes]:
+        """Return the cached hashes for ``path`` - or ``None`` if it's not cached, or has changed since it was cached"""
+        self._load()
+        entry = self.entries.get(str(path))
+        if entry is None or entry[:3] != (st.st_mtime_ns, st.st_size, algorithm):
+            return None
+        return entry[3]
+
+    def set(self, path: Path, st: os.stat_result, algorithm: str, hashes: FileHashes):
+        self._load()
+        with self._lock:
+            self.entries[str(path)] = (st.st_mtime_ns, st.st_size, algorithm, hashes)
+            self.dirty = True
+
+    def save(self) -> bool:
+        """Write the cache to :attr:`.path` if it has changed (no-op for in-memory caches). Returns ``True`` if written."""
+        if self.path is None or not self.dirty:
+            return False
+        with self._lock:
+            entries = {k: [m, s, a, *map(list, h)] for k, (m, s, a, h) in self.entries.items()}
+            self.dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(self.path, json.dumps(dict(version=version.VERSION, entries=entries), separators=(',', ':')))
+        except OSError as e:
+            log.warning("Failed to write hash cache %s - reason: %s - %s", self.path, type(e).__name__, e)
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} path={None if self.path is None else str(self.path)!r} entries={len(self.entries)}>"
+
+
+_memory_cache = HashCache()
+"""The process-wide in-memory cache used when no :class:`.HashCache` is passed to :func:`.scan_templates`"""
+
+
+def scan_templates(dirs: Iterable[Union[str, PathLike]], patterns: Iterable[str] = DEFAULT_PATTERNS,
+                   algorithm: str = 'sha256', jobs: int = 1, cache: HashCache = None) -> FileHashes:
+    """
+    Find every template within ``dirs`` matching ``patterns``, and return the hash sources of all of their inline
+    scripts and styles (de-duplicated, in the order they were found).
+
+    Templates which are already in ``cache`` (with the same mtime and size) aren't read again. The rest are hashed
+    across a pool of ``jobs`` processes when ``jobs`` is greater than 1 (or ``0`` / ``None`` for one per CPU core).
+
+    A warning is logged for each inline block which was skipped because it contains template syntax (cached or not).
+
+    :param cache: The :class:`.HashCache` to use (default: a process-wide in-memory cache)
+    """
+    from privex.cspgen.builder import _parallel_map
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported CSP hash algorithm {algorithm!r} - must be one of: {', '.join(HASH_ALGORITHMS)}")
+    cache = _memory_cache if cache is None else cache
+    results: Dict[Path, Optional[FileHashes]] = {}
+    stale: List[Tuple[Path, os.stat_result]] = []
+    for f in find_templates(dirs, patterns):
+        st = f.stat()
+        results[f] = cache.get(f, st, algorithm)
+        if results[f] is None:
+            stale.append((f, st))
+    if stale:
+        log.debug("Hashing inline blocks in %d of %d templates (%d cached)", len(stale), len(results), len(results) - len(stale))
+        hashed = _parallel_map(partial(hash_file, algorithm=algorithm), [f for f, _ in stale], jobs)
+        for (f, st), h in zip(stale, hashed):
+            cache.set(f, st, algorithm, h)
+            results[f] = h
+        cache.save()
+    scripts = dict.fromkeys(s for h in results.values() for s in h.scripts)
+    styles = dict.fromkeys(s for h in results.values() for s in h.styles)
+    skipped = tuple(s for h in results.values() for s in h.skipped)
+    for block in skipped:
+        log.warning(
+            "%s: inline block contains template syntax ({{ / {%%}) so it can't be hashed - browsers will block it "
+            "unless it's allowed another way (e.g. a nonce)", block
+        )
+    return FileHashes(tuple(scripts), tuple(styles), skipped)
@@ -1,16 +1,50 @@
 import logging
+import os
 import sys
 import re
-from privex.helpers import empty, empty_if, T, K
-from typing import List, Optional, Union
+from base64 import b64encode
+from collections import ChainMap
+from os import PathLike, urandom
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, TypeVar, Union
+from privex.cspgen.exceptions import MarkerCycleError, MarkerError, UndefinedMarkerError
 log = logging.getLogger(__name__)
 
+T = TypeVar('T')
+K = TypeVar('K')
+
 __all__ = [
-    'read_stdin', 're_markers', '_re_markers', 'replace_markers', 'automark_str',
-    'automark', '_dedup', 'dedup', 'dedup_dict', 'clean_dict', 'literal'
+    'read_stdin', 'iter_documents', 'document_id', 're_markers', '_re_markers', 'JoinedView', 'MarkerResolver', 'replace_markers', 'automark_str',
+    'automark', 'tokenize', '_dedup', 'dedup', 'dedup_dict', 'clean_dict', 'NONCE_SLOT', 'generate_nonce',
+    'atomic_write', 'literal'
 ]
 
 
+# The following three functions are lightweight equivalents of the privex-helpers functions of the same name. They're
+# defined here so that using CSPBuilder as a library doesn't require importing privex-helpers (which is slow to import).
+
+def empty(v, zero: bool = False, itr: bool = False) -> bool:
+    """
+    Returns ``True`` if ``v`` is ``None`` or ``''`` - plus ``0`` / ``'0'`` if ``zero`` is True, and empty
+    iterables (``[]``, ``{}`` etc.) if ``itr`` is True.
+    """
+    if v is None or (isinstance(v, str) and v == ''): return True
+    if zero and v in [0, '0']: return True
+    if itr and hasattr(v, '__len__') and len(v) == 0: return True
+    return False
+
+
+def empty_if(v: T, is_empty: K = None, **kwargs) -> Union[T, K]:
+    """Returns ``is_empty`` if ``v`` is empty (see :func:`.empty`), otherwise returns ``v``"""
+    return is_empty if empty(v, **kwargs) else v
+
+
+def is_true(v: Any) -> bool:
+    """Returns ``True`` if ``v`` is some form of true: ``True``, ``1``, or the strings ``'true'``, ``'yes'``, ``'y'``, ``'1'``"""
+    v = v.lower() if type(v) is str else v
+    return v in [True, 'true', 'yes', 'y', '1', 1]
+
+
 def read_stdin(auto_strip=True) -> List[str]:
     """Read STDIN into a list of :class:`.str`'s and then returns that list."""
     lines = []
@@ -19,70 +53,381 @@ def read_stdin(auto_strip=True) -> List[str]:
     return lines
 
 
+def iter_documents(stream: Iterable[str] = None, delimiter: str = '---', auto_strip=True) -> Iterator[List[str]]:
+    """
+    Lazily split a stream of lines (default: STDIN) into INI documents separated by lines containing only ``delimiter``,
+    yielding each document as a list of lines as soon as it's complete. Only one document is held in memory at a time.
+
+    Documents which are empty (or only whitespace) are skipped.
+    """
+    stream = sys.stdin if stream is None else stream
+    delimiter = delimiter.strip()
+    lines = []
+    for ln in stream:
+        if ln.strip() == delimiter:
+            if any(lines): yield lines
+            lines = []
+            continue
+        lines.append(ln.strip() if auto_strip else ln.rstrip('\r\n'))
+    if any(lines): yield lines
+
+
+def document_id(lines: Iterable[str], default: Any = None) -> Any:
+    """Return the ``id`` key from the ``[cspgen]`` section of an INI document (as a list of lines), or ``default`` if it's not set"""
+    section = None
+    for ln in lines:
+        ln = ln.strip()
+        if ln.startswith('[') and ln.endswith(']'):
+            section = ln[1:-1].strip()
+        elif section == 'cspgen' and ln[:2].lower() == 'id':
+            key, sep, val = ln.partition('=') if '=' in ln else ln.partition(':')
+            if sep and key.strip().lower() == 'id':
+                return val.strip()
+    return default
+
+
 _re_markers = r'{{([a-zA-Z0-9._-]+)}}'
-re_markers = re.compile(r'{{([a-zA-Z0-9._-]+)}}')
+re_markers = re.compile(_re_markers)
+
+
+class JoinedView(Mapping):
+    """A read-only mapping view of a dict of token tuples, which returns each value as a space-joined string"""
+    __slots__ = ('tokens',)
+
+    def __init__(self, tokens: Mapping[str, Tuple[str, ...]]):
+        self.tokens = tokens
+
+    def __getitem__(self, key: str) -> str:
+        return ' '.join(self.tokens[key])
+
+    def __contains__(self, key):
+        return key in self.tokens
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class MarkerResolver:
+    """
+    Resolves ``{{marker}}`` references within a dict of groups (e.g. the ``[groups]`` INI section).
+
+    The dependency graph between the groups is built once when the resolver is constructed, then every
+    group is expanded exactly once, in topological order - so that by the time a group is expanded, all of
+    the groups it references have already been fully expanded.
+
+    Groups are expanded as lists of interned source tokens rather than strings, and each group's tokens are
+    de-duplicated (preserving order) as they're expanded, so nested groups never have to be re-split or
+    re-joined. The resolved tokens are available via :attr:`.tokens`, and as space-joined strings
+    via :attr:`.resolved` / ``resolver[name]`` (joined on access, so the strings aren't kept in memory).
+
+    Referencing groups in a loop (e.g. ``a = {{b}}`` + ``b = {{a}}``) raises :class:`.MarkerCycleError`. Markers
+    which refer to groups that don't exist are replaced with an empty string and logged as a warning, or
+    raise :class:`.UndefinedMarkerError` if ``strict`` is True - each undefined marker is only warned about once, the
+    first time it's referenced (see :attr:`.missing`). Both exceptions carry the ``path`` of groups which led to the problem.
+
+        >>> r = MarkerResolver({'cdn': 'https://cdn.privex.io', 'defaultsrc': "'self' {{cdn}}"})
+        >>> r['defaultsrc']
+        "'self' https://cdn.privex.io"
+        >>> r.expand_tokens('{{defaultsrc}} https://i.imgur.com')
+        ["'self'", 'https://cdn.privex.io', 'https://i.imgur.com']
+
+    The original ``groups`` dict is never modified.
+
+    If a ``parent`` resolver is passed (e.g. the groups of a base INI file), any group which isn't defined in
+    ``groups`` is looked up from the parent, without copying it. The parent is never modified, so it can be
+    shared between any number of child resolvers. Base groups which depend on a group that's overridden in
+    ``groups`` are copied into the child and re-resolved, so that overrides apply through nested markers:
+
+        >>> base = MarkerResolver({'cdn': 'https://cdn.privex.io', 'defaultsrc': "'self' {{cdn}}"})
+        >>> site = MarkerResolver({'cdn': 'https://cdn.example.com'}, parent=base)
+        >>> site['defaultsrc']
+        "'self' https://cdn.example.com"
 
+    """
+    LITERAL, REF, TEMPLATE = 0, 1, 2
+
+    def __init__(self, groups: dict, strict: bool = False, parent: 'MarkerResolver' = None):
+        self.strict = strict
+        self.parent = parent
+        self.missing: Set[str] = set()
+        """Undefined markers which have already been warned about - each is only logged once (strict resolvers always raise)"""
+        self.raw = dict(groups.items())
+        self.deps: Dict[str, Tuple[str, ...]] = {}
+        self.dependents: Dict[str, Set[str]] = {}
+        """Reverse dependency index - maps each group name to the set of groups which directly reference it"""
+        # The parsed parts are only kept while resolving the groups for the first time - update() re-parses as needed
+        parts = {}
+        for k, v in list(self.raw.items()):
+            self._set_parts(k, v, parts)
+        self.tokens: Dict[str, Tuple[str, ...]] = {}
+        self.resolved: Mapping[str, str] = JoinedView(self.tokens)
+        # Lookups fall through to the parent's (already resolved) groups, for any group not defined in this resolver
+        self.all_tokens: Mapping[str, Tuple[str, ...]] = self.tokens if parent is None else ChainMap(self.tokens, parent.all_tokens)
+        self.all_resolved: Mapping[str, str] = self.resolved if parent is None else ChainMap(self.resolved, parent.all_resolved)
+        self.order = self._sort()
+        for name in self.order:
+            self.tokens[name] = tuple(self.expand_parts(parts[name], name))
+
+    def _set_parts(self, name: str, value: Optional[str], parts: dict = None):
+        """
+        Parse (or remove, if ``value`` is None) the raw group ``name``, keeping :attr:`.dependents` in sync.
+        If ``parts`` is passed, the parsed parts are stored in it.
+        """
+        for d in self.deps.get(name, ()):
+            self.dependents[d].discard(name)
+        if value is None:
+            self.raw.pop(name, None)
+            self.deps.pop(name, None)
+            return
+        self.raw[name] = value
+        self.missing.discard(name)
+        name_parts, self.deps[name] = self.parse(value)
+        if parts is not None:
+            parts[name] = name_parts
+        for d in self.deps[name]:
+            self.dependents.setdefault(d, set()).add(name)
+        if self.parent is not None:
+            # Copy in any of the parent's groups which depend on this one, so that they're re-resolved using our value
+            for n in self.parent.affected(name):
+                if n not in self.raw:
+                    self._set_parts(n, self.parent.raw[n], parts)
+
+    def affected(self, *names: str) -> List[str]:
+        """
+        Return the groups ``names``, plus every group which depends on them - directly, or through nested markers - in
+        resolution order. Groups which don't exist are excluded.
+        """
+        seen, todo = set(), list(names)
+        while todo:
+            n = todo.pop()
+            if n in seen: continue
+            seen.add(n)
+            todo.extend(self.dependents.get(n, ()))
+        return [n for n in self.order if n in seen]
+
+    def update(self, name: str, value: Optional[str]) -> List[str]:
+        """
+        Set the raw value of the group ``name`` (or remove it if ``value`` is None), then re-resolve only that group
+        and the groups which depend on it.
+
+        If the change would create a marker loop (or reference an undefined group while ``strict``), the resolver is
+        left unchanged, and the :class:`.MarkerError` is raised.
+
+        Groups inherited from the :attr:`.parent` can be overridden, but not removed - removing an override
+        reverts the group to the parent's value.
+
+        :return List[str] changed: The names of every group whose resolved value may have changed
+        """
+        old = self.raw.get(name)
+        self._set_parts(name, value)
+        try:
+            order = self._sort()
+        except MarkerError:
+            self._set_parts(name, old)
+            raise
+        self.order = order
+        if value is None:
+            self.tokens.pop(name, None)
+        changed = self.affected(name)
+        for n in changed:
+            self.tokens[n] = tuple(self.expand_tokens(self.raw[n], n))
+        return changed if value is not None else [name] + changed
+
+    @classmethod
+    def parse(cls, data: str) -> Tuple[List[Tuple[int, Union[str, List[str]]]], Tuple[str, ...]]:
+        """
+        Split ``data`` into a list of ``(kind, value)`` parts, plus a tuple of the marker names it references.
+
+        Each whitespace separated token becomes either a :attr:`.LITERAL` (an interned source token), a :attr:`.REF`
+        (a token which is just a ``{{marker}}``), or a :attr:`.TEMPLATE` (a token with markers embedded within
+        other text, e.g. ``https://{{host}}/path``, stored as the output of ``re_markers.split``).
+        """
+        parts, deps = [], []
+        for tk in str(data).split():
+            if '{{' not in tk:
+                parts.append((cls.LITERAL, sys.intern(tk)))
+                continue
+            m = re_markers.fullmatch(tk)
+            if m is not None:
+                parts.append((cls.REF, m.group(1)))
+                deps.append(m.group(1))
+                continue
+            tpl = re_markers.split(tk)
+            parts.append((cls.TEMPLATE, tpl))
+            deps.extend(tpl[1::2])
+        return parts, tuple(deps)
+
+    def count_tokens(self, data: str) -> int:
+        """Return how many tokens ``data`` expands to before de-duplication (used by :meth:`.CSPBuilder.stats`)"""
+        n, tokens = 0, self.all_tokens
+        for kind, val in self.parse(data)[0]:
+            if kind == self.LITERAL:
+                n += 1
+            elif kind == self.REF:
+                n += len(tokens.get(val, ()))
+            else:
+                n += len(self._template(val))
+        return n
+
+    def depth(self) -> int:
+        """Return the deepest nesting of ``{{markers}}`` between this resolver's groups (``1`` for groups without markers)"""
+        depth: Dict[str, int] = {}
+        for name in self.order:
+            depth[name] = 1 + max((depth.get(d, 0) for d in self.deps.get(name, ())), default=0)
+        return max(depth.values(), default=0)
+
+    def _missing(self, marker: str, path: Iterable[str]):
+        if marker in self.missing:
+            return
+        path = tuple(path) + (marker,)
+        msg = f"Undefined marker {{{{{marker}}}}} referenced via: {' -> '.join(path)}"
+        if self.strict:
+            # Not recorded as reported - a strict resolver must keep rejecting the marker, e.g. after update() rolls back
+            raise UndefinedMarkerError(msg, path)
+        self.missing.add(marker)
+        log.warning("%s - replacing with empty string", msg)
+
+    def _sort(self) -> List[str]:
+        """Topologically sort the groups (dependencies first) using an iterative DFS, detecting cycles and undefined markers"""
+        order, done, stack, on_stack = [], set(), [], {}
+        for root in self.raw:
+            if root in done: continue
+            stack.append((root, iter(self.deps[root])))
+            on_stack[root] = len(stack) - 1
+            while stack:
+                name, deps = stack[-1]
+                for d in deps:
+                    if d in done or (d not in self.raw and d in self.all_tokens): continue
+                    if d in on_stack:
+                        path = [n for n, _ in stack[on_stack[d]:]] + [d]
+                        raise MarkerCycleError(f"Circular marker reference between groups: {' -> '.join(path)}", path)
+                    if d not in self.raw:
+                        self._missing(d, [n for n, _ in stack])
+                        continue
+                    stack.append((d, iter(self.deps[d])))
+                    on_stack[d] = len(stack) - 1
+                    break
+                else:
+                    stack.pop()
+                    del on_stack[name]
+                    done.add(name)
+                    order.append(name)
+        return order
+
+    def _template(self, tpl: List[str]) -> List[str]:
+        """Expand a token with embedded markers as a string, then split it back into interned tokens"""
+        res = self.resolved_str
+        return tokenize(''.join(p if i % 2 == 0 else res(p) for i, p in enumerate(tpl)))
+
+    def resolved_str(self, name: str) -> str:
+        """Return the resolved group ``name`` as a space separated string (empty string if it doesn't exist)"""
+        return ' '.join(self.all_tokens.get(name, ()))
+
+    def expand_parts(self, parts: List[Tuple[int, Union[str, List[str]]]], path: Union[str, Iterable[str]] = ()) -> List[str]:
+        """Expand the output of :meth:`.parse` into a de-duplicated list of tokens (see :meth:`.expand_tokens`)"""
+        out, tokens = {}, self.all_tokens
+        for kind, val in parts:
+            if kind == self.LITERAL:
+                out[val] = None
+            elif kind == self.REF:
+                if val not in tokens and val not in self.raw:
+                    self._missing(val, (path,) if isinstance(path, str) else path)
+                out.update(dict.fromkeys(tokens.get(val, ())))
+            else:
+                for m in val[1::2]:
+                    if m not in tokens and m not in self.raw:
+                        self._missing(m, (path,) if isinstance(path, str) else path)
+                out.update(dict.fromkeys(self._template(val)))
+        return list(out)
+
+    def expand_tokens(self, data: str, path: Union[str, Iterable[str]] = ()) -> List[str]:
+        """
+        Replace all ``{{markers}}`` within ``data`` using the resolved groups, returning a de-duplicated list of tokens.
 
-def replace_markers(data: str, groupsrc: dict, *markers) -> str:
+        :param str data: The string to replace markers within, e.g. the ``zones`` value of a section.
+        :param path: A label (or tuple of labels) describing where ``data`` came from, used in error messages.
+        :return List[str] tokens: The interned source tokens from ``data`` after replacing all markers.
+        """
+        return self.expand_parts(self.parse(data)[0], path)
+
+    def expand(self, data: str, path: Union[str, Iterable[str]] = ()) -> str:
+        """
+        Replace all ``{{markers}}`` within ``data`` using the resolved groups, without altering the rest of the string.
+
+        :param str data: The string to replace markers within, e.g. the ``zones`` value of a section.
+        :param path: A label (or tuple of labels) describing where ``data`` came from, used in error messages.
+        :return str new_data: ``data`` with all markers replaced.
+        """
+        data = str(data)
+        if '{{' not in data:
+            return data
+        parts = re_markers.split(data)
+        for m in parts[1::2]:
+            if m not in self.all_tokens:
+                self._missing(m, (path,) if isinstance(path, str) else path)
+        return ''.join(p if i % 2 == 0 else self.resolved_str(p) for i, p in enumerate(parts))
+
+    def __getitem__(self, item: str) -> str:
+        return self.all_resolved[item]
+
+    def __contains__(self, item):
+        return item in self.all_tokens
+
+
+def replace_markers(data: str, groupsrc: Union[dict, MarkerResolver], *markers) -> str:
     """
     Replace the markers ``markers`` in the form of ``{{marker}}`` which are present in the string ``data``,
-    by looking up the marker names against ``groupsrc``, and recursively replacing any markers found in the
-    replacement from ``groupsrc``.
+    by looking up the marker names against ``groupsrc``, including any markers nested inside of the groups.
     
     :param str data: The data to replace markers within
-    :param dict groupsrc: A dictionary containing marker names mapped to their value, to be used for replacing markers in ``data``
+    :param dict groupsrc: A dictionary containing marker names mapped to their value, or a :class:`.MarkerResolver`
     :param str markers: One or more markers to search for within ``data`` and replace.
     :return str new_data: The ``data`` after replacing all passed markers.
     """
     data = str(data)
+    resolver = groupsrc if isinstance(groupsrc, MarkerResolver) else MarkerResolver(groupsrc)
     for m in markers:
         mk = '{{' + str(m) + '}}'
         if mk not in data: continue
-        repd = ''
-        if m in groupsrc:
-            repd = groupsrc[m]
-            log.debug(f"Found marker replacement: {m!r} = {repd!r}")
-            repmks = re.compile(_re_markers).findall(repd)
-            if len(repmks) > 0:
-                log.debug(f"Marker replacement contains {len(repmks)} markers too! Replacing sub-markers...")
-                repd = groupsrc[m] = replace_markers(repd, groupsrc, *repmks)
-        data = data.replace(mk, repd)
-        log.debug(f"Replaced data marker: {m!r} = {repd!r}")
-        
+        data = data.replace(mk, resolver.resolved_str(m))
     return data
 
 
-def automark_str(data: str, groupsrc: dict):
+def automark_str(data: str, groupsrc: Union[dict, MarkerResolver]):
     """Replace markers in the form of ``{{marker}}`` in ``data``, by looking up the marker name against ``groupsrc``"""
-    log.debug(f" >>> Checking value for markers: {data!r}")
-    gmarks = re.compile(_re_markers).findall(data)
-    if len(gmarks) > 0:
-        data = replace_markers(data, groupsrc, *gmarks)
-    return data
+    resolver = groupsrc if isinstance(groupsrc, MarkerResolver) else MarkerResolver(groupsrc)
+    return resolver.expand(data)
 
 
-def automark(data: dict, groupsrc: dict, inplace=False):
+def automark(data: dict, groupsrc: Union[dict, MarkerResolver], inplace=False):
     """Replace markers in the form of ``{{marker}}`` in the values of ``data``, by looking up the marker name against ``groupsrc``"""
     data = data if inplace else {k: v for k, v in data.items()}
+    resolver = groupsrc if isinstance(groupsrc, MarkerResolver) else MarkerResolver(groupsrc)
     for k, v in data.items():
-        data[k] = automark_str(v, groupsrc)
+        data[k] = resolver.expand(v, k)
     return data
 
 
-def _dedup(data: Union[list, tuple]) -> list:
-    """Remove duplicates from a list/tuple, then return a new clean list"""
-    ndata = []
-    for d in data:
-        if d in ndata: continue
-        ndata.append(d)
-    return ndata
+def tokenize(data: str, sep=None) -> List[str]:
+    """Split ``data`` using ``sep`` (default: any whitespace), and intern each token so that identical sources share one object"""
+    return [sys.intern(t) for t in data.split(sep)]
+
+
+def _dedup(data: Iterable) -> list:
+    """Remove duplicates from a list/tuple (preserving the order they first appear in), then return a new clean list"""
+    return list(dict.fromkeys(data))
 
 
 def dedup(data: Union[list, tuple, str, T], sep=None) -> T:
     """Remove duplicate entries from a list/tuple, or a string (split into a list using ``sep`` (default: any whitespace))"""
     if isinstance(data, str):
-        sdt = data.split(sep)
-        ndata = _dedup(sdt)
+        ndata = _dedup(tokenize(data, sep))
         sep = ' ' if sep is None else sep
         return sep.join(ndata)
     
@@ -105,7 +450,8 @@ def clean_dict(data: dict, groupsec: dict = None, inplace=False, do_automark=Tru
     within it's values, using :func:`.dedup` (if do_dedup is True).
     """
     ndata = dict(list(data.items()))
-    groupsec = ndata if empty(groupsec) else groupsec
+    if not isinstance(groupsec, MarkerResolver) and empty(groupsec):
+        groupsec = ndata
     if do_automark:
         ndata = automark(ndata, groupsec, inplace)
     if do_dedup:
@@ -113,6 +459,38 @@ def clean_dict(data: dict, groupsec: dict = None, inplace=False, do_automark=Tru
     return ndata
 
 
+NONCE_SLOT = '\x00'
+"""Placeholder rendered in place of the nonce value within :attr:`.CompiledPolicy.nonce_sections`"""
+
+
+def generate_nonce(length: int = 16) -> str:
+    """Generate a random base64 encoded nonce (from ``length`` bytes of :func:`os.urandom`) for use as a CSP ``'nonce-...'``"""
+    return b64encode(urandom(length)).decode('ascii')
+
+
+def atomic_write(path: Union[str, PathLike], data: Union[str, bytes], mode: int = 0o644):
+    """
+    Atomically replace the file ``path`` with ``data``, by writing to a temporary file in the same folder, then
+    renaming it over ``path`` - so that readers (e.g. a web server reloading it's config) never see a partially written file.
+    """
+    import tempfile
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data.encode('utf-8') if isinstance(data, str) else data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, str(path))
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 def literal(data: str) -> str:
     """Replaces ``\\n``, ``\\r`` and ``\\t`` in a string, with the real literal newline, carraige return, and tab characters."""
     return str(data).replace("\\n", "\n").replace("\\r", "\r").replace("\\t", "\t")
@@ -0,0 +1,149 @@
+"""
+A single-pass INI loader, used by :class:`.CSPBuilder` in place of :class:`configparser.ConfigParser`.
+
+ConfigParser builds a parser object (with a proxy per section) and then runs every value through it's interpolation
+machinery when the builder copies them out - which dominates load time for multi-megabyte generated INIs. This loader
+makes one pass over the text, producing the builder's plain ``{section: {key: value}}`` dicts directly, and in the same
+pass records the line span of every key (for validation errors) and the ``{{markers}}`` each key references.
+
+It follows ConfigParser's default semantics exactly - ``=`` / ``:`` delimiters, lowercased keys, full line ``#`` / ``;``
+comments, indented continuation lines (including blank lines within a value), and ``[DEFAULT]`` keys being inherited by
+every section. Anything it doesn't handle itself - ``%`` interpolation, duplicate sections / keys, or malformed lines
+- makes :func:`.parse_ini` return ``None``, so the caller can fall back to ConfigParser, which raises the same
+errors (or interpolates the values) as it always has.
+
+Files of :data:`.MMAP_THRESHOLD` bytes or more are memory mapped and decoded straight from the mapping, rather than
+being copied into a buffer first.
+"""
+import locale
+import mmap
+import os
+import re
+import sys
+from os import PathLike
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from privex.cspgen.helpers import re_markers
+
+__all__ = ['MMAP_THRESHOLD', 'IniData', 'read_text', 'parse_ini', 'find_markers']
+
+MMAP_THRESHOLD = 1024 * 1024
+"""Files at least this many bytes in size are read using :mod:`mmap`"""
+
+_re_section = re.compile(r"\[(?P<header>.+)\]")
+
+
+class IniData(NamedTuple):
+    """The output of :func:`.parse_ini`"""
+    sections: Dict[str, Dict[str, str]]
+    """Maps each section (except ``DEFAULT``) to it's keys and values, with ``DEFAULT``'s keys merged in"""
+    lines: Dict[str, Dict[str, Tuple[int, int]]]
+    """Maps each section to ``{key: (first_line, last_line)}`` - the same as :func:`privex.cspgen.validate.line_index`"""
+    markers: Dict[str, Dict[str, Tuple[str, ...]]]
+    """Maps each section to the keys which contain ``{{markers}}``, and the names of the markers they reference"""
+
+
+def read_text(path: Union[str, PathLike], encoding: str = None) -> str:
+    """
+    Read the text file ``path`` the same way :meth:`configparser.ConfigParser.read` would (the locale's encoding, and
+    universal newlines) - but files of :data:`.MMAP_THRESHOLD` bytes or more are decoded straight from a memory map.
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, encoding)
+        else:
+            text = fh.read().decode(encoding)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def find_markers(sections: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, Tuple[str, ...]]]:
+    """Build :attr:`.IniData.markers` from already parsed sections (for configs loaded by ConfigParser)"""
+    res = {}
+    for s, keys in sections.items():
+        for k, v in keys.items():
+            if '{{' in v:
+                res.setdefault(s, {})[k] = tuple(re_markers.findall(v))
+    return res
+
+
+def parse_ini(text: str) -> Optional[IniData]:
+    """
+    Parse the INI ``text`` in a single pass - or return ``None`` if it needs ConfigParser (see the module docs).
+
+        >>> data = parse_ini("[groups]\\ncdn = https://cdn.privex.io\\n[img-src]\\nzones = 'self'\\n    {{cdn}}\\n")
+        >>> data.sections['img-src']
+        {'zones': "'self'\\n{{cdn}}"}
+        >>> data.lines['img-src'], data.markers
+        ({'': (3, 3), 'zones': (4, 5)}, {'img-src': {'zones': ('cdn',)}})
+    """
+    if '%' in text:
+        return None
+    intern = sys.intern
+    sections: Dict[str, Dict[str, List[str]]] = {}
+    lines: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    markers: Dict[str, Dict[str, List[str]]] = {}
+    defaults: Optional[Dict[str, List[str]]] = None
+    cur, cur_name, cur_lines = None, None, None
+    key, vals, first, indent = None, None, 0, sys.maxsize
+
+    for n, line in enumerate(text.split('\n'), start=1):
+        value = line.strip()
+        if not value:
+            # Blank lines within a multi-line value are kept (trailing ones are stripped when the value is joined)
+            if key is not None:
+                vals.append('')
+            continue
+        if value[0] in '#;':
+            continue
+        cur_indent = len(line) - len(line.lstrip())
+        if key is not None and cur_indent > indent:
+            vals.append(value)
+            cur_lines[key] = (first, n)
+            if '{{' in value:
+                markers.setdefault(cur_name, {}).setdefault(key, []).extend(re_markers.findall(value))
+            continue
+        indent = cur_indent
+        m = _re_section.match(value) if value[0] == '[' else None
+        if m is not None:
+            cur_name, key = m.group('header'), None
+            if cur_name == 'DEFAULT':
+                if defaults is None: defaults = {}
+                cur = defaults
+            elif cur_name in sections:
+                return None     # DuplicateSectionError
+            else:
+                cur_name = intern(cur_name)
+                cur = sections[cur_name] = {}
+            cur_lines = lines.setdefault(cur_name, {})
+            cur_lines[''] = (n, n)
+            continue
+        if cur is None:
+            return None         # MissingSectionHeaderError
+        eq, col = value.find('='), value.find(':')
+        pos = eq if col == -1 or (eq != -1 and eq < col) else col
+        if pos == -1:
+            return None         # ParsingError - a line without a delimiter
+        opt = value[:pos].rstrip()
+        if not opt:
+            return None
+        key = intern(opt.lower())
+        if key in cur:
+            return None         # DuplicateOptionError
+        vals = cur[key] = [value[pos + 1:].strip()]
+        first = n
+        cur_lines[key] = (n, n)
+        if '{{' in value:
+            markers.setdefault(cur_name, {})[key] = re_markers.findall(value)
+
+    defaults = {k: '\n'.join(v).rstrip() for k, v in (defaults or {}).items()}
+    res = {}
+    for s, keys in sections.items():
+        res[s] = {k: '\n'.join(v).rstrip() for k, v in keys.items()}
+        for k, v in defaults.items():
+            res[s].setdefault(k, v)
+    return IniData(res, lines, {s: {k: tuple(v) for k, v in ks.items()} for s, ks in markers.items()})
@@ -0,0 +1,251 @@
+"""
+WSGI and ASGI middleware which attach a CSPGen compiled ``Content-Security-Policy`` header to every response.
+
+The INI file(s) are compiled once into :class:`.CompiledPolicy` objects, and the header name/value pairs are
+pre-built, so each request only appends an existing tuple to the response headers. At most once per
+``check_interval`` seconds, the INI files' mtimes are checked from a background thread - if any changed, the
+policies are recompiled and swapped in with a single attribute assignment, so in-flight requests are never blocked
+and always see either the old or the new policy set.
+
+WSGI (e.g. Flask / Django)::
+
+    from privex.cspgen.middleware import CSPMiddleware
+    app.wsgi_app = CSPMiddleware(app.wsgi_app, '/etc/csp/site.ini')
+
+ASGI (e.g. Starlette / FastAPI / Django ASGI)::
+
+    from privex.cspgen.middleware import ASGICSPMiddleware
+    app = ASGICSPMiddleware(app, '/etc/csp/site.ini', report_only=True)
+
+If the INI files contain route sections (``[directive@/prefix]``, see :mod:`privex.cspgen.routes`), every variant is
+compiled up front, and each request gets the headers for the longest prefix matching it's path - a walk of a
+pre-built trie, costing time proportional to the length of the path.
+
+If any of the policies contain a nonce slot (``nonce = true``), a fresh nonce is generated for each request, inserted
+into the header, and made available to the application as ``environ['cspgen.nonce']`` (WSGI) or
+``scope['cspgen.nonce']`` (ASGI).
+"""
+import logging
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from privex.cspgen.builder import CSPBuilder, CompiledPolicy
+from privex.cspgen.helpers import generate_nonce
+from privex.cspgen.routes import RouteTable
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'HEADER_CSP', 'HEADER_CSP_REPORT_ONLY', 'NONCE_KEY', 'LoadedPolicies', 'PolicyLoader',
+    'CSPMiddleware', 'ASGICSPMiddleware'
+]
+
+HEADER_CSP = 'Content-Security-Policy'
+HEADER_CSP_REPORT_ONLY = 'Content-Security-Policy-Report-Only'
+NONCE_KEY = 'cspgen.nonce'
+"""The WSGI ``environ`` / ASGI ``scope`` key which the per-request nonce is stored under"""
+
+
+class LoadedPolicies(NamedTuple):
+    """An immutable snapshot of the compiled policies, and their pre-built headers, held by :class:`.PolicyLoader`"""
+    policies: Tuple[CompiledPolicy, ...]
+    headers: Tuple[Tuple[str, str], ...]
+    """``(name, value)`` header pairs as :class:`.str` - for WSGI"""
+    raw_headers: Tuple[Tuple[bytes, bytes], ...]
+    """``(name, value)`` header pairs as lowercase :class:`.bytes` - for ASGI"""
+    has_nonce: bool
+    files: Tuple[Path, ...]
+    """The INI files, followed by any base INI files which they extend"""
+    stats: Tuple[Tuple[int, int], ...]
+    """``(st_mtime_ns, st_size)`` for each of :attr:`.files` at the time it was loaded"""
+    routes: Optional[RouteTable] = None
+    """
+    If the INI files contain route sections, maps each route prefix to the :class:`.LoadedPolicies` for requests under
+    it (see :meth:`.for_path`) - otherwise ``None``
+    """
+
+    def for_path(self, path: str) -> 'LoadedPolicies':
+        """Return the policies for the request path ``path`` - the route variant for the longest matching prefix, or ``self``"""
+        if self.routes is None:
+            return self
+        loaded = self.routes.lookup(path)
+        return self if loaded is None else loaded
+
+
+class PolicyLoader:
+    """
+    Loads and compiles one or more INI files through :class:`.CSPBuilder`, and hot-reloads them when they change.
+
+        >>> loader = PolicyLoader('/etc/csp/site.ini', check_interval=5)
+        >>> loaded = loader.get()
+        >>> loaded.headers
+        (('Content-Security-Policy', "default-src 'self' ..."),)
+
+    :param filenames: One or more paths to INI files
+    :param bool report_only: Use the ``Content-Security-Policy-Report-Only`` header instead of ``Content-Security-Policy``
+    :param float check_interval: Check the files' mtimes at most once per this many seconds (``0`` / ``None`` disables reloading)
+    :param str sep: Separator between each directive in the header
+    :param builder_kwargs: Any extra keyword arguments are passed through to :class:`.CSPBuilder`
+    """
+    def __init__(self, *filenames: Union[str, PathLike], report_only: bool = False, check_interval: Optional[float] = 2.0,
+                 sep: str = ' ', **builder_kwargs):
+        if len(filenames) == 0:
+            raise ValueError("PolicyLoader requires at least one INI filename")
+        self.filenames: List[Path] = [Path(f).resolve() for f in filenames]
+        self.header_name = HEADER_CSP_REPORT_ONLY if report_only else HEADER_CSP
+        self.check_interval = check_interval
+        self.sep = sep
+        self.builder_kwargs = builder_kwargs
+        self._lock = threading.Lock()
+        self._next_check = time.monotonic() + (check_interval or 0)
+        self.loaded: LoadedPolicies = self.load()
+
+    @staticmethod
+    def _stat(files: Iterable[Path]) -> Tuple[Tuple[int, int], ...]:
+        res = []
+        for f in files:
+            st = f.stat()
+            res.append((st.st_mtime_ns, st.st_size))
+        return tuple(res)
+
+    def load(self) -> LoadedPolicies:
+        """Compile every INI file, and return a new :class:`.LoadedPolicies` snapshot (doesn't replace :attr:`.loaded`)"""
+        stats = self._stat(self.filenames)
+        builders = [CSPBuilder(str(f), **self.builder_kwargs) for f in self.filenames]
+        policies = tuple(b.compile() for b in builders)
+        # Base INI files are watched too, so that changing a shared base reloads every policy which extends it
+        bases = tuple(p for p in dict.fromkeys(p for b in builders for p in b.extends_files) if p not in self.filenames)
+        stats += self._stat(bases)
+        files = tuple(self.filenames) + bases
+        routes = None
+        tables = [b.compile_routes() if b.routes else None for b in builders]
+        if any(t is not None for t in tables):
+            # A prefix may only be routed in some of the files - the others use their nearest matching route (or main policy)
+            routes = RouteTable()
+            for prefix in dict.fromkeys(p for t in tables if t is not None for p in t):
+                variants = tuple(p if t is None else t.lookup(prefix) for p, t in zip(policies, tables))
+                routes[prefix] = self._snapshot(variants, files, stats)
+        return self._snapshot(policies, files, stats, routes)
+
+    def _snapshot(self, policies: Tuple[CompiledPolicy, ...], files: Tuple[Path, ...], stats: Tuple[Tuple[int, int], ...],
+                  routes: RouteTable = None) -> LoadedPolicies:
+        headers = tuple((self.header_name, p.header(self.sep)) for p in policies)
+        raw_name = self.header_name.lower().encode('latin-1')
+        raw_headers = tuple((raw_name, p.header_bytes(self.sep)) for p in policies)
+        return LoadedPolicies(
+            policies=policies, headers=headers, raw_headers=raw_headers,
+            has_nonce=any(p.has_nonce for p in policies), files=files, stats=stats, routes=routes,
+        )
+
+    def refresh(self) -> bool:
+        """
+        Re-stat the INI files (and any base INI files they extend), and if any changed, recompile them and swap in the
+        new policies.
+
+        If the files can't be read or fail to compile, the error is logged and the current policies are kept.
+
+        :return bool reloaded: ``True`` if the policies were reloaded
+        """
+        try:
+            if self._stat(self.loaded.files) == self.loaded.stats:
+                return False
+            loaded = self.load()
+        except Exception:
+            log.exception("Failed to reload CSP policies from %s - keeping the current policies", self.filenames)
+            return False
+        self.loaded = loaded
+        log.info("Reloaded CSP policies from %s", self.filenames)
+        return True
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self._lock.release()
+
+    def get(self) -> LoadedPolicies:
+        """
+        Return the current :class:`.LoadedPolicies`. If ``check_interval`` has elapsed since the last check, a background
+        thread is started to :meth:`.refresh` the policies - this call never waits for it.
+        """
+        if self.check_interval and time.monotonic() >= self._next_check and self._lock.acquire(blocking=False):
+            self._next_check = time.monotonic() + self.check_interval
+            threading.Thread(target=self._background_refresh, name='cspgen-reload', daemon=True).start()
+        return self.loaded
+
+    def nonce_headers(self, nonce: str, loaded: LoadedPolicies = None) -> Tuple[Tuple[str, str], ...]:
+        """Return the ``(name, value)`` :class:`.str` header pairs with ``nonce`` inserted into every nonce slot"""
+        loaded = self.loaded if loaded is None else loaded
+        return tuple((self.header_name, p.header_nonce(nonce, self.sep)) for p in loaded.policies)
+
+    def nonce_raw_headers(self, nonce: str, loaded: LoadedPolicies = None) -> Tuple[Tuple[bytes, bytes], ...]:
+        """Same as :meth:`.nonce_headers` but returns lowercase :class:`.bytes` header pairs for ASGI"""
+        loaded = self.loaded if loaded is None else loaded
+        raw_name = self.header_name.lower().encode('latin-1')
+        return tuple((raw_name, p.render_nonce(nonce, self.sep)) for p in loaded.policies)
+
+
+class CSPMiddleware:
+    """
+    WSGI middleware which adds the CSP header(s) compiled from one or more INI files to every response.
+
+        >>> app.wsgi_app = CSPMiddleware(app.wsgi_app, '/etc/csp/site.ini', check_interval=5)
+
+    Accepts the same arguments as :class:`.PolicyLoader`, or an existing loader can be passed as ``loader=``.
+    """
+    def __init__(self, app: Callable, *filenames, loader: PolicyLoader = None, nonce_func: Callable[[], str] = generate_nonce,
+                 **kwargs):
+        self.app = app
+        self.loader = PolicyLoader(*filenames, **kwargs) if loader is None else loader
+        self.nonce_func = nonce_func
+
+    def __call__(self, environ: dict, start_response: Callable):
+        loaded = self.loader.get()
+        if loaded.routes is not None:
+            loaded = loaded.for_path(environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''))
+        headers = loaded.headers
+        if loaded.has_nonce:
+            nonce = environ[NONCE_KEY] = self.nonce_func()
+            headers = self.loader.nonce_headers(nonce, loaded)
+
+        def _start_response(status, response_headers, exc_info=None):
+            response_headers.extend(headers)
+            return start_response(status, response_headers, exc_info)
+
+        return self.app(environ, _start_response)
+
+
+class ASGICSPMiddleware:
+    """
+    ASGI middleware which adds the pre-encoded CSP header(s) compiled from one or more INI files to every HTTP response.
+
+        >>> app = ASGICSPMiddleware(app, '/etc/csp/site.ini', report_only=True)
+
+    Accepts the same arguments as :class:`.PolicyLoader`, or an existing loader can be passed as ``loader=``.
+    """
+    def __init__(self, app: Callable, *filenames, loader: PolicyLoader = None, nonce_func: Callable[[], str] = generate_nonce,
+                 **kwargs):
+        self.app = app
+        self.loader = PolicyLoader(*filenames, **kwargs) if loader is None else loader
+        self.nonce_func = nonce_func
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        loaded = self.loader.get()
+        if loaded.routes is not None:
+            loaded = loaded.for_path(scope.get('path', ''))
+        raw_headers = loaded.raw_headers
+        if loaded.has_nonce:
+            nonce = scope[NONCE_KEY] = self.nonce_func()
+            raw_headers = self.loader.nonce_raw_headers(nonce, loaded)
+
+        async def _send(message: dict):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', ())) + list(raw_headers)
+            await send(message)
+
+        return await self.app(scope, receive, _send)
@@ -0,0 +1,108 @@
+"""
+Compact in-memory model of a cleaned CSP config, used by :class:`.CSPBuilder`.
+
+Each directive section (``default-src``, ``img-src`` etc.) is held as a :class:`.Directive` - a ``__slots__`` object
+with it's sources stored as a :class:`.SourceList` (a tuple of interned strings, shared with the resolved groups
+wherever possible), and it's keyword options (``unsafe-inline`` etc.) parsed into booleans once, rather than
+re-parsed every time the directive is rendered.
+"""
+import sys
+from typing import Dict, Iterable, Optional, Tuple
+
+from privex.cspgen.helpers import is_true
+
+__all__ = ['SourceList', 'Directive']
+
+
+class SourceList(tuple):
+    """
+    An immutable list of interned CSP source tokens. Behaves exactly like a :class:`tuple`, but ``str()`` returns the
+    sources joined by spaces.
+
+        >>> s = SourceList(["'self'", 'https://cdn.privex.io'])
+        >>> str(s)
+        "'self' https://cdn.privex.io"
+    """
+    __slots__ = ()
+
+    def __new__(cls, sources: Iterable[str] = ()):
+        return super().__new__(cls, map(sys.intern, sources))
+
+    @classmethod
+    def from_str(cls, data: str) -> 'SourceList':
+        """Split the whitespace separated string ``data`` into a :class:`.SourceList`"""
+        return cls(str(data).split())
+
+    def __str__(self):
+        return ' '.join(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({tuple.__repr__(self)})"
+
+
+class Directive:
+    """
+    A single cleaned CSP directive section, e.g. ``img-src``.
+
+    :ivar str name: The directive name, e.g. ``img-src``
+    :ivar SourceList sources: The de-duplicated sources from the ``zones`` key (``None`` if the section has no ``zones``)
+    :ivar tuple options: Every other key in the section as ``(key, value)`` pairs, e.g. ``(('unsafe-inline', 'true'),)``
+    :ivar bool nonce: ``True`` if the section has ``nonce = true``
+    :ivar bool unsafe_eval: ``True`` if the section has ``unsafe-eval = true``
+    :ivar bool unsafe_inline: ``True`` if the section has ``unsafe-inline = true``
+    """
+    __slots__ = ('name', 'sources', 'options', 'nonce', 'unsafe_eval', 'unsafe_inline')
+
+    def __init__(self, name: str, sources: Optional[Iterable[str]] = None, options: Iterable[Tuple[str, str]] = ()):
+        self.name = sys.intern(name)
+        self.sources = None if sources is None else (sources if isinstance(sources, SourceList) else SourceList(sources))
+        self.options = tuple((sys.intern(k), v) for k, v in options)
+        opts = dict(self.options)
+        self.nonce = is_true(opts.get('nonce', False))
+        self.unsafe_eval = is_true(opts.get('unsafe-eval', False))
+        self.unsafe_inline = is_true(opts.get('unsafe-inline', False))
+
+    @property
+    def empty(self) -> bool:
+        """``True`` if the section had no keys at all - in which case it's not rendered"""
+        return self.sources is None and not self.options
+
+    def get(self, key: str, default=None) -> Optional[str]:
+        """Get the (cleaned) string value of ``key``, as it would appear in the old ``config_dict``"""
+        if key == 'zones':
+            return default if self.sources is None else str(self.sources)
+        for k, v in self.options:
+            if k == key:
+                return v
+        return default
+
+    def render(self, section_split: str = ' ', nonce: str = None) -> Optional[str]:
+        """
+        Render this directive into a CSP directive string, e.g. ``img-src 'self' https://i.imgur.com;`` - or ``None``
+        if the section is empty. If :attr:`.nonce` is enabled, and ``nonce`` is passed, then ``'nonce-<nonce>'`` is added
+        after the sources.
+        """
+        if self.empty:
+            return None
+        s = f"{self.name}{section_split}{'' if self.sources is None else ' '.join(self.sources)}"
+        if nonce is not None and self.nonce: s += f" 'nonce-{nonce}'"
+        if self.unsafe_eval: s += " 'unsafe-eval'"
+        if self.unsafe_inline: s += " 'unsafe-inline'"
+        return s + ';'
+
+    def as_dict(self) -> Dict[str, str]:
+        """Return this directive's keys as a dict of strings (the format of the old ``config_dict`` values)"""
+        d = {} if self.sources is None else {'zones': str(self.sources)}
+        d.update(self.options)
+        return d
+
+    def __eq__(self, other):
+        if not isinstance(other, Directive):
+            return NotImplemented
+        return (self.name, self.sources, self.options) == (other.name, other.sources, other.options)
+
+    def __hash__(self):
+        return hash((self.name, self.sources, self.options))
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name!r} sources={len(self.sources or ())} options={dict(self.options)!r}>"
@@ -0,0 +1,248 @@
+"""
+Header size optimizer - removes source expressions which are subsumed by broader source expressions in the same
+directive, e.g. ``https://www.privex.io`` when ``*.privex.io`` is also allowed, or ``https://cdn.privex.io`` when the
+bare scheme source ``https:`` is allowed.
+
+Sources are matched using the CSP Level 3 matching rules (scheme-part, host-part, port-part and path-part matching),
+and a source is only removed if *every* URL it matches is also matched by another source - so the policy allows
+exactly the same URLs before and after optimizing. Keyword sources (``'self'``, ``'unsafe-inline'`` etc.), nonces,
+hashes and anything which can't be parsed are always kept as-is.
+
+Scheme-less host sources (``cdn.privex.io``) match the scheme of the page they protect, so the optimizer assumes
+policies protect pages served over ``http:`` or ``https:``.
+
+    >>> optimize_tokens(["'self'", '*.privex.io', 'https://www.privex.io', 'https:', 'https://cdn.example.com/js/'])
+    (["'self'", '*.privex.io', 'https:'], ['https://www.privex.io', 'https://cdn.example.com/js/'])
+
+"""
+import re
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+__all__ = [
+    'Source', 'parse_source', 'subsumes', 'SubsumptionIndex', 'optimize_tokens', 'OptimizeResult', 're_scheme', 're_host'
+]
+
+SCHEME_MATCHES: Dict[str, FrozenSet[str]] = {
+    'http': frozenset({'http', 'https'}),
+    'ws': frozenset({'ws', 'wss', 'http', 'https'}),
+    'wss': frozenset({'wss', 'https'}),
+}
+"""
+CSP3 scheme-part matching - a source with scheme ``http`` also matches ``https`` URLs, ``ws`` matches ``wss`` / ``http`` / ``https``,
+and ``wss`` matches ``https``. Any other scheme only matches itself.
+"""
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ws': 80, 'wss': 443, 'ftp': 21}
+
+PAGE_SCHEMES = ('http', 'https')
+"""The schemes that protected pages are assumed to be served over, when matching scheme-less host sources"""
+
+KIND_OTHER, KIND_SCHEME, KIND_HOST, KIND_STAR = 0, 1, 2, 3
+
+re_scheme = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*):$')
+"""Matches a scheme source, e.g. ``https:``"""
+re_host = re.compile(
+    r'^(?:(?P<scheme>[a-zA-Z][a-zA-Z0-9+.-]*)://)?'
+    r'(?P<host>\*|(?:\*\.)?[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*)'
+    r'(?::(?P<port>[0-9]+|\*))?'
+    r'(?P<path>/[^;,\s]*)?$'
+)
+"""Matches a host source (with optional scheme, port and path) - the groups are ``scheme``, ``host``, ``port`` and ``path``"""
+
+
+class Source(NamedTuple):
+    """A parsed CSP source expression - see :func:`.parse_source`"""
+    token: str
+    kind: int
+    scheme: Optional[str] = None
+    host: Optional[str] = None
+    """Lowercase host, e.g. ``cdn.privex.io``, ``*.privex.io`` or ``*``"""
+    port: Optional[str] = None
+    """``None`` (the scheme's default port), ``'*'``, or the port number as a string"""
+    path: str = ''
+
+    @property
+    def wildcard(self) -> bool:
+        return self.host is not None and self.host.startswith('*')
+
+    @property
+    def base_host(self) -> str:
+        """The host without it's wildcard, e.g. ``privex.io`` for ``*.privex.io``, or ``''`` for ``*``"""
+        return self.host[2:] if self.host.startswith('*.') else ('' if self.host == '*' else self.host)
+
+
+def parse_source(token: str) -> Source:
+    """Parse a single CSP source expression, e.g. ``https://*.privex.io:443/js/`` or ``data:``"""
+    if token == '*':
+        return Source(token, KIND_STAR)
+    if token.startswith("'"):
+        return Source(token, KIND_OTHER)
+    m = re_scheme.match(token)
+    if m is not None:
+        return Source(token, KIND_SCHEME, scheme=m.group(1).lower())
+    m = re_host.match(token)
+    if m is not None:
+        scheme = m.group('scheme')
+        return Source(
+            token, KIND_HOST, scheme=scheme.lower() if scheme else None, host=m.group('host').lower(),
+            port=m.group('port'), path=m.group('path') or '',
+        )
+    return Source(token, KIND_OTHER)
+
+
+def _schemes(src: Source, page_scheme: str) -> FrozenSet[str]:
+    """The set of URL schemes which ``src`` matches, on a page served over ``page_scheme``"""
+    scheme = page_scheme if src.scheme is None else src.scheme
+    return SCHEME_MATCHES.get(scheme, frozenset({scheme}))
+
+
+def _port_covers(a_port: Optional[str], b_port: Optional[str], b_schemes: FrozenSet[str]) -> bool:
+    if a_port == '*' or a_port == b_port:
+        return True
+    if b_port == '*':
+        return False
+    # A port-less source matches the default port of the URL's scheme - so ':443' and no port are equivalent for https
+    expected = b_port if a_port is None else a_port
+    return all(DEFAULT_PORTS.get(s) is not None and str(DEFAULT_PORTS[s]) == expected for s in b_schemes)
+
+
+def _host_covers(a: Source, b: Source) -> bool:
+    if a.host == '*':
+        return True
+    if a.wildcard:
+        base = a.base_host
+        return (b.wildcard and b.base_host == base) or b.base_host.endswith('.' + base)
+    return not b.wildcard and a.host == b.host
+
+
+def _path_covers(a_path: str, b_path: str) -> bool:
+    if not a_path:
+        return True
+    if a_path.endswith('/'):
+        return b_path.startswith(a_path)
+    return a_path == b_path
+
+
+def subsumes(a: Source, b: Source) -> bool:
+    """Returns ``True`` if every URL matched by the source ``b`` is also matched by the source ``a``"""
+    if b.kind in (KIND_OTHER, KIND_STAR) or a.kind == KIND_OTHER:
+        return False
+    for page in PAGE_SCHEMES:
+        b_schemes = _schemes(b, page)
+        if a.kind == KIND_STAR:
+            # '*' matches any URL with a http(s) scheme, or the same scheme as the page - on any host or port
+            if not b_schemes <= {'http', 'https', page}:
+                return False
+            continue
+        if not b_schemes <= _schemes(a, page):
+            return False
+        if a.kind == KIND_SCHEME:
+            continue
+        if b.kind == KIND_SCHEME:
+            return False
+        if not _port_covers(a.port, b.port, b_schemes):
+            return False
+    if a.kind != KIND_HOST:
+        return True
+    return _host_covers(a, b) and _path_covers(a.path, b.path)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'exact', 'wild')
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.exact: List[int] = []
+        self.wild: List[int] = []
+
+
+class SubsumptionIndex:
+    """
+    Indexes a list of parsed sources so that the sources which may subsume a given source can be found without
+    comparing every pair - scheme sources and ``*`` are kept in flat lists, and host sources are stored in a trie
+    keyed by their reversed host labels (``io`` -> ``privex`` -> ``cdn``), so only sources with a matching host
+    suffix are checked.
+    """
+    def __init__(self, sources: Iterable[Source]):
+        self.sources: List[Source] = list(sources)
+        self.root = _TrieNode()
+        self.broad: List[int] = []
+        """Indexes of scheme sources and ``*`` - which may subsume a source on any host"""
+        for i, src in enumerate(self.sources):
+            if src.kind in (KIND_SCHEME, KIND_STAR):
+                self.broad.append(i)
+            elif src.kind == KIND_HOST:
+                node = self._node(src.base_host, create=True)
+                (node.wild if src.wildcard else node.exact).append(i)
+
+    def _node(self, host: str, create: bool = False) -> Optional[_TrieNode]:
+        node = self.root
+        for label in reversed(host.split('.')) if host else ():
+            nxt = node.children.get(label)
+            if nxt is None:
+                if not create: return None
+                nxt = node.children[label] = _TrieNode()
+            node = nxt
+        return node
+
+    def candidates(self, src: Source) -> List[int]:
+        """Return the indexes of the sources which might subsume ``src`` (which still need checking with :func:`.subsumes`)"""
+        if src.kind not in (KIND_SCHEME, KIND_HOST):
+            return []
+        res = list(self.broad)
+        if src.kind == KIND_SCHEME:
+            return res
+        node = self.root
+        res.extend(node.wild)
+        labels = list(reversed(src.base_host.split('.'))) if src.base_host else []
+        for depth, label in enumerate(labels, start=1):
+            node = node.children.get(label)
+            if node is None:
+                break
+            # '*.x' matches subdomains of x, but not x itself - unless the source being checked is also '*.x'
+            if depth < len(labels) or src.wildcard:
+                res.extend(node.wild)
+            if depth == len(labels) and not src.wildcard:
+                res.extend(node.exact)
+        return res
+
+    def redundant(self) -> List[int]:
+        """
+        Return the indexes of every source which is subsumed by another source. When two sources are equivalent
+        (e.g. ``https://privex.io`` and ``https://privex.io:443``), only the later one is treated as redundant.
+        """
+        res = []
+        for i, b in enumerate(self.sources):
+            for j in self.candidates(b):
+                if j == i: continue
+                a = self.sources[j]
+                if subsumes(a, b) and (j < i or not subsumes(b, a)):
+                    res.append(i)
+                    break
+        return res
+
+
+class OptimizeResult(NamedTuple):
+    kept: List[str]
+    removed: List[str]
+
+    @property
+    def bytes_saved(self) -> int:
+        """How many bytes shorter the space-joined sources are after optimizing"""
+        return len(' '.join(self.kept + self.removed)) - len(' '.join(self.kept))
+
+
+def optimize_tokens(tokens: List[str]) -> OptimizeResult:
+    """
+    Remove every source in ``tokens`` which is subsumed by another source in ``tokens``, preserving the order of the
+    remaining sources.
+
+    :return OptimizeResult result: ``(kept, removed)`` - the remaining sources, and the sources which were removed
+    """
+    index = SubsumptionIndex(parse_source(t) for t in tokens)
+    redundant = set(index.redundant())
+    if not redundant:
+        return OptimizeResult(list(tokens), [])
+    return OptimizeResult(
+        [t for i, t in enumerate(tokens) if i not in redundant], [t for i, t in enumerate(tokens) if i in redundant]
+    )
@@ -0,0 +1,388 @@
+"""
+Multi-tenant policy registry - maps hostnames (including wildcard hosts) to compiled policies, for applications
+which serve many domains, each with it's own INI file, from one process.
+
+Tenants are registered up-front (which is cheap - nothing is read or compiled), and each tenant's INI is compiled
+the first time one of it's hostnames is looked up. Only the :class:`.CompiledPolicy` is kept, never the builder, and
+once more than ``max_policies`` policies (or ``max_bytes`` bytes of policies) are held, the least recently used ones
+are dropped - they're simply recompiled if they're requested again.
+
+    >>> registry = PolicyRegistry(max_policies=1000, max_bytes=64 * 1024 * 1024)
+    >>> registry.register('privex.io', '*.privex.io', filename='/etc/csp/privex.ini')
+    >>> registry.register('example.com', contents="[default-src]\\nzones = self\\n")
+    >>> registry.register('*', filename='/etc/csp/default.ini')    # Fallback for any other host
+    >>> registry.lookup('cdn.privex.io:8080')
+    <CompiledPolicy directives=['default-src', 'img-src', ...] flags=['upgrade-insecure-requests;']>
+
+Exact hostnames are found with a single dict lookup. Wildcard hosts (``*.privex.io``) are stored in a trie keyed by
+reversed host labels (``io`` -> ``privex``), and match any subdomain at any depth - when several wildcards match,
+the longest (most specific) one wins, and an exact hostname always wins over a wildcard.
+
+Compiled policies are shared between tenants wherever possible: tenants which compile to identical policies share
+a single :class:`.CompiledPolicy`, identical directive strings are interned so they're only held once, and tenants
+which ``extends`` the same base INI share the base's resolved groups (see :func:`.load_base`).
+"""
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from privex.cspgen.builder import CSPBuilder, CompiledPolicy
+
+log = logging.getLogger(__name__)
+
+__all__ = ['normalize_host', 'policy_size', 'Tenant', 'HostTrie', 'PolicyRegistry']
+
+
+def normalize_host(host: str) -> str:
+    """
+    Normalize a hostname (e.g. from a ``Host`` header) for lookups - lowercases it, and strips any port and trailing dot.
+
+        >>> normalize_host('WWW.Privex.IO.:8443')
+        'www.privex.io'
+        >>> normalize_host('[::1]:8080')
+        '::1'
+    """
+    host = host.strip().lower()
+    if host.startswith('['):
+        return host[1:host.find(']')] if ']' in host else host[1:]
+    if host.count(':') == 1:
+        host = host.split(':', 1)[0]
+    return host.rstrip('.')
+
+
+def policy_size(policy: CompiledPolicy, sep: str = ' ') -> int:
+    """
+    Estimate how many bytes ``policy`` holds once it's header has been rendered with ``sep`` - the rendered
+    directive strings, plus the joined header string and it's encoded bytes.
+    """
+    size = sys.getsizeof(policy) + sum(sys.getsizeof(s) for s in policy.sections)
+    size += sum(sys.getsizeof(s) for s in policy.nonce_directives.values())
+    return size + sys.getsizeof(policy.header(sep)) + sys.getsizeof(policy.header_bytes(sep))
+
+
+class Tenant:
+    """
+    A single tenant in a :class:`.PolicyRegistry` - the INI source to compile, and the hostnames it serves.
+
+    :ivar str name: The tenant's unique name (defaults to it's first hostname)
+    :ivar tuple hosts: The (normalized) hostnames / wildcard hosts which map to this tenant
+    :ivar Path filename: The INI file to compile (``None`` if ``contents`` is set)
+    :ivar contents: The INI contents to compile, as a string or list of lines (``None`` if ``filename`` is set)
+    :ivar dict builder_kwargs: Extra keyword arguments for :class:`.CSPBuilder`
+    """
+    __slots__ = ('name', 'hosts', 'filename', 'contents', 'builder_kwargs', 'lock')
+
+    def __init__(self, name: str, hosts: Iterable[str], filename: Union[str, PathLike] = None,
+                 contents: Union[str, list, tuple] = None, **builder_kwargs):
+        if (filename is None) == (contents is None):
+            raise ValueError(f"Tenant {name!r} requires exactly one of 'filename' or 'contents'")
+        self.name = name
+        self.hosts = tuple(dict.fromkeys(normalize_host(h) for h in hosts))
+        self.filename = None if filename is None else Path(filename).expanduser().resolve()
+        self.contents = contents
+        self.builder_kwargs = builder_kwargs
+        self.lock = threading.Lock()
+
+    def compile(self) -> CompiledPolicy:
+        """Read and compile this tenant's INI into a :class:`.CompiledPolicy`"""
+        if self.filename is not None:
+            return CSPBuilder(str(self.filename), **self.builder_kwargs).compile()
+        return CSPBuilder(contents=self.contents, **self.builder_kwargs).compile()
+
+    def __repr__(self):
+        src = str(self.filename) if self.filename is not None else '<contents>'
+        return f"<{type(self).__name__} {self.name!r} hosts={list(self.hosts)!r} source={src!r}>"
+
+
+class _HostNode:
+    __slots__ = ('children', 'wild')
+
+    def __init__(self):
+        self.children: Dict[str, _HostNode] = {}
+        self.wild: Optional[str] = None
+
+
+class HostTrie:
+    """
+    Maps exact hostnames and wildcard hosts (``*.privex.io``, or ``*`` for any host) to values (e.g. tenant names).
+
+    Exact hosts are held in a plain dict, while wildcards are held in a trie keyed by their reversed labels, so a
+    lookup costs one dict lookup per label of the hostname, regardless of how many wildcards are registered.
+
+        >>> t = HostTrie()
+        >>> t['*.privex.io'] = 'privex'
+        >>> t['*.cdn.privex.io'] = 'cdn'
+        >>> t.lookup('a.b.cdn.privex.io'), t.lookup('www.privex.io'), t.lookup('privex.io')
+        ('cdn', 'privex', None)
+    """
+    def __init__(self):
+        self.exact: Dict[str, str] = {}
+        self.root = _HostNode()
+
+    @staticmethod
+    def _labels(host: str) -> List[str]:
+        return list(reversed(host.split('.'))) if host else []
+
+    def __setitem__(self, host: str, value: str):
+        if host == '*':
+            self.root.wild = value
+        elif host.startswith('*.'):
+            node = self.root
+            for label in self._labels(host[2:]):
+                node = node.children.setdefault(label, _HostNode())
+            node.wild = value
+        elif '*' in host:
+            raise ValueError(f"Invalid wildcard host {host!r} - wildcards must be '*' or start with '*.'")
+        else:
+            self.exact[host] = value
+
+    def __delitem__(self, host: str):
+        if host == '*' or host.startswith('*.'):
+            path, node = [], self.root
+            for label in self._labels('' if host == '*' else host[2:]):
+                path.append((node, label))
+                node = node.children.get(label)
+                if node is None: raise KeyError(host)
+            if node.wild is None: raise KeyError(host)
+            node.wild = None
+            # Prune any branches which no longer lead to a wildcard
+            for parent, label in reversed(path):
+                child = parent.children[label]
+                if child.wild is not None or child.children: break
+                del parent.children[label]
+        else:
+            del self.exact[host]
+
+    def _wild_node(self, host: str) -> Optional[_HostNode]:
+        node = self.root
+        for label in self._labels('' if host == '*' else host[2:]):
+            node = node.children.get(label)
+            if node is None: return None
+        return node
+
+    def get(self, host: str, default=None) -> Optional[str]:
+        """Return the value registered for exactly ``host`` (a hostname, or a wildcard such as ``*.privex.io``)"""
+        if host == '*' or host.startswith('*.'):
+            node = self._wild_node(host)
+            return default if node is None or node.wild is None else node.wild
+        return self.exact.get(host, default)
+
+    def lookup(self, host: str) -> Optional[str]:
+        """Return the value for the (normalized) hostname ``host`` - exact matches first, then the most specific wildcard"""
+        value = self.exact.get(host)
+        if value is not None:
+            return value
+        node, best = self.root, self.root.wild
+        labels = self._labels(host)
+        # '*.x' only matches subdomains of x, so the last label is never matched against a wildcard
+        for label in labels[:-1]:
+            node = node.children.get(label)
+            if node is None: break
+            if node.wild is not None: best = node.wild
+        return best
+
+
+class PolicyRegistry:
+    """
+    Maps hostnames to lazily compiled :class:`.CompiledPolicy` objects, holding at most ``max_policies`` compiled
+    policies (and at most ``max_bytes`` bytes of them, as estimated by :func:`.policy_size`) - evicting the least
+    recently used policies once either limit is exceeded. Safe to use from multiple threads.
+
+    :param int max_policies: Maximum number of compiled policies to hold (``None`` for no limit)
+    :param int max_bytes: Maximum total estimated size of the compiled policies to hold (``None`` for no limit)
+    :param str sep: The separator the policies' headers are rendered with - used to estimate their size
+    :param builder_kwargs: Any extra keyword arguments are passed through to :class:`.CSPBuilder` for every tenant
+    """
+    def __init__(self, max_policies: Optional[int] = 1000, max_bytes: Optional[int] = None, sep: str = ' ', **builder_kwargs):
+        self.max_policies = max_policies
+        self.max_bytes = max_bytes
+        self.sep = sep
+        self.builder_kwargs = builder_kwargs
+        self.tenants: Dict[str, Tenant] = {}
+        self.hosts = HostTrie()
+        self._compiled: 'OrderedDict[str, CompiledPolicy]' = OrderedDict()
+        self._shared: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], List] = {}
+        """
+        Maps the ``(sections, nonce_sections)`` of each distinct compiled policy to ``[policy, refcount, size]``, so
+        identical policies are held once - policies which only differ in their nonce slots are kept apart
+        """
+        self.bytes = 0
+        """The total estimated size of the distinct compiled policies currently held"""
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.RLock()
+
+    def register(self, *hosts: str, filename: Union[str, PathLike] = None, contents: Union[str, list, tuple] = None,
+                 name: str = None, **builder_kwargs) -> Tenant:
+        """
+        Register a tenant serving ``hosts`` - exact hostnames, wildcard hosts (``*.privex.io``), or ``*`` to match any
+        host which no other tenant matches. Nothing is read or compiled until one of the hosts is looked up.
+
+        If a tenant with the same ``name`` already exists, it's replaced (and it's compiled policy dropped).
+
+        :param hosts: One or more hostnames for this tenant
+        :param filename: The tenant's INI file
+        :param contents: The tenant's INI contents, as a string or list of lines (instead of ``filename``)
+        :param str name: A unique name for the tenant (default: the first hostname)
+        :param builder_kwargs: Extra keyword arguments for :class:`.CSPBuilder`, overriding the registry's
+        :raises ValueError: When no hosts are passed, or a wildcard host is invalid
+        """
+        if len(hosts) == 0:
+            raise ValueError("PolicyRegistry.register requires at least one hostname")
+        tenant = Tenant(
+            normalize_host(hosts[0]) if name is None else name, hosts, filename=filename, contents=contents,
+            **{**self.builder_kwargs, **builder_kwargs}
+        )
+        with self._lock:
+            if tenant.name in self.tenants:
+                self.unregister(tenant.name)
+            for h in tenant.hosts:
+                self.hosts[h] = tenant.name
+            self.tenants[tenant.name] = tenant
+        return tenant
+
+    def register_dir(self, folder: Union[str, PathLike], pattern: str = '*.ini', **builder_kwargs) -> List[Tenant]:
+        """
+        Register every INI file in ``folder`` matching ``pattern``, using each file's name (without ``.ini``) as it's
+        hostname - e.g. ``privex.io.ini`` serves ``privex.io``, and ``*.privex.io.ini`` serves it's subdomains.
+        """
+        return [self.register(f.stem, filename=f, **builder_kwargs) for f in sorted(Path(folder).expanduser().glob(pattern))]
+
+    def unregister(self, name: str):
+        """Remove the tenant ``name`` along with it's hostnames and compiled policy. Raises :class:`KeyError` if it doesn't exist."""
+        with self._lock:
+            tenant = self.tenants.pop(name)
+            for h in tenant.hosts:
+                # Another tenant may have since been registered for the same host - leave it's mapping alone
+                if self.hosts.get(h) == name:
+                    del self.hosts[h]
+            self._drop(name)
+
+    def tenant_for(self, host: str) -> Optional[Tenant]:
+        """Return the :class:`.Tenant` which serves the hostname ``host`` (or ``None`` if no tenant matches)"""
+        name = self.hosts.lookup(normalize_host(host))
+        return None if name is None else self.tenants.get(name)
+
+    def lookup(self, host: str) -> Optional[CompiledPolicy]:
+        """
+        Return the compiled policy for the hostname ``host`` (e.g. a ``Host`` header, ports are ignored), compiling the
+        tenant's INI if it isn't already held. Returns ``None`` if no tenant matches ``host``.
+
+        Errors from compiling the tenant's INI (e.g. a missing file or :class:`.MarkerError`) are raised.
+        """
+        tenant = self.tenant_for(host)
+        if tenant is None:
+            return None
+        with self._lock:
+            policy = self._hit(tenant.name)
+            if policy is not None:
+                return policy
+        # Compile outside of the registry lock, so one slow tenant doesn't block lookups for every other tenant -
+        # the tenant's own lock stops concurrent requests for the same tenant from compiling it more than once.
+        with tenant.lock:
+            with self._lock:
+                policy = self._hit(tenant.name)
+                if policy is not None:
+                    return policy
+            policy = tenant.compile()
+            with self._lock:
+                self.misses += 1
+                if self.tenants.get(tenant.name) is not tenant:
+                    # The tenant was replaced / unregistered while compiling - don't cache the stale policy
+                    return policy
+                policy = self._store(tenant.name, policy)
+                self._evict()
+        return policy
+
+    def __getitem__(self, host: str) -> CompiledPolicy:
+        policy = self.lookup(host)
+        if policy is None:
+            raise KeyError(host)
+        return policy
+
+    def get(self, host: str, default=None) -> Optional[CompiledPolicy]:
+        policy = self.lookup(host)
+        return default if policy is None else policy
+
+    def __contains__(self, host: str) -> bool:
+        return self.tenant_for(host) is not None
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def _hit(self, name: str) -> Optional[CompiledPolicy]:
+        """Return the compiled policy held for the tenant ``name`` (or ``None``), marking it as the most recently used"""
+        policy = self._compiled.get(name)
+        if policy is not None:
+            self._compiled.move_to_end(name)
+            self.hits += 1
+        return policy
+
+    def _store(self, name: str, policy: CompiledPolicy) -> CompiledPolicy:
+        self._drop(name)
+        key = (policy.sections, policy.nonce_sections)
+        shared = self._shared.get(key)
+        if shared is None:
+            # Identical directives across tenants (e.g. "font-src 'self';") are interned, so they're only stored once
+            policy = CompiledPolicy(
+                {k: sys.intern(v) for k, v in policy.directives.items()}, [sys.intern(f) for f in policy.flags],
+                nonce_directives={k: sys.intern(v) for k, v in policy.nonce_directives.items()},
+            )
+            shared = self._shared[key] = [policy, 0, policy_size(policy, self.sep)]
+            self.bytes += shared[2]
+        shared[1] += 1
+        self._compiled[name] = shared[0]
+        return shared[0]
+
+    def _drop(self, name: str) -> bool:
+        policy = self._compiled.pop(name, None)
+        if policy is None:
+            return False
+        key = (policy.sections, policy.nonce_sections)
+        shared = self._shared[key]
+        shared[1] -= 1
+        if shared[1] <= 0:
+            del self._shared[key]
+            self.bytes -= shared[2]
+        return True
+
+    def _evict(self):
+        while self._compiled and (
+            (self.max_policies is not None and len(self._compiled) > self.max_policies) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            if len(self._compiled) == 1 and self.max_policies != 0:
+                break   # Always keep the policy which was just compiled, even if it alone is over max_bytes
+            name = next(iter(self._compiled))
+            self._drop(name)
+            self.evictions += 1
+            log.debug("Evicted compiled policy for tenant %r from the registry", name)
+
+    def invalidate(self, name: str = None):
+        """
+        Drop the compiled policy for the tenant ``name`` (or every tenant, if ``name`` is ``None``), so that it's
+        recompiled from it's INI on the next lookup - e.g. after the INI file was changed.
+        """
+        with self._lock:
+            for n in (list(self._compiled) if name is None else [name]):
+                self._drop(n)
+
+    @property
+    def compiled(self) -> Tuple[str, ...]:
+        """The names of the tenants which currently have a compiled policy held, least recently used first"""
+        with self._lock:
+            return tuple(self._compiled)
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters for the registry - tenants, compiled / distinct policies held, bytes, hits, misses and evictions"""
+        with self._lock:
+            return dict(
+                tenants=len(self.tenants), compiled=len(self._compiled), distinct=len(self._shared), bytes=self.bytes,
+                hits=self.hits, misses=self.misses, evictions=self.evictions,
+            )
+
+    def __repr__(self):
+        return f"<{type(self).__name__} tenants={len(self.tenants)} compiled={len(self._compiled)} bytes={self.bytes}>"
@@ -0,0 +1,561 @@
+"""
+A lightweight asyncio collector for CSP violation reports, with bounded-memory aggregation.
+
+Point your policy's ``report-uri`` (and / or ``report-to``) at the collector, and it accepts both the legacy
+``report-uri`` bodies (``application/csp-report``) and Reporting API bodies (``application/reports+json``). Reports
+are queued as raw bytes by the HTTP handler, and parsed in batches by a separate task, so a burst of reports never
+blocks the server from accepting more.
+
+Counts are aggregated by directive and blocked origin, in structures whose size doesn't depend on how many distinct
+origins are seen - a :class:`.CountMinSketch` (approximate count for any origin) and a :class:`.TopK` (Space-Saving
+heavy hitters). Every ``flush_interval`` seconds the aggregated counts are flushed to a :class:`.FileSink` (NDJSON) or
+:class:`.SQLiteSink`, and reset.
+
+If the collector is given the INI your policy was generated from, :func:`.suggest` compares the most frequently
+blocked origins against the policy, and suggests which sources to add - ignoring noise such as browser extensions.
+
+Run it from the command line (e.g. behind nginx with ``proxy_pass``)::
+
+    python3 -m privex.cspgen.reports --listen 127.0.0.1:8090 --sqlite /var/lib/cspgen/reports.db --ini site.ini
+
+Then ``GET /stats`` returns the current counts as JSON, and ``GET /suggestions`` the suggested additions. Or use
+:class:`.ReportCollector` from your own asyncio application.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'Violation', 'parse_reports', 'normalize_blocked', 'CountMinSketch', 'TopK', 'ReportAggregator', 'FileSink',
+    'SQLiteSink', 'Suggestion', 'suggest', 'ReportCollector', 'main', 'DIRECTIVE_FALLBACKS', 'NO_FALLBACK'
+]
+
+REPORT_CONTENT_TYPES = ('application/csp-report', 'application/reports+json', 'application/json')
+EXTENSION_SCHEMES = ('chrome-extension', 'moz-extension', 'safari-extension', 'safari-web-extension', 'ms-browser-extension')
+"""Blocked URLs with these schemes come from browser extensions, not the site - they're never suggested"""
+
+DIRECTIVE_FALLBACKS: Dict[str, Tuple[str, ...]] = {
+    'script-src-elem': ('script-src', 'default-src'),
+    'script-src-attr': ('script-src', 'default-src'),
+    'style-src-elem': ('style-src', 'default-src'),
+    'style-src-attr': ('style-src', 'default-src'),
+    'worker-src': ('child-src', 'script-src', 'default-src'),
+    'frame-src': ('child-src', 'default-src'),
+}
+"""Which directives a browser falls back to when a directive isn't in the policy (other fetch directives use ``default-src``)"""
+
+NO_FALLBACK = ('base-uri', 'form-action', 'frame-ancestors', 'sandbox', 'report-uri', 'report-to', 'navigate-to')
+"""Directives which never fall back to ``default-src`` - if they're not in the policy, they don't restrict anything"""
+
+
+class Violation(NamedTuple):
+    """A single parsed violation report"""
+    directive: str
+    """The effective directive which blocked the resource, e.g. ``img-src``"""
+    blocked: str
+    """The normalized blocked origin (``https://i.imgur.com``), scheme (``data:``), or keyword (``inline``, ``eval``)"""
+    document: str = ''
+    """The URL of the page the violation happened on"""
+
+
+def normalize_blocked(blocked: str) -> str:
+    """
+    Reduce a blocked URL to the origin which would need allowing - e.g. ``https://i.imgur.com:443/a.png?x`` becomes
+    ``https://i.imgur.com:443``, ``data:image/png...`` becomes ``data:``, while keywords such as ``inline`` are kept.
+    """
+    blocked = blocked.strip()
+    if '://' in blocked:
+        try:
+            u = urlsplit(blocked)
+            host = u.hostname or ''
+            port = f":{u.port}" if u.port else ''
+        except ValueError:
+            return blocked.lower()
+        return f"{u.scheme.lower()}://{host}{port}" if host else f"{u.scheme.lower()}:"
+    if ':' in blocked:
+        return blocked.split(':', 1)[0].lower() + ':'
+    if blocked in ('data', 'blob', 'filesystem', 'mediastream'):
+        return blocked + ':'
+    return blocked.lower()
+
+
+def _directive(d: Optional[str]) -> str:
+    return (d or '').strip().split(' ', 1)[0].lower()
+
+
+def parse_reports(body: Union[str, bytes]) -> List[Violation]:
+    """
+    Parse a report request body - either a legacy ``report-uri`` body (``{"csp-report": {...}}``), or a Reporting API
+    body (a list of ``{"type": "csp-violation", "body": {...}}`` objects). Anything else is ignored.
+
+    :raises ValueError: If the body isn't valid JSON
+    """
+    data = json.loads(body)
+    items = data if isinstance(data, list) else [data]
+    res = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if 'csp-report' in item:
+            r = item['csp-report']
+            if not isinstance(r, dict): continue
+            directive = _directive(r.get('effective-directive') or r.get('violated-directive'))
+            blocked, doc = r.get('blocked-uri', ''), r.get('document-uri', '')
+        elif item.get('type') == 'csp-violation' and isinstance(item.get('body'), dict):
+            r = item['body']
+            directive = _directive(r.get('effectiveDirective') or r.get('violatedDirective'))
+            blocked, doc = r.get('blockedURL', ''), r.get('documentURL', item.get('url', ''))
+        else:
+            continue
+        if directive:
+            res.append(Violation(directive, normalize_blocked(str(blocked or '')), str(doc or '')))
+    return res
+
+
+class CountMinSketch:
+    """
+    Approximate counts for any number of distinct keys in fixed memory (``width * depth`` counters). A key's count
+    is never under-estimated, and over-estimated by at most ``2 / width`` of the total count with probability
+    ``1 - 0.5 ** depth``.
+    """
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width, self.depth = width, depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def _cells(self, key) -> Iterable[Tuple[List[int], int]]:
+        for seed, row in enumerate(self.rows):
+            yield row, hash((seed, key)) % self.width
+
+    def add(self, key, count: int = 1):
+        self.total += count
+        for row, i in self._cells(key):
+            row[i] += count
+
+    def __getitem__(self, key) -> int:
+        return min(row[i] for row, i in self._cells(key))
+
+    def clear(self):
+        self.rows = [[0] * self.width for _ in range(self.depth)]
+        self.total = 0
+
+
+class TopK:
+    """
+    Tracks the ``k`` most frequent keys in a stream with the Space-Saving algorithm, holding at most ``k`` keys. When a
+    new key arrives and the table is full, it replaces the key with the lowest count, inheriting that count as it's
+    possible error - so heavy hitters are always kept, and their counts are over-estimated by at most ``error``.
+
+    The lowest count is found with a min-heap of ``(count, seq, key)``. Incrementing a tracked key doesn't touch the
+    heap - an entry whose count is out of date is only fixed (pushed back with it's current count) when it reaches the
+    top during an eviction, so each :meth:`.add` costs ``O(log k)`` amortized.
+    """
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.counts: Dict[object, List[int]] = {}
+        """Maps each tracked key to ``[count, error]``"""
+        self._heap: List[Tuple[int, int, object]] = []
+        self._seq = 0
+
+    def _push(self, key, count: int):
+        # seq breaks ties between equal counts, so keys (which may not be orderable) are never compared
+        self._seq += 1
+        heapq.heappush(self._heap, (count, self._seq, key))
+
+    def add(self, key, count: int = 1):
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self.counts) < self.k:
+            self.counts[key] = [count, 0]
+            self._push(key, count)
+            return
+        while True:
+            floor, _, victim = heapq.heappop(self._heap)
+            current = self.counts[victim][0]
+            if current == floor:
+                break
+            self._push(victim, current)
+        del self.counts[victim]
+        self.counts[key] = [floor + count, floor]
+        self._push(key, floor + count)
+
+    def top(self, n: int = None) -> List[Tuple[object, int, int]]:
+        """Return the top ``n`` (default: all tracked) keys as ``(key, count, error)``, highest count first"""
+        items = sorted(self.counts.items(), key=lambda x: -x[1][0])
+        return [(k, c, e) for k, (c, e) in items[:n]]
+
+    def clear(self):
+        self.counts, self._heap = {}, []
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class ReportAggregator:
+    """
+    Aggregates violations in bounded memory - exact counts per directive (of which there are only a few dozen), and
+    per ``(directive, blocked)`` pair, approximate counts in a :class:`.CountMinSketch` plus the heaviest pairs in a
+    :class:`.TopK`.
+    """
+    def __init__(self, top_k: int = 200, width: int = 2048, depth: int = 4, max_directives: int = 64):
+        self.sketch = CountMinSketch(width, depth)
+        self.top = TopK(top_k)
+        self.max_directives = max_directives
+        self.directives: Dict[str, int] = {}
+        self.total = 0
+        self.started = time.time()
+
+    def add(self, v: Violation, count: int = 1):
+        self.total += count
+        if v.directive in self.directives or len(self.directives) < self.max_directives:
+            self.directives[v.directive] = self.directives.get(v.directive, 0) + count
+        key = (v.directive, v.blocked)
+        self.sketch.add(key, count)
+        self.top.add(key, count)
+
+    def add_many(self, violations: Iterable[Violation]):
+        for v in violations:
+            self.add(v)
+
+    def count(self, directive: str, blocked: str) -> int:
+        """Return the (approximate, never under-estimated) count of violations for ``blocked`` in ``directive``"""
+        return self.sketch[(directive, normalize_blocked(blocked))]
+
+    def snapshot(self, n: int = None) -> dict:
+        """Return the current counts as a JSON serializable dict"""
+        return dict(
+            started=self.started, at=time.time(), total=self.total, directives=dict(self.directives),
+            top=[dict(directive=d, blocked=b, count=c, error=e) for (d, b), c, e in self.top.top(n)],
+        )
+
+    def reset(self):
+        self.sketch.clear()
+        self.top.clear()
+        self.directives, self.total, self.started = {}, 0, time.time()
+
+
+class FileSink:
+    """Appends each flushed :meth:`.ReportAggregator.snapshot` to ``path`` as one JSON line"""
+    def __init__(self, path: Union[str, PathLike]):
+        self.path = Path(path).expanduser()
+
+    def write(self, snapshot: dict):
+        with open(self.path, 'a') as fh:
+            fh.write(json.dumps(snapshot, separators=(',', ':')) + '\n')
+
+    def load_counts(self) -> Dict[Tuple[str, str], int]:
+        """Sum the ``top`` counts of every snapshot in the file"""
+        counts = {}
+        with open(self.path) as fh:
+            for line in fh:
+                for t in json.loads(line).get('top', []):
+                    k = (t['directive'], t['blocked'])
+                    counts[k] = counts.get(k, 0) + t['count']
+        return counts
+
+
+class SQLiteSink:
+    """
+    Accumulates flushed counts into an SQLite database - the ``violations`` table holds the running total for each
+    ``(directive, blocked)`` pair, and ``flushes`` holds the totals of each flush.
+    """
+    def __init__(self, path: Union[str, PathLike]):
+        self.path = str(Path(path).expanduser())
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS violations (
+                    directive TEXT NOT NULL, blocked TEXT NOT NULL, count INTEGER NOT NULL,
+                    first_seen REAL NOT NULL, last_seen REAL NOT NULL, PRIMARY KEY (directive, blocked)
+                );
+                CREATE TABLE IF NOT EXISTS flushes (started REAL NOT NULL, at REAL NOT NULL, total INTEGER NOT NULL);
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, snapshot: dict):
+        at = snapshot['at']
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO violations (directive, blocked, count, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (directive, blocked) DO UPDATE SET count = count + excluded.count, last_seen = excluded.last_seen",
+                    [(t['directive'], t['blocked'], t['count'], at, at) for t in snapshot['top']]
+                )
+                conn.execute("INSERT INTO flushes (started, at, total) VALUES (?, ?, ?)", (snapshot['started'], at, snapshot['total']))
+        finally:
+            conn.close()
+
+    def load_counts(self) -> Dict[Tuple[str, str], int]:
+        """Return the running total for every ``(directive, blocked)`` pair"""
+        conn = self._connect()
+        try:
+            return {(d, b): c for d, b, c in conn.execute("SELECT directive, blocked, count FROM violations")}
+        finally:
+            conn.close()
+
+
+class Suggestion(NamedTuple):
+    directive: str
+    """The INI section to add the source to"""
+    source: Optional[str]
+    """The source to add (``None`` when there's nothing safe to add, e.g. for inline scripts)"""
+    count: int
+    note: str = ''
+
+
+def _allowed_by(builder, directive: str) -> Tuple[Optional[str], List[str]]:
+    """Return the section which governs ``directive`` in the builder's policy (following browser fallbacks), and it's sources"""
+    names = (directive,) + DIRECTIVE_FALLBACKS.get(directive, ('default-src',) if directive not in NO_FALLBACK else ())
+    for name in names:
+        d = builder.directives.get(name)
+        if d is not None and d.sources is not None:
+            return name, list(d.sources)
+    return None, []
+
+
+def suggest(counts: Union[ReportAggregator, Dict[Tuple[str, str], int]], builder, min_count: int = 10) -> List[Suggestion]:
+    """
+    Compare the most frequently blocked origins against the policy compiled by ``builder`` (a :class:`.CSPBuilder`),
+    and suggest sources to add to it's INI - most reported first.
+
+    Origins which the policy already allows (e.g. a violation reported before the policy was updated) are skipped, as
+    are browser extensions and anything reported fewer than ``min_count`` times. Inline / eval violations are listed
+    with a note, but no source - adding ``'unsafe-inline'`` should be a deliberate choice (consider ``hash-dirs``).
+
+    :param counts: A :class:`.ReportAggregator`, or a dict of ``(directive, blocked): count`` (e.g. from a sink's ``load_counts``)
+    """
+    from privex.cspgen.optimize import KIND_HOST, KIND_SCHEME, parse_source, subsumes
+    if isinstance(counts, ReportAggregator):
+        counts = {k: c for k, c, _ in counts.top.top()}
+    builder.autoclean()
+    res = []
+    for (directive, blocked), count in sorted(counts.items(), key=lambda x: -x[1]):
+        if count < min_count or not blocked:
+            continue
+        if blocked.split(':', 1)[0] in EXTENSION_SCHEMES:
+            continue
+        section, sources = _allowed_by(builder, directive)
+        if blocked in ('inline', 'eval', 'wasm-eval', 'trusted-types-policy', 'trusted-types-sink'):
+            res.append(Suggestion(directive, None, count, f"{blocked} violation - use hash-dirs or a nonce rather than 'unsafe-{blocked}'"))
+            continue
+        src = parse_source(blocked)
+        if src.kind not in (KIND_HOST, KIND_SCHEME):
+            continue
+        if any(s == blocked or subsumes(parse_source(s), src) for s in sources):
+            continue
+        note = '' if section == directive else (
+            f"[{directive}] isn't in the INI - add it to [{section}], or create [{directive}] from it" if section
+            else f"[{directive}] isn't in the INI"
+        )
+        res.append(Suggestion(directive if section is None else section, blocked, count, note))
+    return res
+
+
+class ReportCollector:
+    """
+    An asyncio HTTP server which receives CSP violation reports on ``path`` (``POST``), and aggregates them with a
+    :class:`.ReportAggregator`. ``GET /stats`` and ``GET /suggestions`` return JSON.
+
+        >>> collector = ReportCollector('127.0.0.1', 8090, sink=SQLiteSink('reports.db'), builder=CSPBuilder('site.ini'))
+        >>> asyncio.run(collector.serve_forever())
+
+    :param str path: The URL path which accepts reports (``None`` to accept reports on any path)
+    :param float flush_interval: Flush the aggregated counts to ``sink`` (then reset them) every this many seconds
+    :param sink: A :class:`.FileSink` / :class:`.SQLiteSink` (or anything with a ``write(snapshot)`` method)
+    :param builder: A :class:`.CSPBuilder` to check suggestions against
+    :param int max_body: Reject request bodies larger than this many bytes
+    :param int queue_size: Maximum number of unparsed bodies to hold - when full, new reports are dropped (and counted)
+    :param int batch_size: Maximum number of bodies to parse per batch
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8090, path: Optional[str] = '/csp-report',
+                 flush_interval: float = 60.0, sink=None, builder=None, aggregator: ReportAggregator = None,
+                 max_body: int = 64 * 1024, queue_size: int = 10000, batch_size: int = 500, min_count: int = 10):
+        self.host, self.port, self.path = host, port, path
+        self.flush_interval, self.sink, self.builder = flush_interval, sink, builder
+        self.aggregator = ReportAggregator() if aggregator is None else aggregator
+        self.max_body, self.queue_size, self.batch_size, self.min_count = max_body, queue_size, batch_size, min_count
+        self.received = self.dropped = self.invalid = 0
+        self.queue: Optional[asyncio.Queue] = None
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle one HTTP/1.1 connection (with keep-alive)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, close=True)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = line.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                close = headers.get('connection', '').lower() == 'close'
+                length = int(headers.get('content-length') or 0)
+                if length > self.max_body:
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                await self._route(writer, method.upper(), target.split('?', 1)[0], body, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, writer, method: str, path: str, body: bytes, close: bool):
+        if method == 'GET' and path == '/stats':
+            data = self.aggregator.snapshot(50)
+            data.update(received=self.received, dropped=self.dropped, invalid=self.invalid, queued=self.queue.qsize())
+            return await self._respond(writer, 200, json.dumps(data).encode('utf-8'), close=close)
+        if method == 'GET' and path == '/suggestions':
+            if self.builder is None:
+                return await self._respond(writer, 404, b'{"error": "No INI was loaded"}', close=close)
+            data = [s._asdict() for s in suggest(self.aggregator, self.builder, self.min_count)]
+            return await self._respond(writer, 200, json.dumps(data).encode('utf-8'), close=close)
+        if method == 'OPTIONS':
+            return await self._respond(writer, 204, close=close, extra=(
+                ('Access-Control-Allow-Origin', '*'), ('Access-Control-Allow-Methods', 'POST'),
+                ('Access-Control-Allow-Headers', 'Content-Type'),
+            ))
+        if method != 'POST':
+            return await self._respond(writer, 405, close=close)
+        if self.path is not None and path != self.path:
+            return await self._respond(writer, 404, close=close)
+        self.received += 1
+        try:
+            self.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            self.dropped += 1
+        await self._respond(writer, 204, close=close)
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes = b'', close: bool = False, extra=()):
+        reason = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                  413: 'Payload Too Large'}.get(status, '')
+        head = [f"HTTP/1.1 {status} {reason}", f"Content-Length: {len(body)}"]
+        if body: head.append("Content-Type: application/json")
+        if close: head.append("Connection: close")
+        head += [f"{k}: {v}" for k, v in extra]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def consume(self):
+        """Parse queued report bodies in batches, and add them to the aggregator"""
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for body in batch:
+                try:
+                    self.aggregator.add_many(parse_reports(body))
+                except (ValueError, UnicodeDecodeError):
+                    self.invalid += 1
+            # Let the server accept more connections between batches
+            await asyncio.sleep(0)
+
+    async def flush(self):
+        """Write the aggregated counts to the sink (from a worker thread, so the event loop isn't blocked) and reset them"""
+        snapshot = self.aggregator.snapshot()
+        self.aggregator.reset()
+        if self.sink is not None and snapshot['total'] > 0:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.sink.write, snapshot)
+            except Exception:
+                log.exception("Failed to flush CSP report counts to %r", self.sink)
+        return snapshot
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def serve_forever(self):
+        """Start the server, consumer and flush tasks, and run until cancelled - flushing any remaining counts on exit"""
+        self.queue = asyncio.Queue(self.queue_size)
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        log.info("Listening for CSP reports on http://%s:%s%s", self.host, self.port, self.path or '/')
+        tasks = [asyncio.ensure_future(self.consume()), asyncio.ensure_future(self._flush_loop())]
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            for t in tasks:
+                t.cancel()
+            # Parse anything still queued, so it's included in the final flush
+            while not self.queue.empty():
+                try:
+                    self.aggregator.add_many(parse_reports(self.queue.get_nowait()))
+                except (ValueError, UnicodeDecodeError):
+                    self.invalid += 1
+            await self.flush()
+
+
+def main():
+    from privex.helpers import ErrHelpParser
+    from privex.cspgen.builder import setup_logging
+    parser = ErrHelpParser(description="Collect and aggregate CSP violation reports")
+    parser.add_argument('--listen', default='127.0.0.1:8090', help="host:port to listen on (default: 127.0.0.1:8090)")
+    parser.add_argument('--path', default='/csp-report', help="URL path which accepts reports (default: /csp-report)")
+    parser.add_argument('--flush-interval', type=float, default=60.0, help="Flush counts every N seconds (default: 60)")
+    parser.add_argument('--sqlite', default=None, help="Accumulate flushed counts into this SQLite database")
+    parser.add_argument('--file', default=None, help="Append flushed counts to this file as NDJSON")
+    parser.add_argument('--ini', default=None, help="The INI the policy was generated from - enables /suggestions")
+    parser.add_argument('--top-k', type=int, default=200, help="Number of (directive, origin) pairs to track (default: 200)")
+    parser.add_argument('--min-count', type=int, default=10, help="Only suggest origins reported at least this many times")
+    parser.add_argument('--suggest', action='store_true', default=False,
+                        help="Don't run the server - print suggestions for --ini from the counts stored in --sqlite / --file")
+    parser.add_argument('--verbose', '-v', action='store_true', default=False, dest='verbose_mode', help="Verbose Mode - Show DEBUG logs")
+    args = parser.parse_args()
+    setup_logging(logging.DEBUG if args.verbose_mode else os.getenv('LOG_LEVEL', 'INFO'))
+    if args.sqlite and args.file:
+        parser.error("Use either --sqlite or --file, not both")
+    sink = SQLiteSink(args.sqlite) if args.sqlite else (FileSink(args.file) if args.file else None)
+    builder = None
+    if args.ini:
+        from privex.cspgen.builder import CSPBuilder
+        builder = CSPBuilder(args.ini)
+    if args.suggest:
+        if sink is None or builder is None:
+            parser.error("--suggest requires --ini, and either --sqlite or --file")
+        for s in suggest(sink.load_counts(), builder, args.min_count):
+            print(f"[{s.directive}] {s.source or '-'}  ({s.count} reports){'  # ' + s.note if s.note else ''}")
+        return
+    host, _, port = args.listen.rpartition(':')
+    collector = ReportCollector(
+        host or '127.0.0.1', int(port), path=args.path, flush_interval=args.flush_interval, sink=sink, builder=builder,
+        aggregator=ReportAggregator(top_k=args.top_k), min_count=args.min_count,
+    )
+    try:
+        asyncio.run(collector.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    # Run main() from the module imported as privex.cspgen.reports, so that it's log messages go through the
+    # 'privex.cspgen' logger which setup_logging configures (rather than '__main__')
+    from privex.cspgen.reports import main as _main
+    _main()
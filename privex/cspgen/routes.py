@@ -0,0 +1,192 @@
+"""
+Per-route policy variants. A section named ``[directive@/prefix]`` overrides ``directive`` for every request path
+under ``/prefix``, layered over the rest of the config::
+
+    [script-src]
+    zones = 'self' {{cdn}}
+
+    # /checkout (and /checkout/...) also allow the payment provider
+    [script-src@/checkout]
+    zones = 'self' {{cdn}} https://js.stripe.com
+
+    # /admin only allows scripts from the site itself, and disables unsafe-inline
+    [script-src@/admin]
+    zones = 'self'
+    unsafe-inline = false
+
+    [frame-ancestors@/embed]
+    zones = https://partner.example.com
+
+    [flags@/admin]
+    flags = upgrade-insecure-requests block-all-mixed-content
+
+Keys in a route section override the same keys of the directive it's nested under - the directive in the main
+policy, or in the route for the nearest parent prefix (so ``[script-src@/admin/users]`` builds on
+``[script-src@/admin]``). Prefixes match whole path segments - ``/admin`` matches ``/admin`` and ``/admin/users``,
+but not ``/administrator``.
+
+:meth:`.CSPBuilder.compile_routes` compiles every variant ahead of time into a :class:`.RouteTable` - each variant is
+the parent's :class:`.CompiledPolicy` with only the overridden directives replaced, so unchanged directives share their
+rendered strings. Looking up a request path walks the table's segment trie, so it costs time proportional to the
+length of the path, however many routes there are.
+"""
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+__all__ = ['ROUTE_SEP', 'is_route', 'normalize_prefix', 'split_route', 'RouteTable']
+
+ROUTE_SEP = '@'
+"""Separates the directive name from the path prefix in a route section name, e.g. ``[script-src@/admin]``"""
+
+_MISSING = object()
+
+
+def is_route(section: str) -> bool:
+    """``True`` if ``section`` is a route section, e.g. ``script-src@/admin``"""
+    return ROUTE_SEP in section
+
+
+def normalize_prefix(prefix: str) -> str:
+    """
+    Normalise a route prefix - removing empty segments and any trailing slash (``/admin//users/`` -> ``/admin/users``)
+
+    :raises ValueError: When ``prefix`` doesn't start with ``/``
+    """
+    prefix = prefix.strip()
+    if not prefix.startswith('/'):
+        raise ValueError(f"Route prefixes must start with '/' - got {prefix!r}")
+    return '/' + '/'.join(s for s in prefix.split('/') if s)
+
+
+def split_route(section: str) -> Tuple[str, Optional[str]]:
+    """
+    Split a section name into ``(directive, prefix)`` - ``prefix`` is ``None`` for sections which aren't routes.
+
+        >>> split_route('script-src@/admin/')
+        ('script-src', '/admin')
+    """
+    name, sep, prefix = section.partition(ROUTE_SEP)
+    if not sep:
+        return section, None
+    prefix = normalize_prefix(prefix)
+    if prefix == '/':
+        raise ValueError(f"Route section [{section}] matches every path - use [{name.strip()}] instead")
+    return name.strip(), prefix
+
+
+def _segments(path: str) -> Iterator[str]:
+    # Ignore the query string / fragment, and empty segments (so '/admin//x' is the same as '/admin/x')
+    for c in '?#':
+        i = path.find(c)
+        if i != -1: path = path[:i]
+    return (s for s in path.split('/') if s)
+
+
+class _Node:
+    __slots__ = ('children', 'prefix', 'value')
+
+    def __init__(self, prefix: str):
+        self.children: Dict[str, _Node] = {}
+        self.prefix = prefix
+        self.value = _MISSING
+
+
+class RouteTable:
+    """
+    Maps URL path prefixes to values (e.g. :class:`.CompiledPolicy` objects), stored in a trie of path segments, so
+    that :meth:`.lookup` finds the value for the longest matching prefix in time proportional to the path's length.
+
+        >>> table = RouteTable(default='main')
+        >>> table['/admin'] = 'admin'
+        >>> table.lookup('/admin/users?page=2'), table.lookup('/administrator'), table.lookup('/')
+        ('admin', 'main', 'main')
+
+    :param default: The value returned for paths which don't match any prefix (stored as the prefix ``/``)
+    :param routes: An optional mapping of prefixes to values to add
+    """
+    __slots__ = ('_root', '_len')
+
+    def __init__(self, default: Any = None, routes: Dict[str, Any] = None):
+        self._root = _Node('/')
+        self._root.value = default
+        self._len = 0
+        for prefix, value in (routes or {}).items():
+            self[prefix] = value
+
+    @property
+    def default(self) -> Any:
+        return self._root.value
+
+    @default.setter
+    def default(self, value: Any):
+        self._root.value = value
+
+    def _node(self, prefix: str, create: bool = False) -> Optional[_Node]:
+        node, path = self._root, ''
+        for seg in _segments(prefix):
+            path += '/' + seg
+            nxt = node.children.get(seg)
+            if nxt is None:
+                if not create:
+                    return None
+                nxt = node.children[seg] = _Node(path)
+            node = nxt
+        return node
+
+    def match(self, path: str) -> Tuple[str, Any]:
+        """Return ``(prefix, value)`` for the longest prefix matching ``path`` (``('/', default)`` if none match)"""
+        node = best = self._root
+        if node.children:
+            for seg in _segments(path):
+                node = node.children.get(seg)
+                if node is None:
+                    break
+                if node.value is not _MISSING:
+                    best = node
+        return best.prefix, best.value
+
+    def lookup(self, path: str) -> Any:
+        """Return the value for the longest prefix matching the request path ``path`` (or :attr:`.default`)"""
+        return self.match(path)[1]
+
+    def __setitem__(self, prefix: str, value: Any):
+        node = self._node(normalize_prefix(prefix), create=True)
+        if node is self._root:
+            node.value = value
+            return
+        if node.value is _MISSING:
+            self._len += 1
+        node.value = value
+
+    def __getitem__(self, prefix: str) -> Any:
+        node = self._node(normalize_prefix(prefix))
+        if node is None or node.value is _MISSING or node is self._root:
+            raise KeyError(prefix)
+        return node.value
+
+    def __contains__(self, prefix: str) -> bool:
+        try:
+            self[prefix]
+        except (KeyError, ValueError):
+            return False
+        return True
+
+    def items(self) -> Iterable[Tuple[str, Any]]:
+        """Yield ``(prefix, value)`` for every route (excluding :attr:`.default`), parents before their children"""
+        todo = [self._root]
+        while todo:
+            node = todo.pop(0)
+            if node is not self._root and node.value is not _MISSING:
+                yield node.prefix, node.value
+            todo.extend(node.children.values())
+
+    def __iter__(self) -> Iterator[str]:
+        return (p for p, _ in self.items())
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return f"<{type(self).__name__} routes={list(self)!r}>"
@@ -0,0 +1,108 @@
+"""
+Timings and counters for each phase of turning an INI file into a policy - so a slow compile can be narrowed down to
+reading the config, resolving groups, expanding / de-duplicating sections, or rendering.
+
+Every :class:`.CSPBuilder` records a :class:`.BuildStats` as it works (a handful of :func:`time.perf_counter` calls per
+compile), and :meth:`.CSPBuilder.stats` returns them along with counters that are only computed when asked for::
+
+    >>> builder = CSPBuilder('site.ini')
+    >>> builder.compile()
+    >>> builder.stats()
+    {'timings': {'read': 0.412, 'resolve': 1.203, 'dedup': 0.655, 'validate': 0.201, 'render': 0.088},
+     'counters': {'bytes_read': 2841, 'markers_expanded': 57, 'max_depth': 3, 'tokens_before_dedup': 212, ...}}
+
+:func:`.compile_source` / :func:`.compile_policy` (used by the ``csp-gen`` command) add every builder's stats, plus
+compiled-cache hits and misses, to the process-wide :data:`.TOTALS` - which ``csp-gen --stats`` prints once it's done.
+``csp-gen --profile FILE`` dumps a :mod:`cProfile` profile of the whole run, for use with :mod:`pstats` / snakeviz.
+"""
+from time import perf_counter
+from typing import Dict, Union
+
+__all__ = ['PHASES', 'BuildStats', 'TOTALS', 'DETAILED']
+
+PHASES = ('read', 'resolve', 'hash', 'dedup', 'routes', 'validate', 'render')
+"""The phases timed by :class:`.CSPBuilder`, in the order they run"""
+
+
+class BuildStats:
+    """
+    Accumulates the time spent in each phase (in seconds), and named counters.
+
+        >>> stats = BuildStats()
+        >>> t = perf_counter()
+        >>> t = stats.lap('read', t)     # adds the time since t to 'read', and returns the current time
+        >>> stats.incr('markers_expanded', 4)
+    """
+    __slots__ = ('timings', 'counters')
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def lap(self, phase: str, since: float) -> float:
+        """Add the time elapsed since ``since`` (a :func:`time.perf_counter` value) to ``phase``, and return the current time"""
+        now = perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + (now - since)
+        return now
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def peak(self, name: str, value: int):
+        """Set the counter ``name`` to ``value``, if it's higher than the current value"""
+        if value > self.counters.get(name, 0):
+            self.counters[name] = value
+
+    def merge(self, other: Union['BuildStats', dict]):
+        """
+        Add the timings and counters of ``other`` (a :class:`.BuildStats`, or the output of :meth:`.as_dict`) to these -
+        except ``max_*`` counters, which keep the highest value
+        """
+        if isinstance(other, dict):
+            timings = {k: v / 1000 for k, v in other.get('timings', {}).items()}
+            counters = other.get('counters', {})
+        else:
+            timings, counters = other.timings, other.counters
+        for k, v in timings.items():
+            self.timings[k] = self.timings.get(k, 0.0) + v
+        for k, v in counters.items():
+            if k.startswith('max_'):
+                self.peak(k, v)
+            else:
+                self.incr(k, v)
+        return self
+
+    def as_dict(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """Return ``{'timings': {phase: milliseconds}, 'counters': {name: value}}``, with phases in :data:`.PHASES` order"""
+        order = {p: i for i, p in enumerate(PHASES)}
+        timings = sorted(self.timings.items(), key=lambda kv: order.get(kv[0], len(order)))
+        return {'timings': {k: round(v * 1000, 3) for k, v in timings}, 'counters': dict(sorted(self.counters.items()))}
+
+    def format(self) -> str:
+        """Render the timings (with their share of the total) and counters as an aligned, human readable table"""
+        d = self.as_dict()
+        total = sum(d['timings'].values())
+        lines = ['Timings:']
+        for k, v in d['timings'].items():
+            lines.append(f"    {k:<10} {v:>12.3f} ms  {(v / total * 100) if total else 0:5.1f}%")
+        lines.append(f"    {'total':<10} {total:>12.3f} ms")
+        lines.append('Counters:')
+        lines.extend(f"    {k:<28} {v:>12}" for k, v in d['counters'].items())
+        return '\n'.join(lines)
+
+    def clear(self):
+        self.timings.clear()
+        self.counters.clear()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.as_dict()!r}>"
+
+
+TOTALS = BuildStats()
+"""The stats of every builder compiled by :func:`.compile_source` / :func:`.compile_policy` in this process, plus cache hits / misses"""
+
+DETAILED = False
+"""
+When ``True``, :data:`.TOTALS` also collects the counters which :meth:`.CSPBuilder.stats` computes on demand (nesting
+depth, tokens before / after de-duplication) - set by ``csp-gen --stats``, as computing them re-expands every section
+"""
@@ -0,0 +1,448 @@
+"""
+Validates cleaned configs against the CSP Level 3 grammar - directive names, and every source expression - so typos
+such as ``self`` (missing quotes), ``'self`` (missing closing quote), ``htps//cdn.privex.io`` or ``[img-scr]`` are
+caught when the policy is generated, rather than showing up as browser console errors in production.
+
+Validation runs as part of :meth:`.CSPBuilder.clean`. By default, issues are logged as warnings - set
+``validate = strict`` in the ``[cspgen]`` section (or pass ``validate='strict'`` to :class:`.CSPBuilder`) to raise
+:class:`.PolicyValidationError` instead, or ``off`` to disable validation (an argument passed to :class:`.CSPBuilder`
+takes precedence over the INI). ``csp-gen --validate`` checks INI files without outputting policies, for use in CI.
+
+Issues are reported with the file and line the bad token was written on - following ``{{markers}}`` back to the group
+which contains the token, and into base INI files.
+
+Plain scheme / host sources are accepted by the optimizer's patterns (already compiled when the builder is imported),
+and the stricter regexes - needed for paths, uncommon directives and invalid tokens - are only compiled when first
+used. The check for each kind of directive is picked from a table built at import time, and the result for each
+distinct token, and each distinct source list, is cached for the life of the process. So validating thousands of INIs
+which share most of their sources only checks each source once, and re-validating a config whose sections haven't
+changed (e.g. a registry recompiling an evicted tenant) is a dict lookup per directive. Configs served from the
+:class:`.PolicyCache` aren't re-validated at all, as they were validated when they were first compiled.
+"""
+import logging
+import re
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from privex.cspgen.optimize import re_host, re_scheme
+from privex.cspgen.routes import ROUTE_SEP, is_route, split_route
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'SOURCE_LIST_DIRECTIVES', 'KNOWN_DIRECTIVES', 'SECTION_OPTIONS', 'ValidationIssue', 'check_directive', 'check_token',
+    'check_sources', 'line_index', 'validate_builder', 'format_issues', 'validate_source', 'validate_sources'
+]
+
+SOURCE_LIST_DIRECTIVES = frozenset({
+    'default-src', 'script-src', 'script-src-elem', 'script-src-attr', 'style-src', 'style-src-elem', 'style-src-attr',
+    'img-src', 'font-src', 'connect-src', 'media-src', 'object-src', 'frame-src', 'child-src', 'worker-src',
+    'manifest-src', 'prefetch-src', 'base-uri', 'form-action', 'frame-ancestors', 'navigate-to',
+})
+"""Directives whose value is a list of source expressions"""
+
+NO_VALUE_DIRECTIVES = frozenset({'upgrade-insecure-requests', 'block-all-mixed-content'})
+"""Directives which take no value - these belong in ``[flags]``"""
+
+OTHER_DIRECTIVES = frozenset({
+    'sandbox', 'report-uri', 'report-to', 'trusted-types', 'require-trusted-types-for', 'plugin-types', 'require-sri-for',
+})
+
+KNOWN_DIRECTIVES = SOURCE_LIST_DIRECTIVES | NO_VALUE_DIRECTIVES | OTHER_DIRECTIVES
+
+SECTION_OPTIONS = frozenset({'zones', 'unsafe-inline', 'unsafe-eval', 'nonce'})
+"""The keys CSPGen understands within a directive section"""
+
+KEYWORDS = frozenset({
+    "'self'", "'none'", "'unsafe-inline'", "'unsafe-eval'", "'strict-dynamic'", "'unsafe-hashes'", "'report-sample'",
+    "'unsafe-allow-redirects'", "'wasm-unsafe-eval'",
+})
+
+SANDBOX_TOKENS = frozenset({
+    'allow-downloads', 'allow-forms', 'allow-modals', 'allow-orientation-lock', 'allow-pointer-lock', 'allow-popups',
+    'allow-popups-to-escape-sandbox', 'allow-presentation', 'allow-same-origin', 'allow-scripts',
+    'allow-storage-access-by-user-activation', 'allow-top-navigation', 'allow-top-navigation-by-user-activation',
+    'allow-top-navigation-to-custom-protocols',
+})
+
+_HASH_LENGTHS = {'sha256': 44, 'sha384': 64, 'sha512': 88}
+
+
+class _LazyRe:
+    """
+    A regex which is only compiled the first time it's used - for the patterns that are only needed by uncommon tokens,
+    invalid tokens or error locations, so that validating an ordinary config doesn't pay to compile them
+    """
+    __slots__ = ('pattern', '_re')
+
+    def __init__(self, pattern: str):
+        self.pattern, self._re = pattern, None
+
+    def match(self, string: str):
+        if self._re is None:
+            self._re = re.compile(self.pattern)
+        return self._re.match(string)
+
+
+_re_scheme_source = _LazyRe(r"[A-Za-z][A-Za-z0-9+.\-]*:\Z")
+_re_host_source = _LazyRe(
+    r"(?:[A-Za-z][A-Za-z0-9+.\-]*://)?"
+    r"(?:\*|(?:\*\.)?[A-Za-z0-9\-]+(?:\.[A-Za-z0-9\-]+)*)"
+    r"(?::(?:[0-9]+|\*))?"
+    r"(?:/(?:[A-Za-z0-9\-._~!$&'()*+=:@]|%[0-9A-Fa-f]{2})*)*\Z"
+)
+_re_missing_colon = _LazyRe(r"[A-Za-z][A-Za-z0-9+\-]*//")
+_re_bad_port = _LazyRe(r"(?:[A-Za-z][A-Za-z0-9+.\-]*://)?[^/:]+:(?!/|[0-9]+(?:/|\Z)|\*(?:/|\Z))")
+_re_nonce = _LazyRe(r"'nonce-[A-Za-z0-9+/_\-]+={0,2}'\Z")
+_re_hash = _LazyRe(r"'(sha256|sha384|sha512)-([A-Za-z0-9+/_\-]+={0,2})'\Z")
+_re_report_to = _LazyRe(r"[A-Za-z0-9!#$%&*+.^_`|~\-]+\Z")
+_re_uri = _LazyRe(r"[^\s;,'\"]+\Z")
+_re_mime = _LazyRe(r"[A-Za-z0-9!#$&^_.+\-]+/[A-Za-z0-9!#$&^_.+\-]+\Z")
+_re_tt_policy = _LazyRe(r"[A-Za-z0-9\-#=_/@.%]+\Z")
+
+_re_section = _LazyRe(r'\[([^\]]+)\]')
+_re_key = _LazyRe(r'([^=:\s][^=:]*?)\s*[=:]')
+
+ERROR, WARNING = 'error', 'warning'
+
+_token_cache: Dict[Tuple[str, str], Optional[Tuple[str, str]]] = {}
+_directive_cache: Dict[str, Optional[Tuple[str, str]]] = {}
+_sources_cache: Dict[Tuple[str, Tuple[str, ...]], Tuple[Tuple[str, Tuple[str, str]], ...]] = {}
+_MAX_CACHE = 200000
+
+
+class ValidationIssue(NamedTuple):
+    """A single problem found by :func:`.validate_builder`"""
+    severity: str
+    """``error`` (the browser will reject or misread it) or ``warning`` (valid, but almost certainly a mistake)"""
+    message: str
+    section: str
+    key: Optional[str] = None
+    token: Optional[str] = None
+    file: Optional[str] = None
+    line: Optional[int] = None
+
+    def __str__(self):
+        where = f"{self.file or '<string>'}:{self.line}" if self.line else (self.file or '<string>')
+        key = f" {self.key}" if self.key else ''
+        return f"{where}: {self.severity}: [{self.section}]{key}: {self.message}"
+
+
+def check_directive(name: str) -> Optional[Tuple[str, str]]:
+    """Return ``(severity, message)`` if ``name`` isn't a known CSP directive (cached per name), otherwise ``None``"""
+    if name in _directive_cache:
+        return _directive_cache[name]
+    res = None
+    if name not in KNOWN_DIRECTIVES:
+        near = [d for d in KNOWN_DIRECTIVES if _close(name, d)]
+        res = (ERROR, f"unknown directive {name!r}" + (f" - did you mean {sorted(near)[0]!r}?" if near else ''))
+    elif name in NO_VALUE_DIRECTIVES:
+        res = (WARNING, f"{name!r} takes no sources - put it in [flags] instead")
+    _directive_cache[name] = res
+    return res
+
+
+def _close(a: str, b: str) -> bool:
+    """``True`` if ``a`` and ``b`` are within one edit (or one transposition) of each other"""
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    return any(b[:i] + b[i + 1:] == a for i in range(len(b)))
+
+
+def _check_source(token: str) -> Optional[Tuple[str, str]]:
+    if token == '*':
+        return None
+    if token.startswith("'"):
+        if token in KEYWORDS or _re_nonce.match(token):
+            return None
+        m = _re_hash.match(token)
+        if m:
+            expected = _HASH_LENGTHS[m.group(1)]
+            if len(m.group(2)) != expected:
+                return ERROR, f"{m.group(1)} hash should be {expected} base64 characters, not {len(m.group(2))}: {token}"
+            return None
+        if len(token) == 1 or not token.endswith("'"):
+            return ERROR, f"missing closing quote: {token}"
+        return ERROR, f"unknown keyword source {token}"
+    if token.endswith("'"):
+        return ERROR, f"missing opening quote: {token}"
+    if "'" + token + "'" in KEYWORDS:
+        return ERROR, f"keyword sources must be quoted - use '{token}' rather than {token}"
+    if '{{' in token or '}}' in token:
+        return ERROR, f"unresolved marker: {token}"
+    # Most tokens are scheme sources or host sources without a path, which the optimizer's (already compiled) patterns
+    # accept exactly as the stricter patterns below would - so those are only compiled for paths and invalid tokens
+    if re_scheme.match(token):
+        return None
+    m = re_host.match(token)
+    if m is not None and not m.group('path'):
+        return None
+    if _re_missing_colon.match(token):
+        return ERROR, f"missing ':' after the scheme: {token}"
+    if _re_scheme_source.match(token) or _re_host_source.match(token):
+        return None
+    if _re_bad_port.match(token):
+        return ERROR, f"invalid port in source expression: {token}"
+    return ERROR, f"invalid source expression: {token}"
+
+
+def _err(test, message: str):
+    """Build a token check which returns ``(ERROR, message)`` (formatted with the token) when ``test(token)`` is false"""
+    return lambda token: None if test(token) else (ERROR, message.format(token=token))
+
+
+_TOKEN_CHECKS = {
+    'source': _check_source,
+    'sandbox': _err(SANDBOX_TOKENS.__contains__, "unknown sandbox token {token!r}"),
+    'report-uri': _err(_re_uri.match, "invalid report-uri URL: {token}"),
+    'report-to': _err(_re_report_to.match, "invalid report-to group name: {token}"),
+    'plugin-types': _err(_re_mime.match, "invalid MIME type: {token}"),
+    'require-trusted-types-for': _err("'script'".__eq__, "require-trusted-types-for only accepts 'script', not {token}"),
+    'trusted-types': _err(
+        lambda t: t in ("'none'", "'allow-duplicates'", '*') or _re_tt_policy.match(t), "invalid trusted-types policy name: {token}"
+    ),
+    'require-sri-for': _err(('script', 'style', 'script-style').__contains__, "invalid require-sri-for value: {token}"),
+}
+"""Maps each kind of directive (``source`` for every source list directive) to the function which checks it's tokens"""
+
+
+def _kind(directive: str) -> str:
+    return 'source' if directive in SOURCE_LIST_DIRECTIVES else directive
+
+
+def check_token(token: str, directive: str = 'default-src') -> Optional[Tuple[str, str]]:
+    """
+    Check a single value token of ``directive``, returning ``(severity, message)`` if it's invalid, otherwise ``None``.
+    The result is cached per distinct token (and kind of directive), so each token is only ever checked once.
+    """
+    kind = _kind(directive)
+    key = (kind, token)
+    try:
+        return _token_cache[key]
+    except KeyError:
+        pass
+    check = _TOKEN_CHECKS.get(kind)
+    res = None if check is None else check(token)
+    if len(_token_cache) >= _MAX_CACHE:
+        _token_cache.clear()
+    _token_cache[key] = res
+    return res
+
+
+def check_sources(sources: Tuple[str, ...], directive: str = 'default-src') -> Tuple[Tuple[str, Tuple[str, str]], ...]:
+    """
+    Check every token of the source list ``sources`` (e.g. a :class:`.SourceList`) of ``directive``, returning
+    ``(token, (severity, message))`` for each invalid token. The result is cached per distinct source list (and kind
+    of directive), so a source list which has already been checked costs a single dict lookup.
+    """
+    key = (_kind(directive), sources)
+    try:
+        return _sources_cache[key]
+    except KeyError:
+        pass
+    res = tuple((t, r) for t, r in ((t, check_token(t, directive)) for t in sources) if r is not None)
+    if len(_sources_cache) >= _MAX_CACHE:
+        _sources_cache.clear()
+    _sources_cache[key] = res
+    return res
+
+
+def line_index(lines: Iterable[str]) -> Dict[str, Dict[str, Tuple[int, int]]]:
+    """
+    Map each INI section to ``{key: (first_line, last_line)}`` (1-indexed, covering multi-line values) - the section
+    header's own line is stored under the key ``''``. Keys are lowercased, the same as :class:`configparser.ConfigParser`.
+    """
+    idx: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    section, key = None, None
+    for n, line in enumerate(lines, start=1):
+        stripped = line.strip()
+        if not stripped or stripped[0] in '#;':
+            continue
+        if line[0].isspace() and section is not None and key is not None:
+            idx[section][key] = (idx[section][key][0], n)
+            continue
+        m = _re_section.match(line)
+        if m:
+            section, key = m.group(1), None
+            idx.setdefault(section, {})[''] = (n, n)
+            continue
+        m = _re_key.match(line)
+        if m and section is not None:
+            key = m.group(1).strip().lower()
+            idx[section][key] = (n, n)
+    return idx
+
+
+def _exact_line(path: Optional[Path], span: Tuple[int, int], token: Optional[str], within: bool = False) -> int:
+    """
+    Narrow a key's ``(first, last)`` line span down to the line containing ``token`` (as a whole token, or anywhere
+    within the line if ``within`` is True), by re-reading the file
+    """
+    first, last = span
+    if path is None or token is None or first == last:
+        return first
+    try:
+        with open(path) as fh:
+            for n, line in enumerate(fh, start=1):
+                if n >= first and (token in line if within else token in line.split()):
+                    return n
+                if n >= last:
+                    break
+    except OSError:
+        pass
+    return first
+
+
+def _locate(builder, section: str, key: Optional[str], token: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Find the file and line where ``token`` was written - in ``section`` / ``key`` itself, in a group it's markers pull
+    in, or in a base INI file the builder extends.
+    """
+    b = builder
+    while b is not None:
+        lines = getattr(b, '_lines', None) or {}
+        path = None if b.conf_file is None else str(b.conf_file)
+        raw = b._raw.get(section, {})
+        if key is not None and key in raw and (token is None or token in raw[key].split()):
+            span = lines.get(section, {}).get(key)
+            return path, None if span is None else _exact_line(b.conf_file, span, token)
+        if token is not None:
+            for g, v in b._raw.get('groups', {}).items():
+                if token in v.split():
+                    span = lines.get('groups', {}).get(g)
+                    return path, None if span is None else _exact_line(b.conf_file, span, token)
+        if token is None and section in lines:
+            return path, lines[section].get(key or '', lines[section][''])[0]
+        b = b.base
+    span = (getattr(builder, '_lines', None) or {}).get(section, {}).get(key or '')
+    return (None if builder.conf_file is None else str(builder.conf_file)), (None if span is None else span[0])
+
+
+def _chain(builder) -> Iterable:
+    """Yield ``builder``, then the base it extends, the base's base, and so on"""
+    while builder is not None:
+        yield builder
+        builder = builder.base
+
+
+def validate_builder(builder) -> List[ValidationIssue]:
+    """
+    Validate the cleaned directives and flags of a :class:`.CSPBuilder`, returning every issue found (errors and warnings)
+    """
+    issues = []
+
+    def add(res, section, key=None, token=None):
+        file, line = _locate(builder, section, key, token)
+        issues.append(ValidationIssue(res[0], res[1], section, key, token, file, line))
+
+    def check(name, d, section, skip=()):
+        res = check_directive(name)
+        if res is not None:
+            add(res, section)
+        for k, _ in d.options:
+            if k not in SECTION_OPTIONS:
+                add((WARNING, f"unknown key {k!r} is ignored (CSPGen understands: {', '.join(sorted(SECTION_OPTIONS))})"), section, k)
+        if d.sources is None:
+            return
+        for token, res in check_sources(d.sources, name):
+            if token not in skip:
+                add(res, section, 'zones', token)
+        if "'none'" in d.sources and len(d.sources) > 1:
+            add((WARNING, "'none' is ignored when combined with other sources"), section, 'zones', "'none'")
+
+    for name, d in builder.directives.items():
+        if name not in builder.excluded:
+            check(name, d, name)
+    # Route sections ([directive@/prefix]) - tokens inherited from the main directive have already been checked above
+    sections = {}
+    for b in _chain(builder):
+        for k in b._raw:
+            if is_route(k): sections.setdefault(split_route(k), k)
+    for prefix, dirs in builder.routes.items():
+        for name, d in dirs.items():
+            section = sections.get((name, prefix), f"{name}{ROUTE_SEP}{prefix}")
+            if name == 'flags':
+                for token in d.sources:
+                    if token not in KNOWN_DIRECTIVES and token not in builder.flag_sources:
+                        add((ERROR, f"unknown flag {token!r}"), section, 'flags', token)
+                continue
+            main = builder.directives.get(name)
+            check(name, d, section, skip=(main.sources or ()) if main is not None else ())
+    # Markers were found while loading each INI (see privex.cspgen.loader) - keys overridden by an INI which extends
+    # a base are skipped in the base
+    seen, b = set(), builder
+    while b is not None:
+        path = None if b.conf_file is None else str(b.conf_file)
+        for section, keys in (getattr(b, '_markers', None) or {}).items():
+            if section in ('cspgen', 'DEFAULT'):
+                continue
+            for key, names in keys.items():
+                if (section, key) in seen:
+                    continue
+                seen.add((section, key))
+                for m in dict.fromkeys(names):
+                    if m in builder.resolver:
+                        continue
+                    span = (getattr(b, '_lines', None) or {}).get(section, {}).get(key)
+                    line = None if span is None else _exact_line(b.conf_file, span, '{{' + m + '}}', within=True)
+                    issues.append(ValidationIssue(
+                        ERROR, f"undefined marker {{{{{m}}}}} - there's no such group", section, key, '{{' + m + '}}', path, line
+                    ))
+        b = b.base
+    for token in builder.flag_sources:
+        if token not in KNOWN_DIRECTIVES:
+            add((ERROR, f"unknown flag {token!r}"), 'flags', 'flags', token)
+    return issues
+
+
+def format_issues(issues: Iterable[ValidationIssue]) -> str:
+    return '\n'.join(str(i) for i in issues)
+
+
+def validate_source(source: Union[str, List[str], Tuple[str, ...]], **kwargs) -> List[ValidationIssue]:
+    """
+    Load and validate an INI file (or list of INI lines), returning it's issues. A config which can't be parsed at all
+    is returned as a single error.
+
+    This is a plain top-level function, so that it can be used with a :class:`concurrent.futures.ProcessPoolExecutor`.
+    """
+    from privex.cspgen.builder import CSPBuilder
+    file = 'stdin' if isinstance(source, (list, tuple)) else str(source)
+    # Passed explicitly, so it overrides 'validate = strict' in [cspgen] - the issues are returned rather than raised
+    kwargs['validate'] = 'off'
+    try:
+        builder = CSPBuilder(contents=list(source), **kwargs) if isinstance(source, (list, tuple)) else CSPBuilder(source, **kwargs)
+        builder.clean()
+    except Exception as e:
+        return [ValidationIssue(ERROR, f"failed to load config - {type(e).__name__}: {e}", 'cspgen', file=file)]
+    return validate_builder(builder)
+
+
+def validate_sources(sources: List[Union[str, List[str]]], jobs: int = 1, out=None, **kwargs) -> int:
+    """
+    Validate each INI file / list of lines in ``sources`` (across ``jobs`` processes), writing every issue to ``out``
+    (default: stdout), followed by a summary line.
+
+    :return int errors: The number of errors found (warnings aren't counted)
+    """
+    import sys
+    from functools import partial
+    from privex.cspgen.builder import _parallel_map
+    out = sys.stdout if out is None else out
+    errors = warnings = 0
+    for issues in _parallel_map(partial(validate_source, **kwargs), sources, jobs):
+        for issue in issues:
+            out.write(f"{issue}\n")
+            if issue.severity == ERROR:
+                errors += 1
+            else:
+                warnings += 1
+    out.write(f"Checked {len(sources)} config(s): {errors} error(s), {warnings} warning(s)\n")
+    out.flush()
+    return errors
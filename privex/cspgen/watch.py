@@ -0,0 +1,268 @@
+"""
+Watch mode for the ``csp-gen`` CLI - recompiles INI files when they change, and atomically rewrites the output file(s).
+
+On Linux, file changes are detected using inotify (via :mod:`ctypes`, no extra dependencies needed), watching the folders
+containing each INI file, so that editors which save by renaming a temporary file over the original are handled.
+On other platforms, or if inotify is unavailable, the files' mtime/size are polled instead.
+
+    csp-gen --watch -o '/etc/nginx/csp/{name}.conf' --reload-cmd 'nginx -s reload' sites/*.ini
+
+"""
+import abc
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from privex.cspgen.builder import compile_source, find_extends
+from privex.cspgen.helpers import atomic_write
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'Watcher', 'PollWatcher', 'InotifyWatcher', 'get_watcher', 'write_output', 'output_path', 'FileCompiler',
+    'run_reload_cmd', 'watch_files'
+]
+
+NAME_MARKER = '{name}'
+"""Placeholder within an output path, which is replaced with the INI file's name (without the extension)"""
+
+
+class Watcher(abc.ABC):
+    """Base class for file watchers. :meth:`.wait` blocks until at least one of :attr:`.paths` changes."""
+    def __init__(self, paths: Iterable[Path]):
+        self.paths: Set[Path] = {Path(p).resolve() for p in paths}
+
+    @abc.abstractmethod
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Wait up to ``timeout`` seconds (forever if ``None``) for changes, returning the set of changed paths (may be empty)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollWatcher(Watcher):
+    """Detects changes by polling each file's ``(st_mtime_ns, st_size)`` every ``interval`` seconds"""
+    def __init__(self, paths: Iterable[Path], interval: float = 1.0):
+        super().__init__(paths)
+        self.interval = interval
+        self.stats = {p: self._stat(p) for p in self.paths}
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            st = path.stat()
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for p in self.paths:
+                st = self._stat(p)
+                if st != self.stats[p]:
+                    self.stats[p] = st
+                    changed.add(p)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            wait = self.interval if deadline is None else max(0.0, min(self.interval, deadline - time.monotonic()))
+            time.sleep(wait)
+
+
+class InotifyWatcher(Watcher):
+    """Detects changes using Linux inotify, watching the parent folder of each file"""
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _event = struct.Struct('iIII')
+
+    def __init__(self, paths: Iterable[Path]):
+        super().__init__(paths)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this system")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, Path] = {}
+        for d in {p.parent for p in self.paths}:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(str(d)), self.MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {d}")
+            self.dirs[wd] = d
+
+    def _read(self) -> Set[Path]:
+        changed = set()
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        i, esize = 0, self._event.size
+        while i + esize <= len(buf):
+            wd, mask, cookie, nlen = self._event.unpack_from(buf, i)
+            name = buf[i + esize:i + esize + nlen].rstrip(b'\0')
+            i += esize + nlen
+            if wd in self.dirs and name:
+                p = self.dirs[wd] / os.fsdecode(name)
+                if p in self.paths:
+                    changed.add(p)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            r, _, _ = select.select([self.fd], [], [], remaining)
+            if not r:
+                return set()
+            changed = self._read()
+            # Events for other files in the same folder are ignored - keep waiting until the timeout
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(paths: Iterable[Path], poll_interval: float = 1.0, use_inotify: bool = True) -> Watcher:
+    """Return an :class:`.InotifyWatcher` if inotify is available (and ``use_inotify`` is True), otherwise a :class:`.PollWatcher`"""
+    paths = list(paths)
+    if use_inotify:
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as e:
+            log.info("inotify unavailable (%s: %s) - falling back to polling every %s seconds", type(e).__name__, e, poll_interval)
+    return PollWatcher(paths, interval=poll_interval)
+
+
+def write_output(path: Union[str, Path], data: str) -> bool:
+    """Atomically write ``data`` (plus a trailing newline) to ``path``, logging (rather than raising) any errors"""
+    try:
+        atomic_write(path, data + '\n')
+    except OSError as e:
+        log.error("Failed to write %s - reason: %s - %s", path, type(e).__name__, e)
+        return False
+    log.info("Wrote CSP policy to %s", path)
+    return True
+
+
+def output_path(template: str, filename: str) -> Path:
+    """Replace ``{name}`` in the output path ``template`` with the name of ``filename`` (without it's extension)"""
+    return Path(template.replace(NAME_MARKER, Path(filename).stem))
+
+
+class FileCompiler:
+    """
+    Compiles a set of INI files into one or more output files, keeping each file's latest compiled policy so that
+    only changed files need recompiling.
+
+    If ``output`` contains ``{name}``, each INI file is written to it's own output file. Otherwise, all of the
+    policies are joined using ``file_sep`` and written to the single file ``output``.
+    """
+    def __init__(self, filenames: List[str], output: str, sep: str = ' ', file_sep: str = '\n\n', **builder_kwargs):
+        self.filenames = [str(Path(f).resolve()) for f in filenames]
+        self.output, self.sep, self.file_sep = output, sep, file_sep
+        self.builder_kwargs = builder_kwargs
+        self.per_file = NAME_MARKER in output
+        self.policies: Dict[str, str] = {}
+
+    def bases(self) -> List[str]:
+        """Return the base INI files which any of :attr:`.filenames` extend (excluding files which are also in :attr:`.filenames`)"""
+        found = {}
+        for fn in self.filenames:
+            try:
+                data = Path(fn).read_bytes()
+            except OSError:
+                continue
+            found.update(dict.fromkeys(str(p) for p in find_extends(data, Path(fn).parent)))
+        return [p for p in found if p not in self.filenames]
+
+    def compile(self, filenames: Iterable[str] = None) -> bool:
+        """
+        (Re-)compile ``filenames`` (default: all files), then atomically write the affected output file(s).
+
+        :return bool ok: ``True`` if every file compiled and was written successfully
+        """
+        filenames = self.filenames if filenames is None else [str(Path(f).resolve()) for f in filenames]
+        ok, written = True, []
+        for fn in filenames:
+            try:
+                self.policies[fn] = compile_source(fn, self.sep, **self.builder_kwargs)[0]
+            except Exception as e:
+                log.error("Failed to compile %s - keeping previous output. Reason: %s - %s", fn, type(e).__name__, e)
+                ok = False
+                continue
+            if self.per_file:
+                written.append(write_output(output_path(self.output, fn), self.policies[fn]))
+        if not self.per_file and all(fn in self.policies for fn in self.filenames):
+            written.append(write_output(Path(self.output), self.file_sep.join(self.policies[fn] for fn in self.filenames)))
+        return ok and all(written)
+
+
+def run_reload_cmd(cmd: str) -> bool:
+    """Run the shell command ``cmd`` (e.g. ``nginx -s reload``), returning ``True`` if it exited successfully"""
+    res = subprocess.run(cmd, shell=True)
+    if res.returncode != 0:
+        log.error("Reload command %r exited with status %d", cmd, res.returncode)
+        return False
+    return True
+
+
+def watch_files(filenames: List[str], output: str, sep: str = ' ', file_sep: str = '\n\n', debounce: float = 0.5,
+                reload_cmd: str = None, poll_interval: float = 1.0, use_inotify: bool = True, **builder_kwargs):
+    """
+    Compile ``filenames`` into ``output`` (see :class:`.FileCompiler`), then watch the files forever, recompiling
+    each file when it changes.
+
+    Bursts of changes are debounced - after a change is detected, we wait until no further changes have happened for
+    ``debounce`` seconds before recompiling. After each successful write, ``reload_cmd`` is ran (if set).
+
+    Base INI files (``extends``) are watched too - when a base changes, every file is recompiled. The bases are
+    re-scanned after each recompile, so that newly added (or changed) ``extends`` are picked up.
+    """
+    compiler = FileCompiler(filenames, output, sep=sep, file_sep=file_sep, **builder_kwargs)
+    if compiler.compile() and reload_cmd:
+        run_reload_cmd(reload_cmd)
+    bases = compiler.bases()
+    watcher = get_watcher([Path(f) for f in compiler.filenames + bases], poll_interval=poll_interval, use_inotify=use_inotify)
+    log.info("Watching %d file(s) for changes using %s", len(compiler.filenames) + len(bases), type(watcher).__name__)
+    try:
+        while True:
+            pending = watcher.wait()
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                pending |= more
+            log.info("Detected changes to: %s", ', '.join(str(p) for p in sorted(pending)))
+            changed = sorted(str(p) for p in pending)
+            if any(p not in compiler.filenames for p in changed):
+                changed = None
+            if compiler.compile(changed) and reload_cmd:
+                run_reload_cmd(reload_cmd)
+            new_bases = compiler.bases()
+            if set(new_bases) != set(bases):
+                bases = new_bases
+                watcher.close()
+                watcher = get_watcher(
+                    [Path(f) for f in compiler.filenames + bases], poll_interval=poll_interval, use_inotify=use_inotify
+                )
+                log.info("Base INI files changed - now watching %d file(s)", len(compiler.filenames) + len(bases))
+    except KeyboardInterrupt:
+        log.info("Received interrupt - no longer watching files.")
+    finally:
+        watcher.close()
@@ -56,7 +56,7 @@ setup(
     install_requires=[
         'privex-helpers>=3.2.0', 'privex-loghelper>1.0.0', 'rich', 'colorama'
     ],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
     scripts=['bin/csp-gen', 'bin/cspgen', 'bin/gen-csp'],
     include_package_data=True,
     classifiers=[
@@ -0,0 +1,129 @@
+"""
+Tests for :mod:`privex.cspgen.evaluate` - URL splitting, matching URLs against a directive's indexes, and evaluating a
+log file split into byte ranges.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from privex.cspgen.evaluate import DirectiveMatcher, EvaluationResult, PolicyEvaluator, evaluate_file, split_url
+
+CONFIG = """
+[default-src]
+zones = 'self'
+
+[img-src]
+zones = 'self' https://*.privex.io cdn.example.com:8080/img/ data:
+
+[script-src]
+zones = 'self' https://cdn.example.com/js/app.js https://static.example.com/js/
+"""
+
+LOG = [
+    "img-src https://files.privex.io/a.png",
+    "img-src https://privex.io/a.png",
+    "img-src https://cdn.example.com:8080/img/logo.png",
+    "img-src https://cdn.example.com/img/logo.png",
+    "img-src data:image/png;base64,AAAA",
+    "script-src https://cdn.example.com/js/app.js",
+    "script-src https://cdn.example.com/js/other.js",
+    "script-src https://static.example.com/js/deep/lib.js",
+    "script-src https://www.privex.io/main.js",
+    "font-src https://fonts.example.com/a.woff2",
+    "not-a-pair",
+]
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTPS://User@CDN.Privex.io:443/js/app.js?v=2', ('https', 'cdn.privex.io', None, '/js/app.js')),
+    ('http://example.com:8080/a#frag', ('http', 'example.com', 8080, '/a')),
+    ('https://example.com.', ('https', 'example.com', None, '/')),
+    ('https://[::1]:8443/x', ('https', '[::1]', 8443, '/x')),
+    ('data:image/png;base64,AAAA', ('data', '', None, 'image/png;base64,AAAA')),
+    ('no-scheme/path', None),
+    ('https://example.com:http/', None),
+    ('https:///path', None),
+    ('https://[::1/x', None),
+])
+def test_split_url(url, expected):
+    assert split_url(url) == expected
+
+
+def test_matcher_suffix_trie():
+    m = DirectiveMatcher(['https://*.privex.io', '*.a.example.com'])
+    assert m.allows('https://files.privex.io/x') and m.allows('https://a.b.privex.io/x')
+    assert not m.allows('https://privex.io/x')
+    assert not m.allows('https://evilprivex.io/x')
+    assert not m.allows('http://files.privex.io/x')
+    # Scheme-less wildcards match the page's scheme (https: when there's no origin)
+    assert m.allows('https://b.a.example.com/') and not m.allows('https://a.example.com/')
+
+
+def test_matcher_ports():
+    m = DirectiveMatcher(['https://cdn.example.com:8443', 'https://any.example.com:*', 'https://plain.example.com'])
+    assert m.allows('https://cdn.example.com:8443/a')
+    assert not m.allows('https://cdn.example.com/a')
+    assert m.allows('https://any.example.com:1234/a') and m.allows('https://any.example.com/a')
+    assert m.allows('https://plain.example.com:443/a')
+    assert not m.allows('https://plain.example.com:8443/a')
+
+
+def test_matcher_paths():
+    m = DirectiveMatcher(['https://cdn.example.com/js/', 'https://cdn.example.com/app.js'])
+    assert m.allows('https://cdn.example.com/js/a.js') and m.allows('https://cdn.example.com/js/sub/b.js')
+    assert m.allows('https://cdn.example.com/app.js')
+    assert not m.allows('https://cdn.example.com/app.js/x')
+    assert not m.allows('https://cdn.example.com/other.js')
+    assert not m.allows('https://cdn.example.com/jsx/a.js')
+
+
+def test_matcher_self():
+    m = DirectiveMatcher(["'self'"], 'http://www.privex.io')
+    assert m.allows('http://www.privex.io/a') and m.allows('https://www.privex.io/a')
+    assert not m.allows('https://privex.io/a')
+    assert not m.allows('http://www.privex.io:8080/a')
+    # Without an origin, 'self' never matches
+    assert not DirectiveMatcher(["'self'"]).allows('https://www.privex.io/a')
+
+
+def _evaluator() -> PolicyEvaluator:
+    from privex.cspgen.builder import CSPBuilder
+    return PolicyEvaluator.from_builder(CSPBuilder(contents=CONFIG.splitlines()), origin='https://www.privex.io')
+
+
+def _as_tuple(res: EvaluationResult):
+    return res.as_dict(100), res.total, res.invalid
+
+
+def test_evaluate_file_ranges_match_single_pass(tmp_path):
+    path = tmp_path / 'requests.log'
+    path.write_text('\n'.join(LOG) + '\n')
+    ev = _evaluator()
+    whole = evaluate_file(path, ev, chunk_size=1 << 20)
+    assert whole.counts == {
+        'img-src': [3, 2], 'script-src': [3, 1], 'font-src': [0, 1],
+    }
+    assert whole.invalid == 1
+    # Small chunks split most lines across ranges - every line must still be counted exactly once
+    for chunk_size in (1, 7, len(LOG[0]), len(LOG[0]) + 1, 64):
+        assert _as_tuple(evaluate_file(path, ev, chunk_size=chunk_size)) == _as_tuple(whole), chunk_size
+
+
+def test_evaluate_file_without_trailing_newline(tmp_path):
+    path = tmp_path / 'requests.log'
+    path.write_text('\n'.join(LOG))
+    ev = _evaluator()
+    expected = _as_tuple(evaluate_file(path, ev, chunk_size=1 << 20))
+    assert _as_tuple(evaluate_file(path, ev, chunk_size=10)) == expected
+
+
+def test_cli_evaluate_from_stdin(tmp_path):
+    path = tmp_path / 'requests.log'
+    path.write_text('\n'.join(LOG) + '\n')
+    res = subprocess.run(
+        [sys.executable, '-m', 'privex.cspgen', '--evaluate', str(path), '--origin', 'https://www.privex.io', '-'],
+        input=CONFIG, capture_output=True, text=True,
+    )
+    assert res.returncode == 0, res.stderr
+    assert 'img-src' in res.stdout and 'https://privex.io' in res.stdout
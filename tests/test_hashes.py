@@ -0,0 +1,46 @@
+"""
+Tests for hashing inline template blocks (:mod:`privex.cspgen.hashes`) - skipped dynamic blocks, and refusing to
+combine hashes with ``unsafe-inline``.
+"""
+import logging
+
+import pytest
+
+from privex.cspgen.builder import CSPBuilder
+from privex.cspgen.exceptions import HashConflictError
+from privex.cspgen.hashes import extract_inline, hash_source
+
+TEMPLATE = "<p>\n<script>alert(1)</script>\n<script>var x = {{ x }};</script>\n<style>p { color: {% c %} }</style>\n"
+
+
+def _builder(tmp_path, config: str) -> CSPBuilder:
+    (tmp_path / 'templates').mkdir(exist_ok=True)
+    (tmp_path / 'templates' / 'page.html').write_text(TEMPLATE)
+    (tmp_path / 'site.ini').write_text("[cspgen]\nhash-dirs = templates/\n" + config)
+    return CSPBuilder(str(tmp_path / 'site.ini'))
+
+
+def test_extract_inline_reports_skipped_blocks():
+    skipped = []
+    assert extract_inline(TEMPLATE, skipped) == (['alert(1)'], [])
+    assert sorted(skipped, key=lambda b: b[1]) == [('script', 3), ('style', 4)]
+
+
+def test_skipped_blocks_are_logged(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger='privex.cspgen.hashes'):
+        policy = _builder(tmp_path, "\n[default-src]\nzones = 'self'\n").generate('str')
+    assert hash_source('alert(1)') in policy
+    warned = [r.getMessage() for r in caplog.records if 'template syntax' in r.getMessage()]
+    assert len(warned) == 2
+    assert warned[0].startswith(f"{tmp_path / 'templates' / 'page.html'}:3 <script>")
+    assert warned[1].startswith(f"{tmp_path / 'templates' / 'page.html'}:4 <style>")
+
+
+def test_hashes_with_unsafe_inline_refused(tmp_path):
+    with pytest.raises(HashConflictError):
+        _builder(tmp_path, "\n[default-src]\nzones = 'self'\nunsafe-inline = true\n").generate('str')
+
+
+def test_hashes_with_unsafe_inline_opt_in(tmp_path):
+    policy = _builder(tmp_path, "hash-unsafe-inline = true\n\n[script-src]\nzones = 'self'\nunsafe-inline = true\n").generate('str')
+    assert hash_source('alert(1)') in policy and "'unsafe-inline'" in policy
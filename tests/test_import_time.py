@@ -0,0 +1,51 @@
+"""
+Checks the library import (``import privex.cspgen``) doesn't pull in any of the CLI's dependencies, and enforces a
+generous import-time budget (see :mod:`benchmarks.imports`).
+
+Wall-clock timings vary a lot between machines (especially shared CI runners), so the timing check only catches gross
+regressions - the module checks are what keep the import lean. The budget can be changed with the environment variable
+``CSPGEN_IMPORT_BUDGET_MS`` (``0`` skips the timing check), e.g. ``CSPGEN_IMPORT_BUDGET_MS=100 python3 -m pytest``
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.imports import CLI_ONLY_MODULES, check_import
+
+IMPORT_BUDGET_MS = float(os.getenv('CSPGEN_IMPORT_BUDGET_MS', 1000.0))
+"""The maximum median time ``import privex.cspgen`` may take, in milliseconds (env: ``CSPGEN_IMPORT_BUDGET_MS``)"""
+
+_SNIPPET = """
+import sys, json
+import privex.cspgen
+from privex.cspgen import builder
+print(json.dumps({'modules': sorted(sys.modules), 'parser': builder._parser is not None}))
+"""
+
+
+def _fresh_import() -> dict:
+    out = subprocess.run([sys.executable, '-c', _SNIPPET], capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+@pytest.mark.skipif(IMPORT_BUDGET_MS <= 0, reason="CSPGEN_IMPORT_BUDGET_MS is 0 - import timing check disabled")
+def test_import_within_budget():
+    problems = check_import(IMPORT_BUDGET_MS, repeat=5)
+    assert problems == []
+
+
+def test_import_loads_no_cli_modules():
+    res = _fresh_import()
+    for mod in ('rich', 'colorama', 'privex.loghelper', 'privex.helpers', 'argparse'):
+        assert mod not in res['modules'], f"import privex.cspgen loaded the CLI-only module {mod}"
+    assert not [m for m in CLI_ONLY_MODULES if m in res['modules']]
+
+
+def test_import_does_not_build_cli_parser():
+    # The ErrHelpParser (from privex.helpers) is only built when the CLI asks for it, via get_parser()
+    res = _fresh_import()
+    assert res['parser'] is False
+    assert 'privex.helpers' not in res['modules']
@@ -0,0 +1,29 @@
+"""
+Tests for :class:`privex.cspgen.helpers.MarkerResolver` reporting undefined markers.
+"""
+import logging
+
+import pytest
+
+from privex.cspgen.builder import CSPBuilder
+from privex.cspgen.exceptions import UndefinedMarkerError
+from privex.cspgen.helpers import MarkerResolver
+
+CONFIG = "[groups]\na = 'self'\n[default-src]\nzones = {{a}}\n"
+
+
+def test_strict_update_keeps_rejecting_undefined_marker():
+    builder = CSPBuilder(contents=CONFIG.splitlines(), strict=True)
+    assert builder.generate("str") == "default-src 'self';"
+    for _ in range(3):
+        with pytest.raises(UndefinedMarkerError):
+            builder.set_group('a', '{{nope}}')
+    assert builder.generate("str") == "default-src 'self';"
+
+
+def test_undefined_marker_warned_once(caplog):
+    with caplog.at_level(logging.WARNING, logger='privex.cspgen.helpers'):
+        r = MarkerResolver({'a': '{{nope}} x.com', 'b': '{{a}} {{nope}}'})
+        r.expand_tokens('{{nope}} {{b}}')
+    assert len([m for m in caplog.messages if 'Undefined marker {{nope}}' in m]) == 1
+    assert r['b'] == 'x.com'
@@ -0,0 +1,63 @@
+"""
+Tests for :class:`privex.cspgen.registry.PolicyRegistry` sharing compiled policies between tenants.
+"""
+from privex.cspgen.builder import CompiledPolicy
+from privex.cspgen.helpers import NONCE_SLOT
+from privex.cspgen.registry import PolicyRegistry
+
+PLAIN = "[script-src]\nzones = 'self'\n"
+NONCE = "[script-src]\nzones = 'self'\nnonce = true\n"
+
+
+def _registry(*tenants) -> PolicyRegistry:
+    registry = PolicyRegistry()
+    for host, contents in tenants:
+        registry.register(host, contents=contents)
+    return registry
+
+
+def test_nonce_tenant_registered_first():
+    registry = _registry(('a.com', NONCE), ('b.com', PLAIN))
+    a, b = registry.lookup('a.com'), registry.lookup('b.com')
+    assert a is not b
+    assert a.has_nonce and b'nonce-X' in a.render_nonce('X')
+    assert not b.has_nonce and b.render_nonce('X') == b"script-src 'self';"
+
+
+def test_nonce_tenant_registered_last():
+    registry = _registry(('b.com', PLAIN), ('a.com', NONCE))
+    b, a = registry.lookup('b.com'), registry.lookup('a.com')
+    assert a is not b
+    assert b'nonce-X' in a.render_nonce('X')
+    assert b.render_nonce('X') == b"script-src 'self';"
+    assert registry.stats()['distinct'] == 2
+
+
+def test_identical_tenants_share_policy():
+    registry = _registry(('a.com', NONCE), ('b.com', NONCE))
+    assert registry.lookup('a.com') is registry.lookup('b.com')
+    assert registry.stats()['distinct'] == 1
+
+
+def test_compiled_policy_equality_includes_nonce():
+    plain = CompiledPolicy({'script-src': "script-src 'self';"})
+    nonced = CompiledPolicy(
+        {'script-src': "script-src 'self';"}, nonce_directives={'script-src': f"script-src 'self' 'nonce-{NONCE_SLOT}';"}
+    )
+    assert plain != nonced
+    assert len({plain, nonced}) == 2
+    assert plain == CompiledPolicy({'script-src': "script-src 'self';"})
+
+
+def test_frequently_used_tenant_survives_eviction():
+    registry = PolicyRegistry(max_policies=2)
+    for i in range(5):
+        registry.register(f'site{i}.com', contents=f"[script-src]\nzones = https://cdn{i}.example.com\n")
+    hot = registry.lookup('site0.com')
+    for i in range(1, 5):
+        registry.lookup(f'site{i}.com')
+        # Looking up the hot tenant between every other tenant keeps it the most recently used, so it's never evicted
+        assert registry.lookup('site0.com') is hot
+    assert 'site0.com' in registry.compiled
+    assert registry.stats()['misses'] == 5
+    assert registry.evictions == 3
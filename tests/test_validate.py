@@ -0,0 +1,22 @@
+"""
+Tests for :func:`privex.cspgen.validate.validate_source` - used by ``csp-gen --validate``.
+"""
+import pytest
+
+from privex.cspgen.builder import CSPBuilder
+from privex.cspgen.exceptions import PolicyValidationError
+from privex.cspgen.validate import ERROR, validate_source
+
+STRICT = ["[cspgen]", "validate = strict", "", "[default-src]", "zones = self 'self'", "", "[img-scr]", "zones = 'self'"]
+
+
+def test_validate_source_lists_issues_of_strict_config():
+    issues = validate_source(STRICT)
+    assert [i.severity for i in issues] == [ERROR, ERROR]
+    assert not any('failed to load config' in i.message for i in issues)
+
+
+def test_explicit_validate_overrides_ini():
+    with pytest.raises(PolicyValidationError):
+        CSPBuilder(contents=STRICT).generate('str')
+    assert CSPBuilder(contents=STRICT, validate='off').generate('str') == "default-src self 'self'; img-scr 'self';"